@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer forward mode differentiation
+Runs the model components (PDLogistic, CatchFixed, EffortFixed, Economics) on
+dual numbers, which carry the derivatives of each value with respect to the
+parameters, to give the NPV, final biomass and equilibrium yield of a model
+and their gradients in one run rather than two runs per parameter for
+central finite differences.
+
+The model is not smooth everywhere, the derivatives at the kinks are:
+- A catch greater than the biomass takes the whole biomass: the biomass is 0
+  (derivative 0) and the catch is the biomass before the catch
+- Effort at a cpue of 0 or below is 0 (derivative 0)
+- A profit of less than $1 million either way counts as 0 (derivative 0)
+- The fleet size changes by whole vessels, it is piecewise constant in the
+  parameters so its derivative is 0 (the number of vessels chosen at the
+  parameter values is held). Finite differences instead see a jump in the
+  NPV when a perturbation changes the number of vessels.
+- Equilibrium biomass with a catch greater than the maximum sustainable yield
+  is 0 (derivative 0), and at exactly the maximum sustainable yield the
+  derivative of the square root is taken as 0
+At a kink itself the derivative of the branch the model takes is used.
+
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import copy
+import math
+import numpy
+
+class Dual:
+    '''
+    A value and its gradient with respect to the seeded parameters
+    Arithmetic gives the value and gradient of the result, comparisons and
+    float() use the value, so the model components run on duals unchanged.
+    Gradient arrays are shared between duals and never modified in place.
+    '''
+
+    #Operations with numpy scalars use the dual methods
+    __array_priority__ = 100
+
+    def __init__(self,value,gradient):
+        self.value = float(value)
+        self.gradient = gradient
+
+    def __repr__(self):
+        return 'Dual(%r,%r)' % (self.value,self.gradient)
+
+    def __float__(self):
+        return self.value
+
+    def __add__(self,other):
+        if isinstance(other,Dual):
+            return Dual(self.value+other.value,self.gradient+other.gradient)
+        return Dual(self.value+other,self.gradient)
+
+    __radd__ = __add__
+
+    def __sub__(self,other):
+        if isinstance(other,Dual):
+            return Dual(self.value-other.value,self.gradient-other.gradient)
+        return Dual(self.value-other,self.gradient)
+
+    def __rsub__(self,other):
+        return Dual(other-self.value,-self.gradient)
+
+    def __mul__(self,other):
+        if isinstance(other,Dual):
+            return Dual(self.value*other.value,self.gradient*other.value+other.gradient*self.value)
+        return Dual(self.value*other,self.gradient*other)
+
+    __rmul__ = __mul__
+
+    def __div__(self,other):
+        if isinstance(other,Dual):
+            return Dual(self.value/other.value,
+                        (self.gradient*other.value-other.gradient*self.value)/other.value**2)
+        return Dual(self.value/other,self.gradient/other)
+
+    def __rdiv__(self,other):
+        return Dual(other/self.value,self.gradient*(-other/self.value**2))
+
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+
+    def __pow__(self,other):
+        if isinstance(other,Dual):
+            value = self.value**other.value
+            return Dual(value,self.gradient*(other.value*self.value**(other.value-1))+
+                              other.gradient*(value*math.log(self.value)))
+        if other == 0 or (self.value == 0 and other < 1):
+            #The derivative of a square root at 0 is taken as 0
+            return Dual(self.value**other,self.gradient*0)
+        return Dual(self.value**other,self.gradient*(other*self.value**(other-1)))
+
+    def __rpow__(self,other):
+        value = other**self.value
+        return Dual(value,self.gradient*(value*math.log(other)))
+
+    def __neg__(self):
+        return Dual(-self.value,-self.gradient)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        if self.value < 0:
+            return -self
+        return self
+
+    def __lt__(self,other):
+        return self.value < float(other)
+
+    def __le__(self,other):
+        return self.value <= float(other)
+
+    def __gt__(self,other):
+        return self.value > float(other)
+
+    def __ge__(self,other):
+        return self.value >= float(other)
+
+    def __eq__(self,other):
+        return self.value == float(other)
+
+    def __ne__(self,other):
+        return self.value != float(other)
+
+def seed(parameters,names):
+    '''
+    Return a copy of the parameter values with the parameters names as duals,
+    the gradient of each is 1 for itself and 0 for the others
+    '''
+    seeded = dict(parameters)
+    for index,param in enumerate(names):
+        gradient = numpy.zeros(len(names))
+        gradient[index] = 1
+        seeded[param] = Dual(parameters[param],gradient)
+    return seeded
+
+def npv(state,parameters):
+    '''
+    Return the NPV of a model run, the sum of the discounted profit
+    The profit is calculated as by the economic attributes of
+    fisheries_model.Economics (which work on arrays of floats only).
+    '''
+    total = 0.
+    for step in range(len(state['catch'])):
+        revenue = state['catch'][step]*parameters['beach_price']
+        cost = state['fleet_size'][step]*parameters['fixed_cost']+state['effort'][step]*parameters['marginal_cost']
+        profit = revenue-cost
+        if abs(profit) < 1000000:
+            profit = 0.
+        discounted = profit*(1-parameters['discount_rate'])**(state.time_offset+step-1)
+        if not math.isnan(float(discounted)):
+            total = total+discounted
+    return total
+
+def outputs(model,steps,parameters,convergence_time=20,tolerance=1e-9):
+    '''
+    Return the NPV and final biomass of a dynamic run of steps time steps and
+    the equilibrium yield at the control (the catch at equilibrium, as by a
+    static run) of the model with the parameter values
+    The values are floats or duals, depending on the parameter values.
+    convergence_time, tolerance: as for fisheries_model.static_options, the
+    equilibrium is run until its values converge
+    Returns outputs,convergence: a dict of the values by output, and a dict
+    of the time steps run to equilibrium ('iterations') and whether it
+    converged within convergence_time ('converged')
+    '''
+    dynamic = copy.deepcopy(model)
+    dynamic.reset()
+    dynamic.set_parameters(parameters)
+    dynamic.run(steps)
+
+    control = model.get_control_variable()
+    equilibrium = copy.deepcopy(model)
+    equilibrium.reset()
+    equilibrium.set_parameters(parameters)
+    equilibrium.state[control] = [parameters[control]]
+    if tolerance == None:
+        equilibrium.run(convergence_time,constant_variable = control)
+        iterations,converged = convergence_time,True
+    else:
+        iterations,converged = equilibrium.run_to_equilibrium(convergence_time,control,tolerance)
+
+    return ({'npv': npv(dynamic.state,parameters),
+             'final_biomass': dynamic.state.get('biomass'),
+             'equilibrium_yield': equilibrium.state.get('catch')},
+            {'iterations': iterations,'converged': converged})
+
+def derivatives(model,steps,names=None,convergence_time=20,tolerance=1e-9):
+    '''
+    Return the NPV, final biomass and equilibrium yield of the model (see
+    outputs) with their derivatives with respect to the parameters
+    model: a model with its parameter values set
+    names: the parameters to differentiate with respect to, by default all
+    convergence_time, tolerance: as for outputs, the convergence of the
+    values (not the derivatives) is tested
+    Returns values,gradients,convergence: dicts by output of the value, and of
+    a dict of the derivatives by parameter, and the convergence of the
+    equilibrium (see outputs)
+    '''
+    if names == None:
+        names = [param for param in model.get_schema().names if model.parameters.has_key(param)]
+    results,convergence = outputs(model,steps,seed(model.parameters,names),convergence_time,tolerance)
+
+    values = {}
+    gradients = {}
+    for output,result in results.items():
+        if isinstance(result,Dual):
+            values[output] = result.value
+            gradients[output] = dict(zip(names,result.gradient.tolist()))
+        else:
+            #Not dependent on any parameter, eg. a biomass of 0
+            values[output] = float(result)
+            gradients[output] = dict([(param,0.) for param in names])
+    return values,gradients,convergence
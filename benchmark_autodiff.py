@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer differentiation benchmark
+Compares the gradients of the NPV, final biomass and equilibrium yield given
+by forward mode differentiation (autodiff.py) with central finite differences,
+which take two model runs per parameter, in time and value.
+Differences in the NPV are expected where a perturbation changes the number
+of vessels in the fleet (see autodiff.py).
+
+Usage: python benchmark_autodiff.py [steps] [repeats]
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import sys
+import timeit
+
+import autodiff
+import fisheries_model
+
+#Parameters the fleet size is piecewise constant in, the finite differences
+#of the NPV with respect to them are the jumps from vessels entering or leaving
+PIECEWISE_PARAMETERS = ['movement_rate']
+
+def default_parameters(model):
+    '''Return the default parameter values of a model'''
+    p = model.get_parameters()
+    return dict([(param,float(p[param]['value'])) for param in p])
+
+def finite_differences(model,steps,names,relative_step=1e-6):
+    '''Return the gradients of the outputs (see autodiff.outputs) by central finite differences'''
+    gradients = {}
+    for param in names:
+        h = relative_step*max(abs(model.parameters[param]),1)
+        upper = dict(model.parameters)
+        upper[param] += h
+        lower = dict(model.parameters)
+        lower[param] -= h
+        upper,convergence = autodiff.outputs(model,steps,upper)
+        lower,convergence = autodiff.outputs(model,steps,lower)
+        for output in upper:
+            gradients.setdefault(output,{})[param] = (upper[output]-lower[output])/(2*h)
+    return gradients
+
+def time_per_call(function,repeats):
+    '''Return the best time per call of function in milliseconds'''
+    return min(timeit.repeat(function,number=repeats,repeat=3))/repeats*1e3
+
+def relative_difference(a,b):
+    '''Return the difference of a and b relative to the larger of them'''
+    scale = max(abs(a),abs(b))
+    if scale == 0:
+        return 0.
+    return abs(a-b)/scale
+
+if __name__ == '__main__':
+    steps = 50
+    repeats = 5
+    if len(sys.argv) > 1:
+        steps = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        repeats = int(sys.argv[2])
+
+    for name in sorted(fisheries_model.MODEL_FACTORIES):
+        for control_type in ['catch','effort']:
+            model = fisheries_model.MODEL_FACTORIES[name](control_type = control_type)
+            model.set_parameters(default_parameters(model))
+            model.reset()
+            names = list(model.get_schema().names)
+
+            values,dual,convergence = autodiff.derivatives(model,steps,names)
+            finite = finite_differences(model,steps,names)
+            dual_time = time_per_call(lambda: autodiff.derivatives(model,steps,names),repeats)
+            finite_time = time_per_call(lambda: finite_differences(model,steps,names),repeats)
+
+            print('%s, %s control, %d parameters: dual %.1f ms, finite differences %.1f ms (%.1fx)' %
+                  (name,control_type,len(names),dual_time,finite_time,finite_time/dual_time))
+            print('    equilibrium %s in %d time steps' % ('converged' if convergence['converged'] else 'NOT CONVERGED',convergence['iterations']))
+            for output in sorted(values):
+                differences = [(relative_difference(dual[output][param],finite[output][param]),param)
+                               for param in names if param not in PIECEWISE_PARAMETERS]
+                worst,param = max(differences)
+                print('    %-18s %14.6g  largest difference %.2e (%s)' % (output,values[output],worst,param))
+            for param in PIECEWISE_PARAMETERS:
+                print('    d npv/d %s: dual %.6g, finite differences %.6g' % (param,dual['npv'][param],finite['npv'][param]))
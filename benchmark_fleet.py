@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer heterogeneous fleet benchmark
+Times a dynamic time step of the lobster model with a heterogeneous fleet
+(vessel_fleet.py) for pools of 100 to 100,000 vessels, against the model with
+identical vessels.
+
+Usage: python benchmark_fleet.py [steps]
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import sys
+import timeit
+
+import numpy
+
+import fisheries_model
+import vessel_fleet
+
+#The numbers of vessels in the pool
+POOL_SIZES = [100,1000,10000,100000]
+
+def default_parameters(model,movement_rate):
+    '''Return the default parameter values of a model, with a movement rate'''
+    p = model.get_parameters()
+    parameters = dict([(param,float(p[param]['value'])) for param in p])
+    parameters['movement_rate'] = movement_rate
+    return parameters
+
+def time_per_step(model,steps):
+    '''Return the best time per time step of a run of the model, in milliseconds'''
+    def run():
+        model.reset()
+        model.run(steps)
+    return min(timeit.repeat(run,number=1,repeat=3))/steps*1e3
+
+if __name__ == '__main__':
+    steps = 100
+    if len(sys.argv) > 1:
+        steps = int(sys.argv[1])
+
+    for control_type in ['catch','effort']:
+        model = fisheries_model.lobsterModel(control_type = control_type)
+        model.set_parameters(default_parameters(model,5))
+        print('%s control, identical vessels: %.3f ms per step' % (control_type,time_per_step(model,steps)))
+        for count in POOL_SIZES:
+            vessels = vessel_fleet.Vessels.generate(count,generator=numpy.random.RandomState(0))
+            model = vessel_fleet.heterogeneousModel('lobster',control_type,vessels)
+            #The initial fleet is a tenth of the pool
+            model.state['fleet_size'] = [count//10]
+            model.set_parameters(default_parameters(model,5))
+            milliseconds = time_per_step(model,steps)
+            print('%s control, %6d vessels: %.3f ms per step, final fleet %d' %
+                  (control_type,count,milliseconds,model.state.get('fleet_size')))
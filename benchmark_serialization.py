@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer serialization benchmark
+Compares the size and speed of the compact serialization (serialization.py)
+with pickle and copy.deepcopy for models and run output states.
+
+Usage: python benchmark_serialization.py [steps] [repeats]
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import cPickle
+import copy
+import sys
+import timeit
+
+import fisheries_model
+import serialization
+
+def default_parameters(model):
+    '''Return the default parameter values of a model'''
+    p = model.get_parameters()
+    return dict([(param,float(p[param]['value'])) for param in p])
+
+def time_per_call(function,repeats):
+    '''Return the best time per call of function in microseconds'''
+    return min(timeit.repeat(function,number=repeats,repeat=3))/repeats*1e6
+
+def benchmark(name,obj,dumps,loads,repeats):
+    '''Print the size and dump/load times of an object for each method'''
+    methods = [('compact',dumps,loads),
+               ('pickle',lambda o: cPickle.dumps(o,cPickle.HIGHEST_PROTOCOL),cPickle.loads)]
+    for method,dump,load in methods:
+        data = dump(obj)
+        dump_time = time_per_call(lambda: dump(obj),repeats)
+        load_time = time_per_call(lambda: load(data),repeats)
+        print('%-24s %-8s %8d bytes  dump %8.1f us  load %8.1f us' % (name,method,len(data),dump_time,load_time))
+    print('%-24s %-8s %8s        copy %8.1f us' % (name,'deepcopy','',time_per_call(lambda: copy.deepcopy(obj),repeats)))
+
+if __name__ == '__main__':
+    steps = 100
+    repeats = 200
+    if len(sys.argv) > 1:
+        steps = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        repeats = int(sys.argv[2])
+
+    for name in sorted(fisheries_model.MODEL_FACTORIES):
+        model = fisheries_model.MODEL_FACTORIES[name]()
+        model.set_parameters(default_parameters(model))
+        model.reset()
+        benchmark(name + ' model',model,serialization.dumps,serialization.loads,repeats)
+
+        state = fisheries_model.run_model(model,steps)
+        benchmark(name + ' state (%d steps)' % steps,state,serialization.dumps_state,
+                  lambda data: serialization.loads_state(data,model.state),repeats)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer spatial model benchmark
+Times a dynamic time step of the lobster model with a spatial stock
+(spatial_model.py) on square grids of 100 to 100,000 cells, against the model
+with a single stock.
+
+Usage: python benchmark_spatial.py [steps]
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import sys
+import timeit
+
+import numpy
+
+import fisheries_model
+import spatial_model
+
+#The number of rows and columns of the grids
+GRID_SIZES = [(10,10),(32,32),(100,100),(316,316)]
+
+def default_parameters(model):
+    '''Return the default parameter values of a model'''
+    p = model.get_parameters()
+    return dict([(param,float(p[param]['value'])) for param in p])
+
+def time_per_step(model,steps):
+    '''Return the best time per time step of a run of the model, in milliseconds'''
+    def run():
+        model.reset()
+        model.run(steps)
+    return min(timeit.repeat(run,number=1,repeat=3))/steps*1e3
+
+if __name__ == '__main__':
+    steps = 100
+    if len(sys.argv) > 1:
+        steps = int(sys.argv[1])
+
+    for control_type in ['catch','effort']:
+        model = fisheries_model.lobsterModel(control_type = control_type)
+        model.set_parameters(default_parameters(model))
+        print('%s control, single stock: %.3f ms per step' % (control_type,time_per_step(model,steps)))
+        for rows,columns in GRID_SIZES:
+            cells = spatial_model.Cells.generate(rows*columns,generator=numpy.random.RandomState(0))
+            migration = spatial_model.Migration.grid(rows,columns,0.1)
+            #A tenth of the cells are closed
+            closed = numpy.arange(rows*columns)%10 == 0
+            model = spatial_model.spatialModel('lobster',control_type,cells,migration,closed)
+            model.set_parameters(default_parameters(model))
+            milliseconds = time_per_step(model,steps)
+            print('%s control, %6d cells: %.3f ms per step, final biomass %.0f' %
+                  (control_type,rows*columns,milliseconds,model.state.get('biomass')))
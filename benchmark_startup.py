@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer startup benchmark
+Times the startup of the GUI from the first import to the first plot on
+screen (the first parameter change drawn, see latency_trace), in a fresh
+interpreter for each repeat:
+    import      importing fisheries_gui (wx, matplotlib and the models)
+    frame       creating the frame, up to a single layout
+    first_plot  the first model run drawn on the canvas
+Without wx the same path is timed headless: importing the model and plot
+modules, the first static run of the default model and drawing it on an Agg
+canvas.
+
+Usage: python benchmark_startup.py [repeats]
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy
+
+#The stages timed, in order
+STAGES = ['import','frame','first_plot']
+
+def gui_startup():
+    '''Start the GUI and return the time of the end of each stage'''
+    import fisheries_gui
+    times = {'import': time.time()}
+    app = fisheries_gui.App(redirect=False)
+    times['frame'] = time.time()
+
+    def poll():
+        if fisheries_gui.TRACER.finished > 0:
+            times['first_plot'] = time.time()
+            app.ExitMainLoop()
+        else:
+            fisheries_gui.wx.CallLater(5,poll)
+    poll()
+    app.MainLoop()
+    return times
+
+def headless_startup():
+    '''Time the model and plot path of the GUI startup without wx (the GUI imports these modules too)'''
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import fisheries_model
+    import vector_model
+    import optimal_harvest
+    import parameter_map
+    import equilibrium_table
+    import plot_layout
+    import latency_trace
+    times = {'import': time.time()}
+
+    model = fisheries_model.fishModel(control_type = 'catch')
+    p = model.get_parameters()
+    parameters = dict([(param,float(p[param]['value'])) for param in p])
+    model.set_parameters(parameters)
+    fig = Figure()
+    canvas = FigureCanvasAgg(fig)
+    layout = plot_layout.FigureLayout(fig)
+    layout.set_pixel_width(fig.get_figwidth()*fig.get_dpi())
+    times['frame'] = time.time()
+
+    variable,maximum = fisheries_model.static_maximum(parameters,'catch')
+    state = fisheries_model.run_model(model,100,dynamic=False,independent_variable=variable,
+                                      independent_maximum=maximum)
+    layout.set_state(state)
+    layout.set_simulation(False,'catch')
+    layout.setup_axes(state.default_plot)
+    layout.update_plot()
+    canvas.draw()
+    times['first_plot'] = time.time()
+    return times
+
+def child():
+    '''Run one startup and print the seconds from the start to each stage as JSON'''
+    start = time.time()
+    try:
+        import wx
+        times = gui_startup()
+        mode = 'gui'
+    except ImportError:
+        times = headless_startup()
+        mode = 'headless'
+    print(json.dumps({'mode': mode,'times': dict([(stage,times[stage]-start) for stage in STAGES])}))
+    sys.stdout.flush()
+    #The model threads do not stop with the main loop
+    os._exit(0)
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--child']:
+        child()
+
+    repeats = 5
+    if len(sys.argv) > 1:
+        repeats = int(sys.argv[1])
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for repeat in range(repeats):
+        output = subprocess.check_output([sys.executable,os.path.abspath(__file__),'--child'],cwd=directory)
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print('%s startup, %d runs (seconds from the start of the interpreter script)' % (results[0]['mode'],repeats))
+    print('%-12s %8s %8s %8s' % ('stage','best','median','worst'))
+    for stage in STAGES:
+        times = numpy.array([result['times'][stage] for result in results])*1e3
+        print('%-12s %6.0f ms %6.0f ms %6.0f ms' % (stage,times.min(),numpy.median(times),times.max()))
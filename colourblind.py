@@ -15,11 +15,19 @@ rgbScaled = rgb/255.0
 #http://geography.uoregon.edu/datagraphics/EOS/Light&Bartlein_EOS2004.pdf
 def makeMap(inMap,name):
   import numpy
-  import matplotlib
+  import matplotlib.colors
   inMap = numpy.array(inMap)/255.0
   return matplotlib.colors.LinearSegmentedColormap.from_list(name,inMap)
-  
-blueMap = makeMap([[243,246,248],[224,232,240],[171,209,236],[115,180,224],[35,157,213],[0,142,205],[0,122,192]],'cbBlue')
-blueGrayMap = makeMap([[0,170,227],[53,196,238],[133,212,234],[190,230,242],[217,224,230],[146,161,170],[109,122,129],[65,79,81]],'cbBlueGray')
-brownBlueMap = makeMap([[144,100,44],[187,120,54],[225,146,65],[248,184,139],[244,218,200],[241,244,245],[207,226,240],[160,190,225],[109,153,206],[70,99,174],[24,79,162]],'cbBrownBlue')
-redBlueMap = makeMap([[175,53,71],[216,82,88],[239,133,122],[245,177,139],[249,216,168],[242,238,197],[216,236,241],[154,217,238],[68,199,239],[0,170,226],[0,116,188]],'cbRedBlue')
\ No newline at end of file
+
+#The colours of each colormap, made by getMap when first used
+mapColours = {'blueMap': ('cbBlue',[[243,246,248],[224,232,240],[171,209,236],[115,180,224],[35,157,213],[0,142,205],[0,122,192]]),
+              'blueGrayMap': ('cbBlueGray',[[0,170,227],[53,196,238],[133,212,234],[190,230,242],[217,224,230],[146,161,170],[109,122,129],[65,79,81]]),
+              'brownBlueMap': ('cbBrownBlue',[[144,100,44],[187,120,54],[225,146,65],[248,184,139],[244,218,200],[241,244,245],[207,226,240],[160,190,225],[109,153,206],[70,99,174],[24,79,162]]),
+              'redBlueMap': ('cbRedBlue',[[175,53,71],[216,82,88],[239,133,122],[245,177,139],[249,216,168],[242,238,197],[216,236,241],[154,217,238],[68,199,239],[0,170,226],[0,116,188]])}
+maps = {}
+
+def getMap(name):
+  """Return a colormap by its name in mapColours, made on first use"""
+  if not maps.has_key(name):
+    maps[name] = makeMap(mapColours[name][1],mapColours[name][0])
+  return maps[name]
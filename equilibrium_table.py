@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer equilibrium lookup tables
+The equilibrium biology of a static run (the biomass, catch, cpue and effort
+at each independent value) depends only on r, K and catch_rate when the fleet
+does not change size (a movement_rate of 0), so it is tabulated offline over
+a grid of those parameters, for each model and control type. A static run is
+then interpolated from the 8 table entries around its parameter values, and
+its economic attributes are calculated exactly from the interpolated biology.
+A run from a table takes about 1 ms, most of it building the output state,
+against some 20 ms for the exact static run.
+The grid is geometric and values are interpolated multilinearly in the
+logarithms of the parameters and of the values (linearly where any of them is
+0), which is exact for power laws such as the equilibria of a catch control
+(the biomass in proportion to K, the catch to r*K, the cpue to catch_rate).
+Only catch control is tabulated (see TABLE_CONTROL_TYPES): the equilibrium
+biomass of an effort control is K-effort*catch_rate/r, not a power law, and
+the stock collapses part way through the sweep at an effort moving with
+r*K/catch_rate, so no cell of an effort control table can be interpolated.
+
+A table is a memory-mapped .npy file of the equilibria of every grid point
+with a JSON sidecar describing the grid, the run options the table was built
+with and an estimate of the interpolation error of each cell: the error at
+its centre (of the largest change of an attribute relative to its largest
+value), where the error of multilinear interpolation is largest. sweep gives
+None, and the run should be computed exactly, outside the table, for other
+run options, where the cell error is larger than the accuracy asked for, or
+where the table entries around the parameter values differ in the number of
+iterations, convergence, collapse of the stock or whether the independent
+value is reached at any independent value.
+
+Usage: python equilibrium_table.py [points] [directory]
+builds the tables of every model and tabulated control type with points grid values of
+each parameter (default 9) in directory (default TABLE_DIRECTORY)
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import copy
+import json
+import os
+import sys
+import time
+
+import numpy
+
+import fisheries_model
+
+#The directory the tables are read from by default
+TABLE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),'equilibrium_tables')
+#The control types tabulated
+TABLE_CONTROL_TYPES = ['catch']
+#The parameters tabulated, the axes of the grid
+TABLE_PARAMETERS = ['r','K','catch_rate']
+#The attributes tabulated, the others are calculated
+TABLE_ATTRIBUTES = ['biomass','catch','cpue','effort']
+#The columns of each equilibrium in the table, the attributes then the
+#number of time steps to the equilibrium, the time step it is at (the same
+#unless it was found again from the initial state, see StaticRun), whether it
+#converged and whether the independent value was reached (the stock can
+#support the catch)
+TABLE_COLUMNS = TABLE_ATTRIBUTES+['iterations','time','converged','reached']
+#The options of the static runs the table is built with
+RUN_OPTIONS = ['convergence_time','tolerance','continuation']
+#The default largest interpolation error (relative) of a table sweep
+DEFAULT_ACCURACY = 1e-3
+
+def _default_options():
+    '''Return the default run options (see RUN_OPTIONS) of a static run'''
+    options = fisheries_model.static_options(1,independent_maximum=0)
+    return dict([(option,options[option]) for option in RUN_OPTIONS])
+
+class _Rows(dict):
+    '''The columns of a sweep, derived attributes are calculated when first needed'''
+
+    def __init__(self,columns,derived,parameters):
+        dict.__init__(self,columns)
+        self.derived = derived
+        self.parameters = parameters
+
+    def __missing__(self,attribute):
+        self[attribute] = numpy.asarray(self.derived[attribute](self,self.parameters),dtype=float)
+        return self[attribute]
+
+class EquilibriumTable:
+    '''A table of static runs over a grid of parameter values (see build)'''
+
+    def __init__(self,values,description):
+        '''
+        values: an array of the equilibria of each grid point (one axis per
+        parameter), independent value and column (see TABLE_COLUMNS)
+        description: a dict of the grid and run options (see build)
+        '''
+        self.values = values
+        self.description = description
+        self.axes = [numpy.array(description['axes'][param]) for param in TABLE_PARAMETERS]
+        self.cell_error = numpy.array(description['cell_error'])
+        #The smallest cell error, a table no run can be taken from is not used (see find_table)
+        self.best_error = self.cell_error.min()
+
+    @staticmethod
+    def load(path):
+        '''Load a table from path (without the extension), memory-mapped'''
+        description = json.load(open(path+'.json'))
+        return EquilibriumTable(numpy.load(path+'.npy',mmap_mode='r'),description)
+
+    def save(self,path):
+        '''Save the table to path.npy and its description to path.json'''
+        values = numpy.lib.format.open_memmap(path+'.npy',mode='w+',dtype=self.values.dtype,shape=self.values.shape)
+        values[...] = self.values
+        values.flush()
+        json.dump(self.description,open(path+'.json','w'),indent=1)
+
+    def matches(self,model,steps,arguments):
+        '''Whether a static run of the model (see sweep) can be taken from the table'''
+        description = self.description
+        parameters = model.parameters
+        if model.get_control_variable() != description['control_type'] or steps != description['steps']:
+            return False
+        for param,value in parameters.items():
+            if isinstance(value,fisheries_model.Schedule):
+                return False
+        if parameters.get('movement_rate',0) != 0:
+            return False
+        for att in model.state.attribute_names():
+            if att not in TABLE_ATTRIBUTES and att != 'fleet_size' and att not in model.get_derived_columns():
+                return False
+        for att,value in description['initial'].items():
+            if model.state[att][0] != value:
+                return False
+        variable,maximum = fisheries_model.static_maximum(parameters,description['control_type'])
+        if arguments.get('independent_variable','effort') != variable or \
+           arguments.get('independent_minimum',0) != 0 or arguments.get('independent_maximum') != maximum:
+            return False
+        defaults = _default_options()
+        for option,value in description['options'].items():
+            if arguments.get(option,defaults[option]) != value:
+                return False
+        return True
+
+    def interpolate(self,parameters,accuracy=numpy.inf):
+        '''
+        Return the interpolated columns (see TABLE_COLUMNS) of the parameter
+        values, a dict of arrays, or None if they cannot be interpolated to
+        the accuracy
+        '''
+        cell = []
+        weights = numpy.ones((1,1,1))
+        for axis,param in enumerate(TABLE_PARAMETERS):
+            grid = self.axes[axis]
+            value = parameters[param]
+            if not grid[0] <= value <= grid[-1]:
+                return None
+            index = min(numpy.searchsorted(grid,value,side='right')-1,len(grid)-2)
+            fraction = numpy.log(value/grid[index])/numpy.log(grid[index+1]/grid[index])
+            shape = [1,1,1]
+            shape[axis] = 2
+            weights = weights*numpy.array([1-fraction,fraction]).reshape(shape)
+            cell.append(index)
+        i,j,k = cell
+        if not self.cell_error[i,j,k] <= accuracy:
+            return None
+
+        corners = numpy.asarray(self.values[i:i+2,j:j+2,k:k+2],dtype=float).reshape(8,-1,len(TABLE_COLUMNS))
+        #Discrete values are not interpolated, the corners must agree
+        for column in ['iterations','time','converged','reached']:
+            values = corners[:,:,TABLE_COLUMNS.index(column)]
+            if (values != values[0]).any():
+                return None
+        with numpy.errstate(invalid='ignore'):
+            collapsed = corners[:,:,TABLE_COLUMNS.index('biomass')] <= 0
+        if (collapsed != collapsed[0]).any() or not corners[0,:,TABLE_COLUMNS.index('converged')].all():
+            return None
+
+        weights = weights.ravel()
+        with numpy.errstate(invalid='ignore'):
+            positive = (corners > 0).all(axis=0)
+            logarithms = numpy.log(numpy.where(corners > 0,corners,1))
+        interpolated = numpy.where(positive,numpy.exp(numpy.tensordot(weights,logarithms,axes=1)),
+                                   numpy.tensordot(weights,corners,axes=1))
+        columns = dict([(column,interpolated[:,index]) for index,column in enumerate(TABLE_COLUMNS)])
+        columns['iterations'] = corners[0,:,TABLE_COLUMNS.index('iterations')].astype(int)
+        columns['time'] = corners[0,:,TABLE_COLUMNS.index('time')].astype(int)
+        columns['reached'] = corners[0,:,TABLE_COLUMNS.index('reached')] > 0
+        return columns
+
+    def sweep(self,model,steps,arguments,accuracy=DEFAULT_ACCURACY):
+        '''
+        Return the output state of a static run of the model (with its
+        parameter values set and its state reset) from the table, as
+        fisheries_model.run_model gives, or None if it cannot be taken from the
+        table to the accuracy
+        arguments: a dict of the other keyword arguments of the run
+        '''
+        if not self.matches(model,steps,arguments):
+            return None
+        columns = self.interpolate(model.parameters,accuracy)
+        if columns == None:
+            return None
+
+        state = copy.deepcopy(model.state)
+        state.reset()
+        state.set_parameters(model.parameters)
+        state.materialise()
+        #The independent values that were reached are exact
+        variable = arguments['independent_variable']
+        values = numpy.linspace(0,arguments['independent_maximum'],steps)
+        columns[variable] = numpy.where(columns['reached'],values,columns[variable])
+        #The fleet does not change size, and the discounted profit of each
+        #equilibrium is at its own time step (the time column) as in StaticRun
+        columns['fleet_size'] = numpy.ones(steps)*state['fleet_size'][0]
+        rows = _Rows(columns,model.get_derived_columns(),model.parameters)
+        for att in state:
+            state[att].extend(rows[att].tolist())
+        #As StaticRun marks the independent values that could not be reached
+        state[variable][1:] = numpy.where(columns['reached'],values,numpy.roll(values,1)+1e-6).tolist()
+        restarted = columns['iterations'] != columns['time']
+        state.convergence = {'iterations': columns['iterations'].tolist(),'unconverged': [],
+                             'restarts': values[restarted].tolist()}
+        return state
+
+#The tables loaded by name and control type, None where there is none
+_tables = {}
+
+def find_table(name,control_type,directory=TABLE_DIRECTORY,accuracy=DEFAULT_ACCURACY):
+    '''
+    Return the table of a model (a name of fisheries_model.MODEL_FACTORIES)
+    and control type, or None if there is none or none of its cells is
+    within the accuracy
+    '''
+    if control_type not in TABLE_CONTROL_TYPES:
+        return None
+    key = (name,control_type,directory)
+    if not _tables.has_key(key):
+        path = os.path.join(directory,'%s_%s' % (name,control_type))
+        if os.path.exists(path+'.npy') and os.path.exists(path+'.json'):
+            _tables[key] = EquilibriumTable.load(path)
+        else:
+            _tables[key] = None
+    table = _tables[key]
+    if table == None or not table.best_error <= accuracy:
+        return None
+    return table
+
+def sweep(name,model,steps,accuracy=DEFAULT_ACCURACY,directory=TABLE_DIRECTORY,**arguments):
+    '''
+    Return the output state of a static run of a model (a name of
+    fisheries_model.MODEL_FACTORIES) from its table, or None if there is no
+    table or the run cannot be taken from it (see EquilibriumTable.sweep)
+    Other arguments are as for fisheries_model.run_model
+    '''
+    if arguments.get('dynamic',True):
+        return None
+    table = find_table(name,model.get_control_variable(),directory,accuracy)
+    if table == None:
+        return None
+    return table.sweep(model,steps,arguments,accuracy)
+
+def _default_parameters(model):
+    '''Return the default parameter values of a model, with a fleet of fixed size'''
+    p = model.get_parameters()
+    parameters = dict([(param,float(p[param]['value'])) for param in p])
+    parameters['movement_rate'] = 0.
+    return parameters
+
+def _equilibria(model,parameters,steps,options):
+    '''Return the columns (see TABLE_COLUMNS) of an exact static run of the model with the parameter values'''
+    model.set_parameters(parameters)
+    model.reset()
+    variable,maximum = fisheries_model.static_maximum(parameters,model.get_control_variable())
+    run = fisheries_model.make_run(model,steps,dynamic=False,independent_variable=variable,
+                                   independent_maximum=maximum,**options)
+    columns = numpy.empty((steps,len(TABLE_COLUMNS)))
+    reached = []
+    times = []
+    for step in range(steps):
+        run.single_iteration(step)
+        #The values of the model, the output marks independent values that could not be reached
+        columns[step,:len(TABLE_ATTRIBUTES)] = [run.model.state.get(att) for att in TABLE_ATTRIBUTES]
+        reached.append(run.model.state.get(variable) >= run.options['independent_values'][step])
+        times.append(run.model.state.steps()-1+run.model.state.time_offset)
+    columns[:,TABLE_COLUMNS.index('iterations')] = run.iterations
+    columns[:,TABLE_COLUMNS.index('converged')] = ~numpy.in1d(run.options['independent_values'],run.unconverged)
+    columns[:,TABLE_COLUMNS.index('reached')] = numpy.array(reached)
+    columns[:,TABLE_COLUMNS.index('time')] = times
+    return columns
+
+def _relative_error(interpolated,exact):
+    '''The largest difference of any attribute, relative to its largest value'''
+    error = 0.
+    for att in TABLE_ATTRIBUTES:
+        scale = numpy.abs(exact[att]).max()
+        if scale > 0:
+            error = max(error,numpy.abs(interpolated[att]-exact[att]).max()/scale)
+    return error
+
+def build(name,control_type,points=9,steps=100,dtype=numpy.float32):
+    '''
+    Return the table of a model (a name of fisheries_model.MODEL_FACTORIES)
+    and control type, with points grid values of each tabulated parameter
+    spaced evenly (geometrically) over its range in the model, from 5% of its
+    maximum where its minimum is 0
+    steps: the number of independent values of the static runs
+    '''
+    model = fisheries_model.MODEL_FACTORIES[name](control_type = control_type)
+    base = _default_parameters(model)
+    options = _default_options()
+    p = model.get_parameters()
+    axes = {}
+    for param in TABLE_PARAMETERS:
+        maximum = float(p[param]['max'])
+        minimum = max(float(p[param]['min']),0.05*maximum)
+        axes[param] = numpy.geomspace(minimum,maximum,points) if hasattr(numpy,'geomspace') else \
+                      numpy.exp(numpy.linspace(numpy.log(minimum),numpy.log(maximum),points))
+
+    values = numpy.empty((points,points,points,steps,len(TABLE_COLUMNS)),dtype=dtype)
+    for index in numpy.ndindex(points,points,points):
+        parameters = dict(base)
+        parameters.update(dict([(param,axes[param][i]) for param,i in zip(TABLE_PARAMETERS,index)]))
+        values[index] = _equilibria(model,parameters,steps,options)
+
+    description = {'model': name,
+                   'control_type': control_type,
+                   'steps': steps,
+                   'parameters': TABLE_PARAMETERS,
+                   'columns': TABLE_COLUMNS,
+                   'axes': dict([(param,axes[param].tolist()) for param in TABLE_PARAMETERS]),
+                   'initial': {'biomass': model.state['biomass'][0],'fleet_size': model.state['fleet_size'][0]},
+                   'options': options,
+                   'cell_error': None}
+    table = EquilibriumTable(values,dict(description,cell_error=numpy.zeros((points-1,)*3).tolist()))
+
+    #The error of each cell at its centre, infinite where it cannot be interpolated
+    cell_error = numpy.empty((points-1,)*3)
+    for index in numpy.ndindex(*cell_error.shape):
+        parameters = dict(base)
+        parameters.update(dict([(param,(axes[param][i]*axes[param][i+1])**0.5)
+                                for param,i in zip(TABLE_PARAMETERS,index)]))
+        interpolated = table.interpolate(parameters)
+        exact = _equilibria(model,parameters,steps,options)
+        exact = dict([(column,exact[:,i]) for i,column in enumerate(TABLE_COLUMNS)])
+        if interpolated == None or (interpolated['iterations'] != exact['iterations']).any():
+            cell_error[index] = numpy.inf
+        else:
+            cell_error[index] = _relative_error(interpolated,exact)
+    #JSON has no infinity, a cell that cannot be interpolated has an error of 1e300
+    description['cell_error'] = numpy.minimum(cell_error,1e300).tolist()
+    return EquilibriumTable(values,description)
+
+if __name__ == '__main__':
+    points = 9
+    directory = TABLE_DIRECTORY
+    if len(sys.argv) > 1:
+        points = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        directory = sys.argv[2]
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    for name in sorted(fisheries_model.MODEL_FACTORIES):
+        for control_type in TABLE_CONTROL_TYPES:
+            start = time.time()
+            table = build(name,control_type,points)
+            path = os.path.join(directory,'%s_%s' % (name,control_type))
+            table.save(path)
+            usable = (table.cell_error <= DEFAULT_ACCURACY).mean()
+            print('%s, %s control: %d grid points in %.1f s, %.0f%% of cells within %g, %.1f MB' %
+                  (name,control_type,points**3,time.time()-start,usable*100,DEFAULT_ACCURACY,
+                   table.values.nbytes/1e6))
@@ -10,7 +10,13 @@ This program is released under the Open Software License ("OSL") v. 3.0. See OSL
 import wx
 import wx.html
 import fisheries_model
+import vector_model
+import optimal_harvest
+import parameter_map
+import equilibrium_table
 import colourblind
+import plot_layout
+import latency_trace
 
 import matplotlib
 #matplotlib.use('WXAgg')
@@ -21,6 +27,7 @@ import numpy
 import copy
 import os
 import sys
+import time
 
 #String constants for some menus etc
 MG_QUOTA='Output Controlled'
@@ -42,13 +49,18 @@ VERSIONSTRING = '1.04'
 SIM_TYPE=''
 MG_TYPE=''
 MODEL_TYPE=''
-DEBUG = 1
+#Traces each parameter change to the screen and logs events (printed if verbose)
+TRACER = latency_trace.Tracer(verbose=False)
+#Number of slider steps to precompute ahead of (and behind) the last slider move
+SPECULATIVE_AHEAD = 6
+SPECULATIVE_BEHIND = 2
+#Seconds of parameter map refinement between redraws
+MAP_REFINE_TIME = 0.1
 
 class Frame(wx.Frame):
     '''The main (only?) GUI Frame'''
     def __init__(self,width,height):
-    	if DEBUG > 0:
-    		print("Frame.__init__")
+        TRACER.event("Frame.__init__")
         wx.Frame.__init__(self,
                           None,
                           size=wx.Size(width,height),
@@ -67,8 +79,7 @@ class Frame(wx.Frame):
 
     def _init_update(self):
         '''Initialise model/graph update system'''
-    	if DEBUG > 0:
-    		print("Frame._init_update")
+        TRACER.event("Frame._init_update")
         
         #Will contain current parameters
         self.parameters= {}
@@ -80,22 +91,26 @@ class Frame(wx.Frame):
         #Whether current computation has been completed
         self.computed_complete = True
         
+        #The slider positions of the current parameters, as a vector ordered by the parameter schema
+        self.positions = None
+        #The last slider moved and the size and direction of its move (parameter,positions)
+        self.last_moved = None
+        #The latest parameter change traced (see latency_trace)
+        self.generation = None
+        #The background solution of the optimal harvest path, while it is pending
+        self.optimal_job = None
+        
         #Timer for model reruns
         self.timer_model = wx.Timer(self)
         self.timer_model.Start(250)
         wx.EVT_TIMER(self,self.timer_model.GetId(),self.on_timer_model)
-        #Hack to call layout after init
-        self.timer_init_hack = wx.Timer(self)
-        self.timer_init_hack.Start(250)
-        wx.EVT_TIMER(self,self.timer_init_hack.GetId(),self.on_timer_init_hack)
-        #The model execution thread
-        self.model_thread = fisheries_model.MultiThreadModelRun(self.model_data_updater)
+        #The model execution threads (started by the first run)
+        self.model_thread = fisheries_model.MultiThreadModelRun(self.model_data_updater,tracer=TRACER)
     
     
     def _init_gui(self):
         '''Initialise GUI components'''
-    	if DEBUG > 0:
-    		print("Frame._init_gui")
+        TRACER.event("Frame._init_gui")
         
         
         #Setup sizers (in hierarchical order)
@@ -114,8 +129,11 @@ class Frame(wx.Frame):
         #Set sizers
         self.SetSizer(self.sizer)
         
+        #Status bar, for equilibria of a static run that did not converge
+        self.status_bar = self.CreateStatusBar()
+        
         #Set menu
-        self.menubar = MenuBar(self,sim_update_fx=self.on_simulation_change,parameter_type_fx=self.parameter_panel.show_parameter_set,reset_model_fx=self.on_simulation_change)
+        self.menubar = MenuBar(self,sim_update_fx=self.on_simulation_change,parameter_type_fx=self.parameter_panel.show_parameter_set,reset_model_fx=self.on_simulation_change,optimal_path_fx=self.on_optimal_path,parameter_map_fx=self.on_parameter_map)
         self.SetMenuBar(self.menubar)
         self.menubar.set_parameter_types(self.model.get_parameter_types())
 
@@ -140,8 +158,7 @@ class Frame(wx.Frame):
     block = False
     
     def onCloseWindow(self,event):
-    	if DEBUG > 0:
-    		print("Frame.onCloseWindow")
+        TRACER.event("Frame.onCloseWindow")
         
         self.timer_model.Stop()
         self.timer_model.Destroy()
@@ -152,41 +169,115 @@ class Frame(wx.Frame):
     def on_timer_model(self,event):
         '''Rerun the model if parameters have changed'''
         
-#    	if DEBUG > 0:
-#    		print("Frame.on_timer_model")
         
         #If parameters have changed we need to recalculate the model
         if self.parameters != self.computed_parameters:
             self.computed_complete=False
-            self.model.set_parameters(self.parameter_panel.get_parameters())
+            self.model.set_parameters(self.parameters)
             self.model.reset()
+            key = self._cache_key(SIM_TYPE,MG_TYPE,MODEL_TYPE,self.model.get_schema(),self.parameters)
+            self.computed_parameters = self.parameters
+            
+            #Use a precomputed result if there is one
+            state = self.model_thread.cache.get(key)
+            TRACER.event("Frame.on_timer_model cache",**self.model_thread.cache.stats())
+            if state != None:
+                TRACER.mark(self.generation,'polled','cache')
+                self.model_thread.cancel()
+                self.model_data_updater(state,self.generation)
+                return
+            
+            #A static run is interpolated from the equilibrium table if it covers the parameter values
+            steps,arguments = self._run_arguments(SIM_TYPE,MG_TYPE,self.parameters)
+            state = equilibrium_table.sweep(self._model_name(MODEL_TYPE),self.model,steps,**arguments)
+            if state != None:
+                TRACER.mark(self.generation,'polled','table')
+                self.model_thread.cancel()
+                self.model_thread.cache.put(key,state,'table')
+                self.model_data_updater(state,self.generation)
+                return
             
             #Run the appropriate simulation
-            if SIM_TYPE == SIM_STATIC:
-                if MG_TYPE == MG_QUOTA:
-                    max= self.parameters['K']*self.parameters['r']/4*1.01
-                    self.model_thread.run(self.model,100,dynamic=False,independent_variable='catch',independent_maximum=max)
-                else:
-                    self.model_thread.run(self.model,100,dynamic=False,independent_variable='effort',independent_maximum=6e6)
+            TRACER.mark(self.generation,'polled')
+            self.model_thread.run(self.model,steps,key=key,generation=self.generation,**arguments)
+ 
+    @staticmethod
+    def _cache_key(simulation_type,control_type,model_type,schema,parameters):
+        '''The key of a model run in the result cache, parameters is a dict or vector'''
+        return (simulation_type,control_type,model_type,schema.key(parameters))
+    
+    @staticmethod
+    def _run_arguments(simulation_type,control_type,parameters):
+        '''The number of steps and keyword arguments of a model run'''
+        if simulation_type == SIM_STATIC:
+            if control_type == MG_QUOTA:
+                variable,max = fisheries_model.static_maximum(parameters,'catch')
             else:
-                self.model_thread.run(self.model,100)
-            
-            self.computed_parameters = self.parameters
+                variable,max = fisheries_model.static_maximum(parameters,'effort')
+            return 100,{'dynamic': False,'independent_variable': variable,'independent_maximum': max}
+        return 100,{}
+    
+    def _speculative_jobs(self):
+        '''
+        Jobs precomputing the positions of the last moved slider just ahead of
+        (and behind) its current position, in steps the size of its last move
+        '''
+        if self.last_moved == None:
+            return []
+        param,move = self.last_moved
+        schema = self.model.get_schema()
+        index = schema.index[param]
+        
+        #One row of slider positions per speculative position of the slider
+        offsets = numpy.array(range(1,SPECULATIVE_AHEAD+1)+range(-1,-SPECULATIVE_BEHIND-1,-1))
+        positions = numpy.tile(self.positions,(len(offsets),1))
+        positions[:,index] += offsets*move
+        positions = positions[(positions[:,index] >= 0) & (positions[:,index] <= 1000)]
+        if len(positions) == 0:
+            return []
+        vectors = ParameterPanel.positions_to_values(schema,positions)
+        parameter_sets = [schema.to_dict(vector) for vector in vectors]
+        keys = [self._cache_key(SIM_TYPE,MG_TYPE,MODEL_TYPE,schema,vector) for vector in vectors]
+        
+        #All positions are computed at once by an ensemble run
+        model = self._create_model(MG_TYPE,MODEL_TYPE)
+        steps,arguments = self._run_arguments(SIM_TYPE,MG_TYPE,self.parameters)
+        if SIM_TYPE == SIM_STATIC:
+            arguments['independent_maximum'] = [self._run_arguments(SIM_TYPE,MG_TYPE,parameters)[1]['independent_maximum']
+                                                for parameters in parameter_sets]
+        return [vector_model.EnsembleJob(keys,model,parameter_sets,steps,arguments)]
+    
+    def _precompute(self):
+        '''
+        Precompute in the background the runs most likely to be needed next:
+        nearby positions of the last moved slider, then the other simulation types
+        '''
+        jobs = self._speculative_jobs()+self._variant_jobs()
+        if self.optimal_job != None:
+            jobs.insert(0,self.optimal_job)
+        self.model_thread.precompute(jobs)
+    
+    def _variant_jobs(self):
+        '''
+        Jobs precomputing the other simulation, control and model types, for
+        the parameter values the sliders will show after switching to them
+        '''
+        jobs = []
+        for model_type in sorted([MODEL_LOBSTER,MODEL_NET],key=lambda type: type != MODEL_TYPE):
+            for control_type in [MG_QUOTA,MG_EFFORT]:
+                for simulation_type in [SIM_STATIC,SIM_DYNAMIC]:
+                    if (simulation_type,control_type,model_type) == (SIM_TYPE,MG_TYPE,MODEL_TYPE):
+                        continue
+                    model = self._create_model(control_type,model_type)
+                    schema = model.get_schema()
+                    parameters = schema.to_dict(ParameterPanel.default_values(schema))
+                    model.set_parameters(parameters)
+                    model.reset()
+                    steps,arguments = self._run_arguments(simulation_type,control_type,parameters)
+                    key = self._cache_key(simulation_type,control_type,model_type,schema,parameters)
+                    jobs.append(fisheries_model.PrecomputeJob(key,model,steps,arguments))
+        return jobs
  
-    init_hack_count = 0
-    def on_timer_init_hack(self,event):
-        '''A hack to layout the plot panel after load. For some reason the legend is not displayed correctly.'''
-    	if DEBUG > 0:
-    		print("Frame.on_timer_init_hack")
-        
-        
-        if self.init_hack_count > 0:
-            self.timer_init_hack.Stop()
-        self.init_hack_count += 1
-        self.plot_panel.update_visibility()
-        self.plot_panel.OnSize()
-        self.plot_panel.Layout()
-        
     def set_model(self,simulation_type,control_type,model_type):
         global SIM_TYPE
         global MG_TYPE
@@ -196,28 +287,42 @@ class Frame(wx.Frame):
         MODEL_TYPE= model_type
         
         #Initialise the model with appropriate control type
-        if MG_TYPE == MG_QUOTA:
+        self.model = self._create_model(MG_TYPE,MODEL_TYPE)
+    
+    @staticmethod
+    def _model_name(model_type):
+        '''The name of a model type in fisheries_model.MODEL_FACTORIES'''
+        if model_type == MODEL_LOBSTER:
+            return 'lobster'
+        return 'fish'
+    
+    @staticmethod
+    def _create_model(control_type,model_type):
+        '''Create a model of the given control and model type'''
+        if control_type == MG_QUOTA:
             type='catch'
         else:
-        	type='effort'
+            type='effort'
 
-    	if MODEL_TYPE == MODEL_LOBSTER:
-    		self.model = fisheries_model.lobsterModel(control_type = type)
-    	else:
-	        self.model = fisheries_model.fishModel(control_type = type)
-	    
+        if model_type == MODEL_LOBSTER:
+            return fisheries_model.lobsterModel(control_type = type)
+        else:
+            return fisheries_model.fishModel(control_type = type)
+    
  
     def on_simulation_change(self,simulation_type,control_type,model_type):
         '''Called if the simulation type (static/dynamic, quota/effort controlled or model type) changes'''
-    	if DEBUG > 0:
-    		print("Frame.on_simulation_change")
+        TRACER.event("Frame.on_simulation_change")
         
         self.set_model(simulation_type,control_type,model_type)
         self.computed_parameters = None
+        self.positions = None
+        self.last_moved = None
+        self.optimal_job = None
         self.parameter_panel.set_model(self.model)
         self.on_slide_change(None)
-        print(self.model.state['catch'])
-        print(self.model.state.attributes['catch']['scale'])
+        #The new model is traced to the screen even if the parameter values are the same
+        self.generation = TRACER.begin()
         self.plot_panel.update_state(self.model.state)
         
         self.plot_panel._update_bounds()
@@ -231,44 +336,110 @@ class Frame(wx.Frame):
         
         self.on_timer_model(None)
 
+    def on_optimal_path(self):
+        '''Show the NPV maximising harvest path of the current parameters, until they change'''
+        TRACER.event("Frame.on_optimal_path")
+        
+        parameters = self.parameters
+        model = copy.deepcopy(self.model)
+        model.set_parameters(parameters)
+        model.reset()
+        steps,arguments = self._run_arguments(SIM_DYNAMIC,MG_TYPE,parameters)
+        
+        def update(state):
+            '''Show the path if the parameters have not changed since'''
+            if self.parameters == parameters:
+                self.optimal_job = None
+                self.model_data_updater(state)
+        
+        #The path is solved in the background and replaces the run of the current parameters
+        self.optimal_job = optimal_harvest.OptimalPathJob(model,steps,lambda state: wx.CallAfter(update,state))
+        self.model_thread.cancel()
+        self.computed_parameters = parameters
+        self._precompute()
+
+    def on_parameter_map(self):
+        '''Show a map of the NPV or yield over two parameters, at the current values of the others'''
+        TRACER.event("Frame.on_parameter_map")
+        
+        model = self._create_model(MG_TYPE,MODEL_TYPE)
+        steps,arguments = self._run_arguments(SIM_DYNAMIC,MG_TYPE,self.parameters)
+        frame = ParameterMapFrame(self,model,self.parameters,steps)
+        frame.Show()
+
     def on_slide_change(self,event):
         '''Get the latest set of parameters if the sliders have been moved'''
-    	if DEBUG > 0:
-    		print("Frame.on_slide_change")
+        TRACER.event("Frame.on_slide_change")
         
         
         #Store the latest set of parameters
 #        if event.GetEventObject() in self.parameter_panel.GetChildren():
-        self.parameters = self.parameter_panel.get_parameters()
+        positions = self.parameter_panel.get_positions()
+        
+        #Remember which slider moved and by how much for speculative precomputation
+        if self.positions is not None:
+            moved = numpy.nonzero(positions != self.positions)[0]
+            if len(moved) > 0:
+                index = moved[-1]
+                self.last_moved = (self.parameter_panel.schema.names[index],positions[index]-self.positions[index])
+        self.positions = positions
+        parameters = self.parameter_panel.get_parameters(positions)
+        if parameters != self.parameters:
+            self.generation = TRACER.begin()
+            self.optimal_job = None
+        self.parameters = parameters
             
-    def model_data_updater(self,state):
-    	if DEBUG > 0:
-    		print("Frame.model_data_updater")
-        
+    def model_data_updater(self,state,generation=None):
+        '''Show the output of a model run, generation is the parameter change it is of (see latency_trace)'''
+        TRACER.event("Frame.model_data_updater",generation=generation)
+        TRACER.mark(generation,'received')
     
         self.computed_complete=True
         self.model.state = state
-        self.plot_panel.update_state(self.model.state)
+        self.show_convergence(state)
+        self.plot_panel.update_state(self.model.state,generation=generation)
         min_size = self.sizer.GetMinSize()  
         self.SetMinSize(min_size)
+        
+        #Use the idle time to prepare for the next slider move or change of simulation type
+        self._precompute()
 
         
+    def show_convergence(self,state):
+        '''Report the equilibria of a static run that did not converge in the status bar'''
+        unconverged = []
+        if state.convergence != None:
+            unconverged = state.convergence['unconverged']
+        if len(unconverged) == 0:
+            self.status_bar.SetStatusText('')
+            return
+        TRACER.event("Frame.model_data_updater unconverged",points=len(unconverged))
+        if MG_TYPE == MG_QUOTA:
+            variable = 'catch'
+        else:
+            variable = 'effort'
+        self.status_bar.SetStatusText('%d of %d equilibria did not converge (%s from %g to %g)' %
+                                      (len(unconverged),len(state.convergence['iterations']),
+                                       variable,min(unconverged),max(unconverged)))
                                   
 
 class MenuBar(wx.MenuBar):
-    def __init__(self,parent_frame,sim_update_fx=None,parameter_type_fx=None,reset_model_fx=None):
-    	if DEBUG > 0:
-    		print("MenuBar.__init__")
+    def __init__(self,parent_frame,sim_update_fx=None,parameter_type_fx=None,reset_model_fx=None,optimal_path_fx=None,parameter_map_fx=None):
+        TRACER.event("MenuBar.__init__")
         
         wx.MenuBar.__init__(self)
         
         self.sim_update_fx = sim_update_fx
         self.parameter_type_fx=parameter_type_fx
         self.reset_model_fx = reset_model_fx
+        self.optimal_path_fx = optimal_path_fx
+        self.parameter_map_fx = parameter_map_fx
         self.parent_frame = parent_frame
         
         self.scenario_menu = wx.Menu()
         self.reset_model = self.scenario_menu.Append(-1,'Reset Model')
+        self.optimal_path = self.scenario_menu.Append(-1,'Optimal Harvest Path')
+        self.parameter_map = self.scenario_menu.Append(-1,'Parameter Map')
         self.scenario_menu.Append(-1,' ').Enable(False)        
         self.model_lobster=self.scenario_menu.AppendRadioItem(-1,MODEL_LOBSTER)
         self.model_net = self.scenario_menu.AppendRadioItem(-1,MODEL_NET)
@@ -284,6 +455,8 @@ class MenuBar(wx.MenuBar):
             self.static_simulation.Check()
         else:
             self.dynamic_simulation.Check()
+        #The optimal harvest path is a dynamic run
+        self.optimal_path.Enable(SIM_TYPE == SIM_DYNAMIC)
         if MG_TYPE == MG_QUOTA:
             self.output_control.Check()
         else:
@@ -302,6 +475,9 @@ class MenuBar(wx.MenuBar):
         self.help_menu = wx.Menu()
         self.about = self.help_menu.Append(-1,'About')
         self.license = self.help_menu.Append(-1,'License')
+        self.help_menu.AppendSeparator()
+        self.latency_overlay = self.help_menu.AppendCheckItem(-1,'Latency Overlay')
+        self.latency_export = self.help_menu.Append(-1,'Export Latency...')
         
         self.Append(self.scenario_menu,'Model')
         self.Append(self.parameter_menu,'Parameters')
@@ -315,11 +491,14 @@ class MenuBar(wx.MenuBar):
         parent_frame.Bind(wx.EVT_MENU, self.on_simulation_change, self.dynamic_simulation)
         parent_frame.Bind(wx.EVT_MENU, self.on_about,self.about)
         parent_frame.Bind(wx.EVT_MENU, self.on_license,self.license)
+        parent_frame.Bind(wx.EVT_MENU, self.on_latency_overlay,self.latency_overlay)
+        parent_frame.Bind(wx.EVT_MENU, self.on_latency_export,self.latency_export)
         parent_frame.Bind(wx.EVT_MENU, self.on_simulation_change, self.reset_model)
+        parent_frame.Bind(wx.EVT_MENU, self.on_optimal_path, self.optimal_path)
+        parent_frame.Bind(wx.EVT_MENU, self.on_parameter_map, self.parameter_map)
     
     def set_parameter_types(self,types):
-    	if DEBUG > 0:
-    		print("MenuBar.set_parameter_types")
+        TRACER.event("MenuBar.set_parameter_types")
     
         for item in self.parameter_items:
             self.parameter_menu.Delete(item)
@@ -335,15 +514,25 @@ class MenuBar(wx.MenuBar):
         
     def on_reset_model(self,event):
         '''Reset the model'''
-    	if DEBUG > 0:
-    		print("MenuBar.on_reset_model")
+        TRACER.event("MenuBar.on_reset_model")
         
         self.reset_model_fx()
 
+    def on_optimal_path(self,event):
+        '''Show the optimal harvest path'''
+        TRACER.event("MenuBar.on_optimal_path")
+        
+        self.optimal_path_fx()
+
+    def on_parameter_map(self,event):
+        '''Show a parameter map'''
+        TRACER.event("MenuBar.on_parameter_map")
+        
+        self.parameter_map_fx()
+
     def on_parameter_selection(self,event):
         '''Called when a parameter set is selected'''
-    	if DEBUG > 0:
-    		print("MenuBar.on_parameter_selection")
+        TRACER.event("MenuBar.on_parameter_selection")
         
         for item in self.parameter_items:
             if item.IsChecked():
@@ -351,8 +540,7 @@ class MenuBar(wx.MenuBar):
                        
         
     def on_simulation_change(self,event):
-    	if DEBUG > 0:
-    		print("MenuBar.on_simulation_change")
+        TRACER.event("MenuBar.on_simulation_change")
     	
     	
         if self.input_control.IsChecked():
@@ -369,14 +557,14 @@ class MenuBar(wx.MenuBar):
             simulation_type = SIM_STATIC
         else:
             simulation_type= SIM_DYNAMIC
+        self.optimal_path.Enable(simulation_type == SIM_DYNAMIC)
         self.sim_update_fx(simulation_type = simulation_type, control_type = control_type, model_type = model_type)
         event.Skip()
         
            
     def on_about(self,event):
         '''About handler, shows modal AboutBox'''
-    	if DEBUG > 0:
-    		print("MenuBar.on_about")
+        TRACER.event("MenuBar.on_about")
         
         dlg = AboutBox(self.parent_frame,title='About Fisheries Explorer',filename='about.html')
         dlg.ShowModal()
@@ -384,42 +572,56 @@ class MenuBar(wx.MenuBar):
                 
     def on_license(self,event):
         '''License handler, shows modal AboutBox'''
-    	if DEBUG > 0:
-    		print("MenuBar.on_license")
+        TRACER.event("MenuBar.on_license")
         
         dlg = AboutBox(self.parent_frame,title='Fisheries Explorer License',filename='OSL3.0.htm')
         dlg.ShowModal()
         dlg.Destroy()
+
+    def on_latency_overlay(self,event):
+        '''Show or hide the latency overlay on the plots'''
+        TRACER.event("MenuBar.on_latency_overlay")
+        
+        self.parent_frame.plot_panel.set_overlay(self.latency_overlay.IsChecked())
+
+    def on_latency_export(self,event):
+        '''Save the latency histograms and event log as JSON'''
+        TRACER.event("MenuBar.on_latency_export")
+        
+        dlg = wx.FileDialog(self.parent_frame,'Export Latency',defaultFile='latency.json',
+                            wildcard='JSON files (*.json)|*.json',style=wx.FD_SAVE|wx.FD_OVERWRITE_PROMPT)
+        if dlg.ShowModal() == wx.ID_OK:
+            TRACER.save(dlg.GetPath())
+        dlg.Destroy()
                 
 
 class ParameterPanel(wx.Panel):
     '''A panel for parameter input'''
     def __init__(self,parent,model = [],sim_update_fx=None):
-    	if DEBUG > 0:
-    		print("ParameterPanel.__init__")
+        TRACER.event("ParameterPanel.__init__")
     
         wx.Panel.__init__(self,parent)
         self.type_shown = 'All'
         self.model = model
         self.parameters = model.get_parameters()
+        self.schema = model.get_schema()
         self._base_layout()
         self.set_model(model)
         self.sim_update_fx = sim_update_fx
     
     def set_model(self,model):
         '''Set the parameters displayed in the panel (expects a Parameter object)'''
-    	if DEBUG > 0:
-    		print("ParameterPanel.set_model")
+        TRACER.event("ParameterPanel.set_model")
         self.model = model
         
         self.parameters = model.get_parameters()
+        self.schema = model.get_schema()
 
         self.parameter_layout()    
         self.show_parameter_set()
 
     def _base_layout(self):
-    	if DEBUG > 0:
-    		print("ParameterPanel._base_layout")
+        TRACER.event("ParameterPanel._base_layout")
         
         #Empty lists for storing gui objects (to get parameter values etc)
         self.label_parameters = {}
@@ -463,8 +665,7 @@ class ParameterPanel(wx.Panel):
         
         
     def parameter_layout(self):
-    	if DEBUG > 0:
-    		print("ParameterPanel.parameter_layout")
+        TRACER.event("ParameterPanel.parameter_layout")
 
         #Delete all existing objects
         if hasattr(self,'control_sizer'):
@@ -472,10 +673,11 @@ class ParameterPanel(wx.Panel):
 
         #Create the caption, value and slider for each parameter
         count = 0
+        default_positions = self.values_to_positions(self.schema,self.schema.default)
         for param in self.parameters:
             p = self.parameters[param]
             self.label_parameters[param]=wx.StaticText(self.control_panel,label=p['title']+':')
-            current_value = round((p['value']-p['min'])/float(p['max']-p['min'])*1000)
+            current_value = int(default_positions[self.schema.index[param]])
             self.slider_parameters[param]= wx.Slider(self.control_panel, -1, current_value, 0, 1000, wx.DefaultPosition, 
                                                      style= wx.SL_HORIZONTAL)
             self.label_param_values[param]=wx.StaticText(self.control_panel,label='')
@@ -492,24 +694,21 @@ class ParameterPanel(wx.Panel):
 
     
     def on_simulation_change(self,event):
-    	if DEBUG > 0:
-    		print("ParameterPanel.on_simulation_change")
+        TRACER.event("ParameterPanel.on_simulation_change")
     
         self.sim_update_fx(simulation_type = self.static_toggle.GetStringSelection(),
                            control_type = self.management_toggle.GetStringSelection())
     
     def on_selection_change(self,event):
         '''Update parameter list when a different parameter set is selected'''
-    	if DEBUG > 0:
-    		print("ParameterPanel.on_selection_change")
+        TRACER.event("ParameterPanel.on_selection_change")
         
         type = self.parameter_choice.GetItems()[self.parameter_choice.GetSelection()]
         self.show_parameter_set(type)
         
     def show_parameter_set(self,type=None):
         '''Show parameters of type'''
-    	if DEBUG > 0:
-    		print("ParameterPanel.show_parameter_set")
+        TRACER.event("ParameterPanel.show_parameter_set")
         
         
         #If type is unspecified we show the same parameter set
@@ -533,8 +732,7 @@ class ParameterPanel(wx.Panel):
         
     def on_slide_change(self,event):
         '''Slider change event updates value label'''
-    	if DEBUG > 0:
-    		print("ParameterPanel.on_slide_change")
+        TRACER.event("ParameterPanel.on_slide_change")
         
         param_values = self.get_parameters()
         for param in (param_values):
@@ -547,22 +745,38 @@ class ParameterPanel(wx.Panel):
         if event != None:
             event.Skip()
 
-    def get_parameters(self):
-        '''Get a dict of the current parameter values'''
-    	if DEBUG > 0:
-    		print("ParameterPanel.get_parameters")
-        
-        out = {}
-        for param in self.parameters:
-            p = self.parameters[param]
-            out[param] = float(self.slider_parameters[param].GetValue())/1000.0*(p['max']-p['min'])+p['min']
+    def get_positions(self):
+        '''Get a vector of the slider positions, ordered by the parameter schema'''
+        return numpy.array([self.slider_parameters[param].GetValue() for param in self.schema.names])
+    
+    def get_parameters(self,positions=None):
+        '''Get a dict of the current parameter values (or those of a vector of slider positions)'''
+        TRACER.event("ParameterPanel.get_parameters")
         
-        return out
+        if positions is None:
+            positions = self.get_positions()
+        return self.schema.to_dict(self.positions_to_values(self.schema,positions))
+    
+    @staticmethod
+    def values_to_positions(schema,values):
+        '''The slider positions (0 to 1000) closest to a vector (or array of vectors) of parameter values'''
+        positions = (values-schema.min)/(schema.max-schema.min)*1000
+        #Round halves away from zero
+        return (numpy.sign(positions)*numpy.floor(numpy.abs(positions)+0.5)).astype(int)
+    
+    @staticmethod
+    def positions_to_values(schema,positions):
+        '''The parameter values of a vector (or array of vectors) of slider positions'''
+        return numpy.asarray(positions,dtype=float)/1000.0*(schema.max-schema.min)+schema.min
+    
+    @staticmethod
+    def default_values(schema):
+        '''The vector of values the sliders show for parameters set to their defaults'''
+        return ParameterPanel.positions_to_values(schema,ParameterPanel.values_to_positions(schema,schema.default))
     
     def set_parameters(self,parameter_values):
         '''Update parameters from a dict'''
-    	if DEBUG > 0:
-    		print("ParameterPanel.set_parameters")
+        TRACER.event("ParameterPanel.set_parameters")
         
         out = {}
         for param in parameter_values.keys():
@@ -574,17 +788,8 @@ class ParameterPanel(wx.Panel):
          
 class PlotPanel(wx.Panel):
     
-    line_colours = colourblind.rgbScaled
-    line_styles = [[127,1],         #solid
-                   [5,5],           #dashed
-                   [20,20,2,20],       #dash-dot
-                   [2,2,2,2]        #dotted
-                   ]
-    
-    
     def __init__(self,parent):
-    	if DEBUG > 0:
-    		print("PlotPanel.__init__")
+        TRACER.event("PlotPanel.__init__")
     
         wx.Panel.__init__(self,parent)
 
@@ -593,6 +798,7 @@ class PlotPanel(wx.Panel):
 
         self.fig = Figure()
         self.fig.set_facecolor([1,1,1])
+        self.layout = plot_layout.FigureLayout(self.fig)
         
         self.control_panel = wx.Panel(self)
         self.canvas_panel = wx.Panel(self)
@@ -614,8 +820,11 @@ class PlotPanel(wx.Panel):
 #        self.canvas.SetAutoLayout(True)
         self.canvas_panel.SetMinSize([600,300])
         self.state = None
-        self.bounds = {}
-        self.xbound = 0
+        #Nothing is drawn until the frame is shown and laid out (see start_drawing)
+        self.drawing = False
+        #The latency overlay (see latency_trace), shown from the Help menu
+        self.show_overlay = False
+        self.overlay = None
         self.SetBackgroundColour(wx.WHITE)
         self.canvas_panel.SetBackgroundColour(wx.WHITE)
         self.control_panel.SetBackgroundColour(wx.WHITE)    
@@ -623,8 +832,7 @@ class PlotPanel(wx.Panel):
         self.Fit()
     
     def OnSize(self,event=None,size=None):
-    	if DEBUG > 0:
-    		print("PlotPanel.OnSize")
+        TRACER.event("PlotPanel.OnSize")
         
         if event == None and size == None:
             size = self.canvas_panel.GetClientSize()
@@ -637,7 +845,12 @@ class PlotPanel(wx.Panel):
             self.fig.set_figwidth(size[0]/(1.0*self.fig.get_dpi()))
             self.fig.set_figheight(size[1]/(1.0*self.fig.get_dpi()))
             self.canvas.SetClientSize(size)
-            self.redraw(None, redraw=True)
+            self.layout.set_pixel_width(size[0])
+            if self.drawing:
+                self.redraw(None, redraw=True)
+            else:
+                #The axes are set up at the next redraw
+                self.last_selected_parameters = {}
         
         
         if event != None:
@@ -645,10 +858,8 @@ class PlotPanel(wx.Panel):
         
 
     def _setup_control_panel(self):
-    	if DEBUG > 0:
-    		print("PlotPanel._setups_control_panel")
+        TRACER.event("PlotPanel._setups_control_panel")
     
-        self._update_line_styles()
         
         #Remove existing widgets
         self.control_sizer.Clear(True)
@@ -676,9 +887,9 @@ class PlotPanel(wx.Panel):
 #        self.check_boxes = {}
         linedc = wx.MemoryDC()
         for param in parameters:
-            rgbcolour = self.unit_colour[self.state.get_attribute_units(param)]
+            rgbcolour = self.layout.unit_colour[self.state.get_attribute_units(param)]
             self.colours[param] = wx.Colour(rgbcolour[0]*255,rgbcolour[1]*255,rgbcolour[2]*255)
-            style = self.parameter_style[param]
+            style = self.layout.parameter_style[param]
 
             #Add the check box
             self.check_boxes[param] = wx.CheckBox(self.control_panel,-1,'')
@@ -712,8 +923,7 @@ class PlotPanel(wx.Panel):
         '''
         updates the colours of the control elements
         '''
-    	if DEBUG > 0:
-    		print("PlotPanel._colour_control")
+        TRACER.event("PlotPanel._colour_control")
         
         selected = self.get_selected_parameters()
         for param in self.state.attributes:
@@ -726,42 +936,16 @@ class PlotPanel(wx.Panel):
         
 
             
-    def _update_line_styles(self):
-        '''
-        Update the colour and style associated with each unit and parameter
-        ''' 
-    	if DEBUG > 0:
-    		print("PlotPanel._update_line_styles")
-        
-        self.unit_colour = {}
-        self.parameter_style = {}
-        
-        #For tracking the number of parameters per unit
-        unit_count = {}
-        
-        #Determine colours for units
-        for unit in self.state.unit_order:
-            self.unit_colour[unit] = self.line_colours[len(self.unit_colour)]
-            unit_count[unit] = 0
-            
-        #Determine line styles for parameters
-        for param in self.state.attribute_order:
-            unit = self.state.get_attribute_units(param)
-            self.parameter_style[param] = self.line_styles[unit_count[unit]]
-            unit_count[unit] += 1
-
     def _select_parameters(self,parameters = [],redraw=True):
         '''Set the parameters to be plotted'''
-    	if DEBUG > 0:
-    		print("PlotPanel._select_parameters")
+        TRACER.event("PlotPanel._select_parameters")
         
         self.parameters = parameters
         if redraw: 
             self.redraw_fromscratch()
         
     def update_visibility(self):
-    	if DEBUG > 0:
-    		print("PlotPanel.update_visibility")
+        TRACER.event("PlotPanel.update_visibility")
     
         if SIM_TYPE == SIM_STATIC:
             enabled = False
@@ -771,81 +955,61 @@ class PlotPanel(wx.Panel):
         self.param_text['discounted_profit'].Show(enabled)
         self.param_bitmap['discounted_profit'].Show(enabled)
         
-    def update_state(self,state,redraw=True):
-        '''Update the state that is being plotted'''
-    	if DEBUG > 0:
-    		print("PlotPanel.update_state")
+    def update_state(self,state,redraw=True,generation=None):
+        '''Update the state that is being plotted, generation is the parameter change it is of (see latency_trace)'''
+        TRACER.event("PlotPanel.update_state")
         
         self.state = copy.deepcopy(state)
         if not hasattr(self,'last_parameters'):
             self.last_parameters = {}
             
-        import numpy
-        self.npv = numpy.nansum(self.state['discounted_profit'])
-#        discount_rate = 0.05
-        
-#        for index in range(len(self.state['revenue'])):
-#            if self.state['revenue'][index] != None and ~numpy.isnan(self.state['revenue'][index]):
-#                self.npv += (self.state['revenue'][index]-self.state['cost'][index])*(1-discount_rate)**index
+        self.layout.set_state(self.state)
+        TRACER.mark(generation,'updated')
              
         if redraw:
             #Update the parameter selection controls if necessary
             if state.attributes != self.last_parameters:
                 self._setup_control_panel()
+                self.update_visibility()
                 self.last_parameters = state.attributes
-            self.redraw()
+                self._layout_controls()
+            self.redraw(generation=generation)
+
+    def _layout_controls(self):
+        '''Lay out new controls, resizing the canvas without drawing (the caller redraws)'''
+        drawing = self.drawing
+        self.drawing = False
+        self.Layout()
+        self.OnSize()
+        self.drawing = drawing
+
+    def start_drawing(self):
+        '''Start drawing, once the frame is shown and laid out, at the final canvas size'''
+        TRACER.event("PlotPanel.start_drawing")
+        
+        self.drawing = True
+        #Redraw from scratch even if the size is unchanged
+        self.last_redraw_size = []
+        self.OnSize()
+
+    def _update_simulation(self):
+        '''Pass the current simulation and management type on to the layout'''
+        if MG_TYPE == MG_QUOTA:
+            control_type = 'catch'
+        else:
+            control_type = 'effort'
+        self.layout.set_simulation(SIM_TYPE == SIM_DYNAMIC,control_type)
 
     def _update_bounds(self):
         '''Update the figure bounds'''
-    	if DEBUG > 0:
-    		print("PlotPanel._update_bounds")
+        TRACER.event("PlotPanel._update_bounds")
 
-            
-        def sig_round(number):
-            '''Ceil a number to a nice round figure for limits'''
-            if number == 0:
-                return 0
-            sig = number/(10**numpy.floor(numpy.log10(number*2)))
-            
-            if sig < 2:
-                factor_multiple = 2.0
-            elif sig < 5:
-                factor_multiple = 2.0
-            else:
-                factor_multiple = 1.0
-            
-            
-            factor = 10**(numpy.floor(numpy.log10(number*factor_multiple)))/factor_multiple
-            rounded = numpy.ceil(number/factor)*factor
-            return rounded
-            
-        self.xbound = 0
-        self.bounds = {}
-        for unit in self._get_units():
-            self.bounds[unit]=[float('inf'), -float('inf')]
-            
-        for param in self.get_selected_parameters():
-            unit = self.state.get_attribute_units(param)
-            yv = numpy.asarray(self.state[param])/self.state.attributes[param]['scale']
-            self.bounds[unit][0] = min(self.bounds[unit][0], numpy.nanmin(yv))
-            self.bounds[unit][1] = max(self.bounds[unit][1], numpy.nanmax(yv))
-            self.bounds[unit][0] = sig_round(self.bounds[unit][0])
-            self.bounds[unit][1] = sig_round(self.bounds[unit][1])            
-            if SIM_TYPE == SIM_DYNAMIC:
-                self.xbound = max(self.xbound,len(self.state[param])-1)
-        if SIM_TYPE == SIM_STATIC:
-            if MG_TYPE == MG_QUOTA:
-                self.xbound = numpy.nanmax(numpy.asarray(self.state['catch'])/self.state.attributes['catch']['scale'])
-                
-            else:
-                self.xbound = numpy.nanmax(numpy.asarray(self.state['effort'])/self.state.attributes['effort']['scale'])
-            self.xbound = sig_round(self.xbound)
+        self._update_simulation()
+        self.layout.selected = self.get_selected_parameters()
+        self.layout.update_bounds()
 
-       
     def get_selected_parameters(self):
         '''Return the parameters that have been selected for plotting'''
-#    	if DEBUG > 0:
-#    		print("PlotPanel.get_selected_parameters")
         
         out = []
         for param in self.state.attribute_order:
@@ -853,157 +1017,164 @@ class PlotPanel(wx.Panel):
                 out.append(param)
         return out
                 
-    def _get_units(self):
-        '''
-        Returns a list of units that will be plotted
-        '''
-#    	if DEBUG > 0:
-#    		print("PlotPanel._get_units")
-        
-        units = {}
-        for param in self.get_selected_parameters():
-            units[self.state.get_attribute_units(param)]=1
-        
-        return units.keys()
-
-    def _setup_axes(self):
-        '''
-        Redraw the figure from scratch
-        required if the number of axes etc. have changed
-        '''
-    	if DEBUG > 0:
-    		print("PlotPanel._setup_axes")
-        
-        #Clear the figure
-        self.fig.clf()
-
-        #Add the new axes
-        self.axes = {}
-        self.plot_data = {}
-        self.axes_xscale = {}
-        
-        max_width = 0.87
-        width_increment = 0.07
-        bottom_space = .13
-        pos=[.05, bottom_space, max_width-width_increment*(len(self._get_units())-1), 1-bottom_space-0.05]
-        
-        #Create the axes, one for each unit
-        for unit in self._get_units():
-            first_figure = len(self.axes)==0
-            colour = self.unit_colour[unit]
-            
-            self.axes[unit] = self.fig.add_axes(pos,frameon=True,label=unit)
-            self.axes[unit].yaxis.tick_right()
-            self.axes[unit].yaxis.set_label_position('right')
-            self.axes[unit].set_ylabel(unit)
-
-            self.axes_xscale[unit] = pos[2]/(max_width-width_increment*(len(self._get_units())-1))
-            if not first_figure:
-                self.axes[unit].patch.set_alpha(0)
-            else:
-                self.firstaxes = self.axes[unit]
-                self.axes[unit].set_xlabel('Years')
-            self._modify_axes(self.axes[unit],colour,not first_figure)
-            
-            pos[2] += width_increment
-            
-        #Create the plot lines, one for each parameter
-        for param in self.get_selected_parameters():
-            unit = self.state.get_attribute_units(param)
-            colour = self.unit_colour[unit]
-            style = self.parameter_style[param]
-            
-            self.plot_data[param] = self.axes[unit].plot([0,0],[0,0],linewidth=2)[0]
-            self.plot_data[param].set_color(colour)
-            self.plot_data[param].set_dashes(style)
-            
-        #Text for npv
-        self.npvtext = self.fig.text(.1,bottom_space,'NPV')
-            
-    def redraw(self,event=None,redraw=False):
+    def redraw(self,event=None,redraw=False,generation=None):
         '''
         Update the plots using data in the current state
+        generation: the parameter change the state is of (see latency_trace)
         '''
-    	if DEBUG > 0:
-    		print("PlotPanel.redraw")
+        TRACER.event("PlotPanel.redraw")
         
-        if self.state == None:
+        if self.state == None or not self.drawing:
             return  
 
         if not hasattr(self,'last_selected_parameters'):
             self.last_selected_parameters = {}
         
-        #If the selected parameters have changed we need new axes
+        #If the selected parameters have changed the axes and lines shown change
         if self.last_selected_parameters != self.get_selected_parameters() or redraw:
             self.last_selected_parameters = self.get_selected_parameters()
             self._colour_control()
-            self._setup_axes()
+            self.layout.setup_axes(self.last_selected_parameters)
               
-        self._update_bounds()
-
-        #Update axes bounds
-        for unit in self._get_units():
-            bounds = self.bounds[unit]
-            self.axes[unit].set_ybound(lower = 0,upper = bounds[1])
-            self.axes[unit].set_xbound(lower = 0,upper=self.xbound*self.axes_xscale[unit])
-
-        #Update plot data
-        for param in self.get_selected_parameters():
-            data = self.state[param]
-            if SIM_TYPE == SIM_DYNAMIC:
-                self.plot_data[param].set_xdata(range(len(data)))
-            else:
-                if MG_TYPE == MG_QUOTA:
-                    self.plot_data[param].set_xdata(numpy.asarray(self.state['catch'])/self.state.attributes['catch']['scale'])
-                else:
-                    self.plot_data[param].set_xdata(numpy.asarray(self.state['effort'])/self.state.attributes['effort']['scale'])
-            self.plot_data[param].set_ydata(numpy.asarray(data)/self.state.attributes[param]['scale'])
-        
-        if SIM_TYPE == SIM_DYNAMIC:
-            self.firstaxes.set_xlabel('Years')
-        else:
-            if MG_TYPE == MG_QUOTA:
-                xunit = 'catch'
-            else:
-                xunit = 'effort'
-            self.firstaxes.set_xlabel('Management Control: ' + self.state.attributes[xunit]['title'] + ' (' + self.state.attributes[xunit]['units'] + ')')   
-            
-        if SIM_TYPE == SIM_DYNAMIC and ~numpy.isnan(self.npv):
-            self.npvtext.set_text('NPV: $' + str(int(round(self.npv/self.state.attributes['revenue']['scale']))) + ' million')
-        else:
-            self.npvtext.set_text('')
+        self._update_simulation()
+        self.layout.update_plot()
+        TRACER.mark(generation,'redrawn')
+        self._update_overlay()
         self.canvas.draw()
-        
-    @staticmethod
-    def _modify_axes(axes,color,remove = False):
+        TRACER.mark(generation,'drawn')
+
+    def set_overlay(self,show):
+        '''Show or hide the latency overlay (see latency_trace)'''
+        self.show_overlay = show
+        self._update_overlay()
+        self.canvas.draw()
+
+    def _update_overlay(self):
+        '''Update the text of the latency overlay, (re)creating it if the figure was cleared'''
+        if not self.show_overlay:
+            if self.overlay != None and self.overlay in self.fig.texts:
+                self.overlay.remove()
+            return
+        if self.overlay == None or self.overlay not in self.fig.texts:
+            self.overlay = self.fig.text(0.01,0.99,'',ha='left',va='top',family='monospace',fontsize=7,
+                                         bbox={'facecolor': 'white','alpha': 0.8})
+        self.overlay.set_text(TRACER.summary_text())
+        
+class ParameterMapFrame(wx.Frame):
+    '''
+    A map of the NPV or yield of dynamic runs over two parameters (see
+    parameter_map), at the values of the other parameters when it was opened.
+    The map is refined on a timer, so it appears coarse at once and sharpens.
+    '''
+    def __init__(self,parent,model,parameters,steps):
         '''
-        Set the colour of the y axis to color and optionally 
-        remove the remaining borders of the graph   
+        model: a model to run
+        parameters: the values of the parameters
+        steps: the time steps of each run
         '''
-    	if DEBUG > 0:
-    		print("PlotPanel._modify_axes")
-        
-        def modify_all(object,color=None,remove=False):
-            for child in object.get_children():
-                modify_all(child,color,remove)
-            
-            if remove and hasattr(object,'set_visible'):
-                object.set_visible(not remove)
-            
-            if color != None and hasattr(object,'set_color'):
-    
-                object.set_color(color)
-                        
-        for child in axes.get_children():
-            if isinstance(child, matplotlib.spines.Spine):
-                if child.spine_type == 'right':
-                    modify_all(child,color=color)
-                elif remove == True:
-                    modify_all(child,remove=True)
-        
-        modify_all(axes.yaxis,color=color)
-        if remove:
-            modify_all(axes.xaxis,remove=True)
+        TRACER.event("ParameterMapFrame.__init__")
+
+        wx.Frame.__init__(self,parent,size=wx.Size(900,600),title='Parameter Map')
+        self.map = parameter_map.ParameterMap(model,steps)
+        self.parameters = parameters
+        schema = self.map.schema
+        self.names = list(schema.names)
+        self.measures = sorted(parameter_map.MEASURES.keys())
+
+        #The parameters, ranges, measure and colour map shown
+        self.control_panel = wx.Panel(self)
+        self.control_sizer = wx.FlexGridSizer(rows=8,cols=2,hgap=5,vgap=5)
+        self.control_panel.SetSizer(self.control_sizer)
+        titles = [schema.parameters[name]['title'] for name in self.names]
+        self.x_choice = wx.Choice(self.control_panel,-1,choices=titles)
+        self.y_choice = wx.Choice(self.control_panel,-1,choices=titles)
+        self.x_low = wx.Slider(self.control_panel,-1,0,0,parameter_map.POSITIONS,style=wx.SL_HORIZONTAL)
+        self.x_high = wx.Slider(self.control_panel,-1,parameter_map.POSITIONS,0,parameter_map.POSITIONS,style=wx.SL_HORIZONTAL)
+        self.y_low = wx.Slider(self.control_panel,-1,0,0,parameter_map.POSITIONS,style=wx.SL_HORIZONTAL)
+        self.y_high = wx.Slider(self.control_panel,-1,parameter_map.POSITIONS,0,parameter_map.POSITIONS,style=wx.SL_HORIZONTAL)
+        self.measure_choice = wx.Choice(self.control_panel,-1,choices=[parameter_map.MEASURES[measure]['title'] for measure in self.measures])
+        self.colour_choice = wx.Choice(self.control_panel,-1,choices=['Default']+parameter_map.COLOURMAPS)
+        for label,control in [('Horizontal:',self.x_choice),('From:',self.x_low),('To:',self.x_high),
+                              ('Vertical:',self.y_choice),('From:',self.y_low),('To:',self.y_high),
+                              ('Measure:',self.measure_choice),('Colours:',self.colour_choice)]:
+            self.control_sizer.Add(wx.StaticText(self.control_panel,-1,label),0,flag=wx.ALIGN_CENTER_VERTICAL | wx.ALIGN_RIGHT)
+            self.control_sizer.Add(control,0,flag=wx.EXPAND)
+
+        #The management control by the beach price (or the next parameter)
+        x = model.get_control_variable()
+        y = 'beach_price'
+        if y not in self.names:
+            y = [name for name in self.names if name != x][0]
+        self.x_choice.SetSelection(self.names.index(x))
+        self.y_choice.SetSelection(self.names.index(y))
+        self.measure_choice.SetSelection(self.measures.index('npv'))
+        self.colour_choice.SetSelection(0)
+
+        self.fig = Figure()
+        self.fig.set_facecolor([1,1,1])
+        self.layout = parameter_map.MapLayout(self.fig)
+        self.canvas = FigCanvas(self,wx.ID_ANY,self.fig)
+
+        self.sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.sizer.Add(self.canvas,1,wx.EXPAND)
+        self.sizer.Add(self.control_panel,0,wx.ALIGN_CENTER | wx.ALL,5)
+        self.SetSizer(self.sizer)
+        self.SetBackgroundColour(wx.WHITE)
+        self.control_panel.SetBackgroundColour(wx.WHITE)
+
+        self.control_panel.Bind(wx.EVT_CHOICE,self.on_view_change)
+        self.control_panel.Bind(wx.EVT_SCROLL,self.on_view_change)
+        self.Bind(wx.EVT_CLOSE,self.on_close)
+
+        #Timer for refining the map
+        self.timer = wx.Timer(self)
+        self.timer.Start(50)
+        wx.EVT_TIMER(self,self.timer.GetId(),self.on_timer)
+        self.on_view_change(None)
+
+    @staticmethod
+    def _range(low,high):
+        '''The slider positions of an axis, at least one position apart'''
+        low,high = sorted([low.GetValue(),high.GetValue()])
+        if high == low:
+            if high < parameter_map.POSITIONS:
+                high += 1
+            else:
+                low -= 1
+        return low,high
+
+    def on_view_change(self,event):
+        '''Show the map of the selected parameters, ranges and measure'''
+        TRACER.event("ParameterMapFrame.on_view_change")
+
+        self.map.set_view(self.parameters,
+                          self.names[self.x_choice.GetSelection()],
+                          self.names[self.y_choice.GetSelection()],
+                          self._range(self.x_low,self.x_high),
+                          self._range(self.y_low,self.y_high),
+                          self.measures[self.measure_choice.GetSelection()])
+        colourmap = None
+        if self.colour_choice.GetSelection() > 0:
+            colourmap = parameter_map.COLOURMAPS[self.colour_choice.GetSelection()-1]
+        self.layout.set_colourmap(colourmap)
+        self.drawn = False
+
+    def on_timer(self,event):
+        '''Refine the map for a while and redraw it'''
+        if self.drawn and self.map.complete():
+            return
+        start = time.time()
+        while time.time()-start < MAP_REFINE_TIME and self.map.refine() > 0:
+            pass
+        self.layout.update(self.map)
+        self.canvas.draw()
+        self.drawn = True
+
+    def on_close(self,event):
+        TRACER.event("ParameterMapFrame.on_close")
+
+        self.timer.Stop()
+        event.Skip()
 
 class AboutBox(wx.Dialog):
     '''An about dialog box, which displays a html file'''
@@ -1014,8 +1185,7 @@ class AboutBox(wx.Dialog):
         title: dialog box title
         filename: the html file to show
         '''
-    	if DEBUG > 0:
-    		print("AboutBox.__init__")
+        TRACER.event("AboutBox.__init__")
         
         wx.Dialog.__init__(self,parent,-1,title,size=(500,550))
         
@@ -1047,8 +1217,9 @@ class App(wx.App):
         self.frame = Frame(x,y)
         self.SetTopWindow(self.frame)
         self.frame.Show()
+        #A single layout, then the first plot is drawn at its final size
         self.frame.Layout()
-        
+        self.frame.plot_panel.start_drawing()
         
         return True
     
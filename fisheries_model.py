@@ -7,9 +7,17 @@ This program is released under the Open Software License ("OSL") v. 3.0. See OSL
 '''
 
 import threading
-import wx
-from pylab import *
+from numpy import *
+from numpy.random import RandomState
 import copy
+import collections
+import serialization
+try:
+    import wx
+except ImportError:
+    #wx is only needed to hand results back to the GUI thread, the model
+    #itself can run headless (eg. for report rendering)
+    wx = None
 
 class Parameter(dict):
     """
@@ -29,6 +37,117 @@ class Parameter(dict):
         self['scale'] = scale
         self['scale_text']=scale_text
 
+class ParameterSchema:
+    """
+    Precomputed description of the parameters of a model
+    Parameter values are ordered by name, so a set of parameter values is a
+    flat vector with one element per name, and min, max, scale and default are
+    arrays of the same order for vectorised calculations. The schema must not
+    be modified (the arrays are read only).
+    """
+    
+    def __init__(self,parameters):
+        """
+        parameters: a dict of Parameter objects by name (see Model.get_parameters)
+        """
+        self.parameters = parameters
+        self.names = tuple(sorted(parameters.keys()))
+        self.index = dict([(name,i) for i,name in enumerate(self.names)])
+        self.size = len(self.names)
+        self.min = self._array('min')
+        self.max = self._array('max')
+        self.scale = self._array('scale')
+        self.default = self._array('value')
+        #Parameter types in order of first appearance
+        self.types = []
+        for name in self.names:
+            if parameters[name]['type'] not in self.types:
+                self.types.append(parameters[name]['type'])
+        
+    def _array(self,item):
+        """Return a read only array of an item of each parameter"""
+        values = array([float(self.parameters[name][item]) for name in self.names])
+        values.flags.writeable = False
+        return values
+    
+    def to_vector(self,values,fill=None):
+        """
+        Return a vector of parameter values from a dict
+        fill: the value of parameters missing from values (default their defaults)
+        """
+        if fill == None:
+            vector = self.default.copy()
+        else:
+            vector = ones(self.size)*fill
+        for name in values:
+            vector[self.index[name]] = values[name]
+        return vector
+    
+    def to_dict(self,vector):
+        """Return a dict of parameter values from a vector"""
+        return dict(zip(self.names,asarray(vector,dtype=float).tolist()))
+    
+    def key(self,values):
+        """Return a hashable key of a dict (or vector) of parameter values, eg. for caching"""
+        if isinstance(values,dict):
+            values = self.to_vector(values)
+        return tuple(asarray(values,dtype=float).tolist())
+    
+    def __deepcopy__(self,memo):
+        #The schema is not modified so copies of a model can share it
+        return self
+
+class Schedule:
+    """
+    A parameter value that varies by time step, eg. a TAC phase down
+    Any parameter value may be a schedule, Model.run gives the components the
+    value of each time step. values[i] is the value at time step i+1 (the
+    first step of a run is time step 1), the last value holds after the end
+    and the first before the start. A value may be an array, eg. one per run
+    of a vectorised model, so that a batch of schedules runs at once.
+    """
+    
+    def __init__(self,values):
+        self.values = asarray(values,dtype=float)
+    
+    def at(self,time):
+        """Return the value at a time step, or the values at an array of time steps"""
+        return self.values[clip(asarray(time)-1,0,len(self.values)-1)]
+    
+    @staticmethod
+    def batch(values,steps):
+        """
+        Return a schedule of arrays, one element per value, for batches of runs
+        values: a list of schedules or constant values
+        steps: the number of time steps of the runs
+        """
+        times = arange(1,steps+1)
+        columns = []
+        for value in values:
+            if isinstance(value,Schedule):
+                columns.append(value.at(times))
+            else:
+                columns.append(ones(steps)*value)
+        return Schedule(array(columns).T)
+
+class PiecewiseSchedule(Schedule):
+    """
+    A parameter value that is a piecewise function of time: values[i] from
+    time step times[i] until the next time (or changing linearly to the next
+    value if interpolate). Values are held before the first and after the last time.
+    """
+    
+    def __init__(self,times,values,interpolate=False):
+        self.times = asarray(times,dtype=float)
+        self.values = asarray(values,dtype=float)
+        self.interpolate = interpolate
+    
+    def at(self,time):
+        if self.interpolate:
+            return interp(time,self.times,self.values)
+        index = searchsorted(self.times,time,side='right')-1
+        return self.values[clip(index,0,len(self.values)-1)]
+
 class Component:
     """
     Model component class
@@ -44,6 +163,21 @@ class Component:
       return {}
   
   
+    def get_derived_columns(self):
+      """
+      Returns the state attributes derived from others by this component
+      The format is a dictionary, keys are attribute name, value is a function
+      of the time steps and parameter values (see State.set_derived)
+      """
+      return {}
+  
+    def check_parameters(self,parameters):
+      """
+      Raises ValueError if this component cannot be run with the parameter
+      values, eg. a value it divides by is zero
+      """
+      pass
+  
     def execute(self,state,parameters):
       """Executes this component and returns the modified state"""
       return state
@@ -62,6 +196,10 @@ class PDLogistic(Component):
     def get_parameters(self):
         return {'r': self.r,'K': self.K}
     
+    def check_parameters(self,parameters):
+        if not parameters['K'] > 0:
+            raise ValueError('K must be positive')
+    
   
     #Execute a logistic step
     def execute(self,state,parameters,equilibrium=False):
@@ -93,13 +231,14 @@ class PDLogistic(Component):
 class CatchFixed(Component):
     """Fixed catch component with simplistic CPUE/effort calculation"""
     
-    catch_rate = Parameter(title='Max catch rate',
-                           description='The biomass caught per unit of effort',
-                           type='Fleet dynamics')
-    catch = Parameter(title='TAC',
-                      description='Total allowable catch',
-                      type='Management Controls'
-                      )        
+    def __init__(self):
+        self.catch_rate = Parameter(title='Max catch rate',
+                                    description='The biomass caught per unit of effort',
+                                    type='Fleet dynamics')
+        self.catch = Parameter(title='TAC',
+                               description='Total allowable catch',
+                               type='Management Controls'
+                               )        
     
     def get_parameters(self):
         return {'catch_rate': self.catch_rate, 'catch': self.catch}
@@ -126,13 +265,14 @@ class CatchFixed(Component):
 class EffortFixed(Component):
     """Fixed catch component with simplistic CPUE/effort calculation"""
     
-    catch_rate = Parameter(title='Max catch rate',
-                           description='The biomass caught per unit of effort',
-                           type='Fleet dynamics')
-    effort = Parameter( title='Effort',
-                        description='Fishing effort',
-                        type='Management Controls'
-                        )
+    def __init__(self):
+        self.catch_rate = Parameter(title='Max catch rate',
+                                    description='The biomass caught per unit of effort',
+                                    type='Fleet dynamics')
+        self.effort = Parameter( title='Effort',
+                                 description='Fishing effort',
+                                 type='Management Controls'
+                                 )
     
     def get_parameters(self):
         return {'catch_rate': self.catch_rate, 'effort': self.effort}
@@ -150,24 +290,126 @@ class EffortFixed(Component):
         
         return state
 
+
+class HarvestControlRule(CatchFixed):
+    """
+    Catch component with the TAC set each time step by a harvest control rule
+    from an observation of the stock at the start of the time step, in place
+    of CatchFixed (for dynamic runs)
+    """
+    
+    def __init__(self,rule=None,observation='cpue',observation_error=0,generator=None):
+        """
+        rule: a function of the observed values and the parameter values that
+        returns the TAC, eg. mse.ThresholdRule (it may be given arrays)
+        observation: the stock observed, 'cpue' or 'biomass'
+        observation_error: the standard deviation of the (lognormal) observation error
+        generator: the numpy RandomState of the observation error
+        """
+        CatchFixed.__init__(self)
+        self.rule = rule
+        self.observation = observation
+        self.observation_error = observation_error
+        if generator == None:
+            generator = RandomState()
+        self.generator = generator
+    
+    def get_parameters(self):
+        return {'catch_rate': self.catch_rate}
+    
+    def observe(self,state,parameters):
+        """Return the observed biomass or cpue at the start of the time step"""
+        observed = state['biomass'][-2]
+        if self.observation == 'cpue':
+            observed = observed/parameters['K']*parameters['catch_rate']
+        if self.observation_error > 0:
+            sd = self.observation_error
+            observed = observed*exp(self.generator.normal(-sd**2/2,sd,shape(observed)))
+        return observed
+    
+    def tac_parameters(self,state,parameters):
+        """Return the parameter values with the catch set by the rule"""
+        parameters = dict(parameters)
+        parameters['catch'] = self.rule(self.observe(state,parameters),parameters)
+        return parameters
+    
+    def execute(self,state,parameters,equilibrium=False):
+        return CatchFixed.execute(self,state,self.tac_parameters(state,parameters),equilibrium)
+
+class ProcessError(Component):
+    """Lognormal variation of the biomass after growth, eg. from recruitment, for stochastic runs"""
+    
+    def __init__(self,error=0,generator=None):
+        """
+        error: the standard deviation of the (lognormal) variation
+        generator: the numpy RandomState of the variation
+        """
+        self.error = error
+        if generator == None:
+            generator = RandomState()
+        self.generator = generator
+    
+    def execute(self,state,parameters,equilibrium=False):
+        if not equilibrium and self.error > 0:
+            biomass = state.get('biomass')
+            state.set(biomass=biomass*exp(self.generator.normal(-self.error**2/2,self.error,shape(biomass))))
+        return state
+
+#Economic attributes, derived from the catch, effort and fleet size after a run
+def revenue_column(rows,parameters):
+    return rows['catch']*parameters['beach_price']
+
+def cost_column(rows,parameters):
+    return rows['fleet_size']*parameters['fixed_cost']+rows['effort']*parameters['marginal_cost']
+
+def profit_column(rows,parameters):
+    profit = rows['revenue']-rows['cost']
+    with errstate(invalid='ignore'):
+        return where(abs(profit)<1000000,0,profit)
+
+def discounted_profit_column(rows,parameters):
+    with errstate(divide='ignore'):
+        return rows['profit']*(1-parameters['discount_rate'])**(rows['time']-1)
       
+def adjust_fleet(fleet_size,profit,fixed_cost,movement_rate,equilibrium=False):
+    '''
+    Return the adjusted fleet size (element-wise for arrays)
+    Vessels enter (exit) one at a time while the profit (loss) exceeds the
+    fixed cost of a vessel, at most movement_rate vessels per time step unless
+    at equilibrium. Each vessel moves the profit by one fixed cost, so the
+    number of vessels moving is found at once rather than vessel by vessel.
+    fleet_size: the current fleet size
+    profit: the profit with the current fleet size
+    '''
+    with errstate(divide='ignore',invalid='ignore'):
+        #Every vessel moves the profit by one fixed cost towards zero
+        steps = ceil(abs(profit)/fixed_cost-1)
+        steps = where(isfinite(steps),maximum(steps,0),0)
+        #Limit on the number of vessels moving per time step
+        limit = maximum(ceil(movement_rate),0)
+        if equilibrium:
+            limit = where(movement_rate > 0,inf,0)
+        steps = minimum(steps,limit)
+    return fleet_size+sign(profit)*steps
+
 class Economics(Component):
   
-    fixed_cost   = Parameter(     title='Operator fixed cost',
-                                  description='An individual operator\s fixed annual cost',
-                                  type='Economics')
-    marginal_cost= Parameter(     title='Operator marginal cost',
-                                  description='An individual operator\s marginal cost per unit effort',
-                                  type='Economics')
-    movement_rate= Parameter(     title='Fleet resize rate',
-                                  description='The maximum rate at which vessels can enter or exit the fishery',
-                                  type='Fleet dynamics')
-    beach_price  = Parameter(     title='Beach price',
-                                  description='The price per kg of landed fish',
-                                  type='Economics')
-    discount_rate = Parameter(    title='Discount Rate',
-                                  description='The discount rate',
-                                  type='Economics')
+    def __init__(self):
+        self.fixed_cost   = Parameter(     title='Operator fixed cost',
+                                           description='An individual operator\s fixed annual cost',
+                                           type='Economics')
+        self.marginal_cost= Parameter(     title='Operator marginal cost',
+                                           description='An individual operator\s marginal cost per unit effort',
+                                           type='Economics')
+        self.movement_rate= Parameter(     title='Fleet resize rate',
+                                           description='The maximum rate at which vessels can enter or exit the fishery',
+                                           type='Fleet dynamics')
+        self.beach_price  = Parameter(     title='Beach price',
+                                           description='The price per kg of landed fish',
+                                           type='Economics')
+        self.discount_rate = Parameter(    title='Discount Rate',
+                                           description='The discount rate',
+                                           type='Economics')
     
     def get_parameters(self):
         return {'fixed_cost': self.fixed_cost,
@@ -176,6 +418,12 @@ class Economics(Component):
                 'beach_price': self.beach_price,
                 'discount_rate': self.discount_rate}
     
+    def get_derived_columns(self):
+        return {'revenue': revenue_column,
+                'cost': cost_column,
+                'profit': profit_column,
+                'discounted_profit': discounted_profit_column}
+    
     @staticmethod
     def _calculate_revenue(state,parameters):
         return state.get('catch')*parameters['beach_price']   
@@ -191,26 +439,14 @@ class Economics(Component):
     
     def execute(self,state,parameters,equilibrium=False):
 
-        #Adjust the fleet size
-        original_fleet_size = state.get('fleet_size')
-        while abs(self._calculate_profit(state,parameters))>parameters['fixed_cost'] and \
-              ((equilibrium and parameters['movement_rate'] > 0) or 
-               abs(original_fleet_size - state.get('fleet_size')) < parameters['movement_rate']):
-            if self._calculate_profit(state,parameters) > 0:
-                state.set(fleet_size = state.get('fleet_size')+1)
-            else:
-                state.set(fleet_size = state.get('fleet_size')-1)  
-        
-        #Set the cost, revenue and profit        
-        state.set(cost = self._calculate_cost(state, parameters))
-        state.set(revenue = self._calculate_revenue(state,parameters))
-        profit = state.get('revenue')-state.get('cost')
-        if abs(profit)<1000000:
-            profit = 0
-        state.set(profit = profit)
-        
-        state.set(discounted_profit = profit*(1-parameters['discount_rate'])**(len(state['cost'])-2))
+        #Adjust the fleet size (see adjust_fleet). The number of vessels is
+        #piecewise constant in the parameters, so it is found from their values
+        #(eg. of autodiff.Dual parameters)
+        moved = adjust_fleet(0.,float(self._calculate_profit(state,parameters)),float(parameters['fixed_cost']),
+                             float(parameters['movement_rate']),equilibrium)
+        state.set(fleet_size = state.get('fleet_size')+float(moved))
         
+        #The cost, revenue and profit are derived when needed (see get_derived_columns)
         return state
             
             
@@ -234,6 +470,17 @@ class State(dict):
         for key in attributes:
             self[key] = [nan]
         
+        #Number of time steps dropped from the start of the lists (see trim)
+        self.time_offset = 0
+        
+        #The equilibrium iterations of the output of a static run (see StaticRun)
+        self.convergence = None
+        
+        #Attributes calculated from the others when needed (see set_derived)
+        self.derived = {}
+        self.parameters = {}
+        self.clear_derived()
+        
         self.attributes = attributes
         self.attribute_order = self.attributes.keys()
         #The attributes to plot first up by default
@@ -248,6 +495,130 @@ class State(dict):
                 units[unit]=1
                 self.unit_order.append(unit) 
     
+    def __missing__(self,attribute):
+        """Calculate the column of a derived attribute"""
+        if not self.derived.has_key(attribute):
+            raise KeyError(attribute)
+        if len(self.parameters) == 0:
+            #The model has not been run, the values are unknown
+            return [nan]*self.steps()
+        #Only time steps since the column was last calculated are calculated,
+        #and the last time step as it may have changed since
+        cached = self.derived_cache.get(attribute,[])
+        steps = self.steps()
+        start = max(min(len(cached),steps)-1,0)
+        values = self.derived[attribute](StateRows(self,start,steps),self.row_parameters(start,steps))
+        column = cached[:start]+list(asarray(values,dtype=float))
+        self.derived_cache[attribute] = column
+        return column
+    
+    def derived_rows(self,attribute,start,stop):
+        """Calculate a derived attribute for a range of time steps, without storing it"""
+        return StateRows(self,start,stop,derived=True)[attribute].tolist()
+    
+    def values_at(self,step=-1):
+        """Return a dict of the values of all attributes, stored and derived, at a time step (index)"""
+        if step < 0:
+            step += self.steps()
+        rows = StateRows(self,step,step+1,derived=True)
+        return dict([(att,float(rows[att][0])) for att in self.attribute_names()])
+    
+    def set_derived(self,derived):
+        """
+        Set the derived attributes, a dict of functions by attribute name
+        Derived attributes are not stored time step by time step, the column of
+        one is calculated when it is needed by function(rows,parameters), where
+        rows[attribute] is an array of the values of any attribute (or 'time')
+        for a range of time steps and parameters are the model parameter values.
+        Derived columns must not be modified.
+        """
+        for att in derived:
+            if dict.has_key(self,att):
+                del self[att]
+        self.derived = derived
+        self.clear_derived()
+    
+    def set_parameters(self,parameters):
+        """Set the parameter values derived attributes are calculated with"""
+        if len(self.derived) > 0 and parameters != self.parameters:
+            self.parameters = dict(parameters)
+            self.clear_derived()
+    
+    def row_parameters(self,start,stop):
+        """
+        Return the parameter values of a range of time steps for derived
+        attributes, scheduled parameters (see Schedule) as arrays
+        """
+        parameters = self.parameters
+        for param,value in self.parameters.items():
+            if isinstance(value,Schedule):
+                if parameters is self.parameters:
+                    parameters = dict(parameters)
+                parameters[param] = value.at(arange(start,stop)+self.time_offset)
+        return parameters
+    
+    def clear_derived(self):
+        """
+        Clear the calculated values of the derived attributes, which is needed
+        if time steps other than the last are modified
+        """
+        self.derived_cache = {}
+        self.npv_steps = 0
+        self.npv_total = 0.
+    
+    def materialise(self):
+        """Store the derived attributes like the others, they are no longer calculated"""
+        columns = dict([(att,list(self[att])) for att in self.derived])
+        self.set_derived({})
+        self.update(columns)
+    
+    def attribute_names(self):
+        """Return the names of all attributes, stored and derived"""
+        return self.keys()+[att for att in self.derived if not dict.has_key(self,att)]
+    
+    def steps(self):
+        """Return the number of time steps held"""
+        for att in self:
+            return len(self[att])
+        return 0
+    
+    def npv(self):
+        """
+        Return the net present value, the sum of the discounted profit
+        The sum is carried forward as the state is extended rather than recalculated
+        """
+        column = self['discounted_profit']
+        #The last time step may still change
+        steps = len(column)-1
+        if steps < self.npv_steps:
+            self.npv_steps = 0
+            self.npv_total = 0.
+        for value in column[self.npv_steps:steps]:
+            if not isnan(value):
+                self.npv_total += value
+        self.npv_steps = steps
+        if isnan(column[-1]):
+            return self.npv_total
+        return self.npv_total+column[-1]
+    
+    def converged(self,tolerance):
+        """
+        Whether no attribute changed by more than tolerance, relative to its
+        size, in the last time step (derived attributes follow the others)
+        """
+        for att in self:
+            column = self[att]
+            if len(column) < 2:
+                return False
+            previous = column[-2]
+            current = column[-1]
+            #nan is the only value not equal to itself, for floats and other numbers (eg. autodiff.Dual)
+            if previous == current or (previous != previous and current != current):
+                continue
+            if not abs(current-previous) <= tolerance*max(abs(previous),abs(current)):
+                return False
+        return True
+    
     def extend(self):
         """Extend all the lists by one, using the previous value for the new value"""
         for att in self:
@@ -261,8 +632,27 @@ class State(dict):
             
     def get(self,item):
         """Get the current (last item) of one of the lists"""
+        if self.derived.has_key(item) and not dict.has_key(self,item) and not self.derived_cache.has_key(item):
+            #Only the last time step of a derived attribute is calculated
+            steps = self.steps()
+            return self.derived_rows(item,steps-1,steps)[0]
         return self[item][-1]
     
+    def time(self):
+        """Get the time step of the current (last) item, the initial state is step 0"""
+        for att in self:
+            return self.time_offset+len(self[att])-1
+    
+    def trim(self,keep=1):
+        """Drop all but the last keep time steps from the lists"""
+        #Keep the initial time step for reset
+        if self.time_offset == 0:
+            self.initial = dict([(att,self[att][0]) for att in self.attribute_names()])
+        self.time_offset = self.time()+1-keep
+        for att in self:
+            self[att]=self[att][-keep:]
+        self.clear_derived()
+    
     def get_attribute_title(self,attribute):
         return self.attributes[attribute]['title']
 
@@ -275,10 +665,71 @@ class State(dict):
         """
         Resets the state to the initial timestep
         """
-        for att in self:
-            self[att]=self[att][0:1]
+        if self.time_offset > 0:
+            for att in self:
+                self[att]=[self.initial[att]]
+        else:
+            for att in self:
+                self[att]=self[att][0:1]
+        self.time_offset = 0
+        self.clear_derived()
         return
     
+class StateRows:
+    """The values of the attributes of a state for a range of time steps, as arrays"""
+    
+    def __init__(self,state,start,stop,derived=False):
+        """
+        derived: whether derived attributes are calculated for the range only
+        (once each), rather than taken from their (cached) columns
+        """
+        self.state = state
+        self.start = start
+        self.stop = stop
+        self.derived = derived
+        self.values = {}
+        self.parameters = None
+    
+    def __getitem__(self,attribute):
+        if attribute == 'time':
+            return arange(self.start,self.stop)+self.state.time_offset
+        if self.derived and not dict.has_key(self.state,attribute) and self.state.derived.has_key(attribute):
+            if not self.values.has_key(attribute):
+                if len(self.state.parameters) == 0:
+                    #The model has not been run, the values are unknown
+                    self.values[attribute] = ones(self.stop-self.start)*nan
+                else:
+                    if self.parameters == None:
+                        self.parameters = self.state.row_parameters(self.start,self.stop)
+                    self.values[attribute] = asarray(self.state.derived[attribute](self,self.parameters),dtype=float)
+            return self.values[attribute]
+        return asarray(self.state[attribute][self.start:self.stop],dtype=float)
+    
+#Number of time steps run at once by Model.stream
+STREAM_BLOCK_SIZE = 256
+
+class StreamAggregates:
+    """Running aggregates of a streamed model run (see Model.stream)"""
+    
+    def __init__(self):
+        self.steps = 0
+        self.npv = 0.
+        self.total_catch = 0.
+        self.min_biomass = inf
+        self.max_biomass = -inf
+        self.last = None
+        
+    def update(self,row):
+        """Update the aggregates with the attribute values of a time step"""
+        self.steps += 1
+        if not isnan(row['discounted_profit']):
+            self.npv += row['discounted_profit']
+        if not isnan(row['catch']):
+            self.total_catch += row['catch']
+        self.min_biomass = min(self.min_biomass,row['biomass'])
+        self.max_biomass = max(self.max_biomass,row['biomass'])
+        self.last = row
+    
 class Model():
     """Model Definition
     By combining a set of model functions this class creates a complete
@@ -299,40 +750,80 @@ class Model():
         self.functions = functions
         self.parameters = parameters
         self.convergence_time = convergence_time
+        
+        #Attributes derived by the functions are calculated by the state when needed
+        self.state.set_derived(self.get_derived_columns())
+        #The factory that built the model, eg. ('lobster','catch'), see MODEL_FACTORIES
+        self.factory = None
+        #The parameter schema, built on first use (see get_schema)
+        self.schema = None
+    
+    def get_schema(self):
+        """
+        returns the parameter schema of the model
+        it is built from the functions' parameters the first time it is needed,
+        so the functions must be set up by then
+        """
+        if self.schema == None:
+            parameters = {}
+            for function in self.functions:
+                parameters.update(function.get_parameters())
+            self.schema = ParameterSchema(parameters)
+        return self.schema
+    
+    def get_derived_columns(self):
+        """
+        returns a dict of the functions of the attributes derived by the model
+        functions (see State.set_derived)
+        """
+        derived = {}
+        for function in self.functions:
+            derived.update(function.get_derived_columns())
+        return derived
     
     def get_parameters(self):
         """
-        returns a list of parameters as required by the model functions
+        returns a dict of parameters as required by the model functions
         """ 
-        #Get all parameters
-        pOut = {}
-        for function in self.functions:
-            pOut.update(function.get_parameters())
-            
-        #Replace values with current if applicable
-        for param in pOut:
-            if self.parameters.has_key(param):
-                pOut[param].value = self.parameters[param]
-        
-        return pOut
+        return dict(self.get_schema().parameters)
     
     def set_parameters(self,parameters):
         """
         set the parameters to a given value for this and subsequent time steps
+        parameters: a dict, or a vector ordered as the parameter schema
+        Any value in a dict may be a Schedule of values by time step.
         """
+        if not isinstance(parameters,dict):
+            parameters = self.get_schema().to_dict(parameters)
         self.parameters = parameters
+        self.state.set_parameters(parameters)
+        
+    def check_parameters(self,parameters):
+        """
+        Raises ValueError if the model cannot be run with a dict of parameter
+        values: a value is not a finite number or a function rejects it (see
+        Component.check_parameters)
+        """
+        for param,value in parameters.items():
+            if not isinstance(value,(int,long,float,number)) or not isfinite(value):
+                raise ValueError('%s must be a finite number' % param)
+        for function in self.functions:
+            function.check_parameters(parameters)
+        
+    def get_control_variable(self):
+        """
+        return the management control of the model, the parameter held fixed
+        at equilibrium: 'catch' or 'effort'
+        """
+        if self.get_schema().index.has_key('catch'):
+            return 'catch'
+        return 'effort'
         
     def get_parameter_types(self):
         """
         return a list of parameter types
         """
-        types = {}
-        p = self.get_parameters()
-        for par in p:
-
-            types[p[par]['type']] = 1
-        
-        return types.keys()
+        return list(self.get_schema().types)
     
         
         
@@ -349,37 +840,479 @@ class Model():
         self.state.reset()
         
     
+    def parameters_at(self,time):
+        """
+        returns the parameter values at a time step, the value of each
+        scheduled parameter (see Schedule) at that time
+        """
+        parameters = dict(self.parameters)
+        for param,value in parameters.items():
+            if isinstance(value,Schedule):
+                parameters[param] = value.at(time)
+        return parameters
+    
     def run(self,steps = 1,constant_variable=None):
         """
         run the model for one time step
         """
+        self.state.set_parameters(self.parameters)
+        scheduled = False
+        for value in self.parameters.values():
+            if isinstance(value,Schedule):
+                scheduled = True
+        parameters = self.parameters
         for step in range(0,steps):
             self.state.extend()
+            if scheduled:
+                parameters = self.parameters_at(self.state.time())
             for function in self.functions:
-                self.state=function.execute(self.state,self.parameters,equilibrium=constant_variable!=None)
+                self.state=function.execute(self.state,parameters,equilibrium=constant_variable!=None)
+
+    def run_to_equilibrium(self,max_steps,constant_variable,tolerance=1e-9):
+        """
+        run the model at equilibrium (see run) until the state converges (see
+        State.converged), for at most max_steps time steps
+        returns the number of time steps run and whether the state converged
+        """
+        for step in range(1,max_steps+1):
+            self.run(1,constant_variable)
+            if self.state.converged(tolerance):
+                return step,True
+        return max_steps,False
+    
+    def stream(self,steps,chunk_size=None,aggregates=None):
+        """
+        Generator that runs the model for steps time steps in constant memory
+        Only the current time step is kept in the state between blocks of
+        STREAM_BLOCK_SIZE steps (the functions need the previous and current
+        steps), earlier steps are dropped.
+        Yields a dict of the attribute values (and 'time') of each time step, or
+        if chunk_size is given dicts of arrays of chunk_size time steps.
+        aggregates: an optional StreamAggregates that is updated every time step
+        """
+        self.state.trim(1)
+        names = self.state.attribute_names()
+        attributes = names+['time']
+        if chunk_size != None:
+            chunk = dict([(att,empty(chunk_size)) for att in attributes])
+            filled = 0
+        
+        #The model is run a block of time steps at a time so that derived
+        #attributes are calculated for the block at once
+        for block_start in xrange(0,steps,STREAM_BLOCK_SIZE):
+            block = min(STREAM_BLOCK_SIZE,steps-block_start)
+            self.run(block)
+            columns = dict([(att,self.state[att][1:]) for att in names])
+            first_time = self.state.time()-block+1
+            self.state.trim(1)
+            
+            for step in xrange(block):
+                row = {'time': first_time+step}
+                for att in names:
+                    row[att] = columns[att][step]
+                if aggregates != None:
+                    aggregates.update(row)
+                
+                if chunk_size == None:
+                    yield row
+                else:
+                    for att in attributes:
+                        chunk[att][filled] = row[att]
+                    filled += 1
+                    if filled == chunk_size:
+                        yield chunk
+                        chunk = dict([(att,empty(chunk_size)) for att in attributes])
+                        filled = 0
+        
+        if chunk_size != None and filled > 0:
+            yield dict([(att,chunk[att][:filled]) for att in attributes])
+
+class DynamicRun:
+    '''A dynamic model run, advanced one time step per iteration'''
+
+    def __init__(self,model,steps,options):
+        '''
+        model: the model to use (a copy is taken)
+        steps: the number of iterations in the run
+        options: the run options
+        '''
+        self.model = copy.deepcopy(model)
+        self.steps = steps
+        self.options = options
+
+    def single_iteration(self,step):
+        '''Run a single time step'''
+        self.model.run(1)
+
+    def output(self):
+        '''Return the model state'''
+        return self.model.state
+
+#The largest change (relative) in the equilibrium biomass from one independent
+#value to the next of a continued static run (see StaticRun), a larger change
+#that took longer to reach than from the initial state is taken as a
+#bifurcation and the equilibrium found again from the initial state
+CONTINUATION_JUMP = 0.25
+
+class StaticRun(DynamicRun):
+    '''
+    A static model run, one equilibrium per independent value per iteration
+    With the continuation option each equilibrium is run from the equilibrium
+    state of the previous independent value, which is close to it, rather than
+    from the initial state. Where the stock collapses or the equilibrium is not
+    reached it is found again from the initial state, as it is where it jumps
+    (see CONTINUATION_JUMP) and took more time steps than the last equilibrium
+    found from the initial state, so that restarts are only run where the
+    continuation did not save time steps. Where several fleet sizes are at equilibrium (the profit
+    is within the fixed cost of a vessel of 0) the nearest to the previous
+    one is kept.
+    '''
+
+    def __init__(self,model,steps,options):
+        DynamicRun.__init__(self,model,steps,options)
+        self.output_state = copy.deepcopy(self.model.state)
+        self.output_state.reset()
+        #Each equilibrium is a time step of the output, so derived values are
+        #taken from the model rather than calculated from the output
+        self.output_state.set_parameters(self.model.parameters)
+        self.output_state.materialise()
+        #The number of time steps to each equilibrium, the independent values
+        #that did not converge within convergence_time steps, and those that
+        #were found again from the initial state
+        self.iterations = []
+        self.unconverged = []
+        self.restarts = []
+        self.output_state.convergence = {'iterations': self.iterations,'unconverged': self.unconverged,
+                                         'restarts': self.restarts}
+        #The equilibrium state to continue from, and the initial state
+        self.previous = None
+        #The time steps of the last equilibrium found from the initial state
+        self.cold_iterations = 0
+        self.initial = dict([(att,self.model.state[att][0]) for att in self.model.state])
+
+    def _run_to_equilibrium(self,value,start=None):
+        '''
+        Run the model to the equilibrium of an independent value from the
+        initial state, or from start (a dict of attribute values)
+        Returns the number of time steps run and whether it converged
+        '''
+        self.model.reset()
+        if start != None:
+            for att in start:
+                self.model.state[att][0] = start[att]
+        #Set the independent value to the appropriate value
+        self.model.state[self.options['independent_variable']] = [value]
+        self.model.parameters[self.options['independent_variable']] = value
+        if self.options['tolerance'] == None:
+            self.model.run(self.options['convergence_time'],constant_variable = self.options['independent_variable'])
+            result = self.options['convergence_time'],True
+        else:
+            result = self.model.run_to_equilibrium(self.options['convergence_time'],
+                                                   self.options['independent_variable'],
+                                                   self.options['tolerance'])
+        if start != None:
+            #The model resets to the initial state, not the start
+            for att in start:
+                self.model.state[att][0] = self.initial[att]
+            self.model.state.clear_derived()
+        return result
+
+    def _collapsed(self,value):
+        '''Whether the stock collapsed or the independent value could not be reached'''
+        state = self.model.state
+        return state.get('biomass') <= 0 or state[self.options['independent_variable']][-1] < value
+
+    def _jumped(self):
+        '''Whether the equilibrium biomass changed by more than CONTINUATION_JUMP from the previous one'''
+        previous = self.previous['biomass']
+        current = self.model.state.get('biomass')
+        return abs(current-previous) > CONTINUATION_JUMP*max(abs(previous),abs(current))
+
+    def single_iteration(self,step):
+        '''Find an equilibrium state for a single independent parameter value'''
+        value = self.options['independent_values'][step]
+        if self.options['continuation'] and self.previous != None:
+            iterations,converged = self._run_to_equilibrium(value,self.previous)
+            if not converged or self._collapsed(value) or (self._jumped() and iterations > self.cold_iterations):
+                restart_iterations,converged = self._run_to_equilibrium(value)
+                self.cold_iterations = restart_iterations
+                iterations += restart_iterations
+                self.restarts.append(value)
+        else:
+            iterations,converged = self._run_to_equilibrium(value)
+            self.cold_iterations = iterations
+        self.iterations.append(iterations)
+        if not converged:
+            self.unconverged.append(value)
+
+        #The next value continues from this equilibrium, unless it is unreliable
+        if converged and not self._collapsed(value):
+            self.previous = dict([(att,self.model.state.get(att)) for att in self.model.state
+                                  if att != self.options['independent_variable']])
+        else:
+            self.previous = None
+
+        for param,param_value in self.model.state.values_at().items():
+            self.output_state[param].append(param_value)
+        if self.model.state[self.options['independent_variable']][-1] < value:
+            self.output_state[self.options['independent_variable']][-1] = self.options['independent_values'][step-1]+1e-6
+
+    def output(self):
+        '''Return the output state'''
+        return self.output_state
+
+def static_options(steps,independent_variable='effort',independent_minimum=0,independent_maximum=None,convergence_time=20,tolerance=1e-9,continuation=True):
+    '''
+    Return the run options for a static run of steps independent values
+    convergence_time: the most time steps to run to each equilibrium
+    tolerance: the largest change (relative) in a time step of a converged
+    state (see State.converged), None to always run convergence_time steps
+    continuation: whether each equilibrium is run from the previous one (see StaticRun)
+    '''
+    return {'independent_variable': independent_variable,
+            'independent_values': linspace(independent_minimum,independent_maximum,steps),
+            'convergence_time':convergence_time,
+            'tolerance': tolerance,
+            'continuation': continuation}
+
+def static_maximum(parameters,control_type):
+    '''
+    Return the independent variable and its maximum for a static run
+    parameters: the model parameter values
+    control_type: 'catch' or 'effort'
+    '''
+    if control_type == 'catch':
+        return 'catch',parameters['K']*parameters['r']/4*1.01
+    return 'effort',6e6
+
+def make_run(model,steps,dynamic=True,independent_variable='effort',independent_minimum = 0,independent_maximum = None,convergence_time=20,tolerance=1e-9,continuation=True):
+    '''
+    Return a DynamicRun or StaticRun of the model
+    Arguments are as for MultiThreadModelRun.run
+    '''
+    if dynamic:
+        return DynamicRun(model,steps,{})
+    return StaticRun(model,steps,static_options(steps,independent_variable,independent_minimum,
+                                                independent_maximum,convergence_time,tolerance,continuation))
+
+def run_model(model,steps,**kwargs):
+    '''
+    Run the model to completion in the calling thread and return the output state
+    Arguments are as for MultiThreadModelRun.run
+    '''
+    run = make_run(model,steps,**kwargs)
+    for step in range(0,steps):
+        run.single_iteration(step)
+    return run.output()
+
+def scenario_parameters(model,overrides={}):
+    '''Return the default parameter values of a model updated with overrides'''
+    #Values are floats as in the GUI, the model would do integer division on ints
+    schema = model.get_schema()
+    for param in overrides:
+        if not schema.index.has_key(param):
+            raise KeyError('Unknown parameter: ' + param)
+    return schema.to_dict(schema.to_vector(overrides))
+
+def scenario_state(scenario):
+    '''Run the model for a scenario and return the output state'''
+    control_type = scenario.get('control_type','catch')
+    model = MODEL_FACTORIES[scenario.get('model','lobster')](control_type = control_type)
+    parameters = scenario_parameters(model,scenario.get('parameters',{}))
+    model.set_parameters(parameters)
+    model.reset()
+
+    steps = scenario.get('steps',100)
+    if scenario.get('dynamic',True):
+        return run_model(model,steps)
+    variable,maximum = static_maximum(parameters,control_type)
+    return run_model(model,steps,dynamic=False,independent_variable=variable,independent_maximum=maximum)
+
+class ResultCache:
+    '''
+    A thread safe, bounded store of model run outputs by key
+    The least recently used results are dropped beyond max_size. Lookups are
+    counted, with hits by the source of the result, for hit rate telemetry.
+    Results (states) are stored serialized, which is much faster than copying them.
+    '''
+
+    def __init__(self,max_size=256):
+        self.results = collections.OrderedDict()
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = {}
+        self.evictions = 0
+
+    def has_key(self,key):
+        '''Whether there is a result for key (not counted as a lookup)'''
+        with self.lock:
+            return self.results.has_key(key)
+
+    def get(self,key):
+        '''Return a copy of the result for key, or None'''
+        with self.lock:
+            self.lookups += 1
+            if not self.results.has_key(key):
+                return None
+            data,template,source = self.results.pop(key)
+            self.results[key] = (data,template,source)
+            self.hits[source] = self.hits.get(source,0)+1
+        return serialization.loads_state(data,template)
+
+    def put(self,key,result,source='foreground'):
+        '''Store a copy of the result for key, source describes where it came from'''
+        data = serialization.dumps_state(result)
+        template = serialization.state_template(result)
+        with self.lock:
+            if self.results.has_key(key):
+                del self.results[key]
+            self.results[key] = (data,template,source)
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        '''Return a dict of cache telemetry'''
+        with self.lock:
+            hits = 0
+            for count in self.hits.values():
+                hits += count
+            return {'size': len(self.results),
+                    'max_size': self.max_size,
+                    'lookups': self.lookups,
+                    'hits': hits,
+                    'hit_rate': hits/float(max(self.lookups,1)),
+                    'hits_by_source': dict(self.hits),
+                    'evictions': self.evictions}
+
+class PrecomputeJob:
+    '''A background model run (see PrecomputeThread)'''
+
+    def __init__(self,key,model,steps,arguments,source='precompute'):
+        '''
+        key: the cache key of the output
+        model, steps: the model and number of iterations
+        arguments: a dict of other keyword arguments to make_run
+        source: the source of the result in the cache
+        '''
+        self.keys = [key]
+        self.model = model
+        self.steps = steps
+        self.arguments = arguments
+        self.source = source
+
+    def execute(self,should_continue):
+        '''Run the job and return a list of (key,output) or None if it should not continue'''
+        import time
+        run = make_run(self.model,self.steps,**self.arguments)
+        for step in range(0,self.steps):
+            if not should_continue():
+                return None
+            run.single_iteration(step)
+            #Yield to the foreground threads
+            time.sleep(0)
+        return [(self.keys[0],run.output())]
+
+class PrecomputeThread(threading.Thread):
+    '''
+    Thread that computes queued jobs in the background and stores them in
+    a ResultCache. Jobs only proceed while the foreground is idle and the queue
+    is dropped as soon as foreground work arrives (see cancel).
+    '''
+
+    def __init__(self,cache,is_idle):
+        '''
+        cache: the ResultCache to store the outputs in
+        is_idle: a function returning whether the foreground is idle
+        '''
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.cache = cache
+        self.is_idle = is_idle
+        self.jobs = []
+        self.lock = threading.Lock()
+        #Incremented whenever the queue changes, so running jobs can tell they are stale
+        self.generation = 0
+
+    def schedule(self,jobs):
+        '''
+        Replace the queued jobs
+        jobs: a list of jobs, eg. PrecomputeJob, in order of priority. Jobs
+        with all their keys in the cache already are skipped, jobs without
+        keys are always run.
+        '''
+        jobs = [job for job in jobs if len(job.keys) == 0 or not all([self.cache.has_key(key) for key in job.keys])]
+        with self.lock:
+            self.jobs = jobs
+            self.generation += 1
+
+    def cancel(self):
+        '''Drop the queued jobs and abandon the current one'''
+        with self.lock:
+            self.jobs = []
+            self.generation += 1
+
+    def run(self):
+        '''The thread's run function'''
+        import time
+        while True:
+            job = None
+            with self.lock:
+                if len(self.jobs) > 0 and self.is_idle():
+                    job = self.jobs.pop(0)
+                    generation = self.generation
+            if job == None:
+                time.sleep(0.05)
+                continue
+
+            results = job.execute(lambda: self.generation == generation and self.is_idle())
+            if results != None:
+                for key,output in results:
+                    self.cache.put(key,output,job.source)
+                continue
+
+            #Interrupted by foreground work without a cancel, try again later
+            with self.lock:
+                if self.generation == generation:
+                    self.jobs.insert(0,job)
 
 class MultiThreadModelRun:
     class MyThread(threading.Thread):
 
-        def __init__(self,function):
+        #The run class used by this thread (see DynamicRun and StaticRun)
+        run_class = None
+
+        def __init__(self,function,cache=None,tracer=None):
             '''Initialise the thread:
             function: a function to be called after run completion
+            cache: an optional ResultCache for the outputs of runs with a key
+            tracer: an optional latency_trace.Tracer for the runs with a generation
             '''
             threading.Thread.__init__(self)
             self.function = function        
+            self.cache = cache
+            self.tracer = tracer
             self.update = False
             self.cancel_run = False
+            self.busy = False
 
-        def update_run(self,model,steps,options):
+        def update_run(self,model,steps,options,key=None,generation=None):
             '''Start a new run
             model: the model to use
             options: the run options
+            key: the key to cache the output under (optional)
+            generation: the parameter change traced by the run (optional)
             '''
-            self.newmodel = copy.deepcopy(model)
-            self.newsteps = steps
-            self.newoptions = options
+            self.newrun = self.run_class(model,steps,options)
+            self.newrun.key = key
+            self.newrun.generation = generation
             self.update = True
         
+        def is_idle(self):
+            '''Whether the thread has no run in progress or pending'''
+            return not self.update and not self.busy
+        
         def run(self):
             '''The thread's run function'''
             import time
@@ -390,96 +1323,114 @@ class MultiThreadModelRun:
                     self.update = False
                 #Creating a new run 
                 if self.update:
-                    self.model = self.newmodel
-                    self.options = self.newoptions
-                    self.steps = self.newsteps
+                    self.busy = True
+                    self.current_run = self.newrun
                     self.update = False
+                    generation = self.current_run.generation
+                    if self.tracer != None:
+                        self.tracer.mark(generation,'run_start')
                     
-                    for step in range(0,self.steps):
+                    for step in range(0,self.current_run.steps):
                         if self.update:
                             break
                         self.single_iteration(step)
                         
                     if not self.update:
+                        if self.cache != None and self.current_run.key != None:
+                            self.cache.put(self.current_run.key,self.current_run.output())
+                        if self.tracer != None:
+                            self.tracer.mark(generation,'run_end')
                         if not self.function==None:
-                            wx.CallAfter(self.function,self.output())
+                            #The generation is passed on for tracing
+                            arguments = (self.current_run.output(),)
+                            if generation != None:
+                                arguments += (generation,)
+                            if wx == None:
+                                self.function(*arguments)
+                            else:
+                                wx.CallAfter(self.function,*arguments)
+                    elif self.tracer != None and generation != None:
+                        #Interrupted by a newer run or cancelled
+                        self.tracer.drop(generation)
+                    self.busy = False
                 else:
                     time.sleep(0.01)
                     pass
 
+        def single_iteration(self,step):
+            '''Perform a single iteration of the current run'''
+            self.current_run.single_iteration(step)
+
         def cancel(self):
             '''Cancel this run'''
+            #A thread not yet started has no run to cancel
+            if self.ident == None:
+                return
             self.update = True
             self.cancel_run = True
 
-        def single_iteration(self,step):
-            '''Perform a single iteration (to be implemented by inheriting class)'''
-            pass
-
-        def output(self):
-            '''Return the model output (to be implemented by inheriting class)'''
-            pass
-
     class DynamicThread(MyThread):
         '''Thread for dynamic model runs'''
-
-        def single_iteration(self,step):
-            '''Run a single time step'''
-            self.model.run(1)
-
-        def output(self):
-            '''Return the model state'''
-            return self.model.state
+        run_class = DynamicRun
 
     class StaticThread(MyThread):
         '''Thread for static model runs'''
-        def update_run(self,model,steps,options):
-            '''Update the run, copying a new output state as well'''
-            #MultiThreadModelRun.MyThread.update_run(self,model,steps,options)
-            self.newmodel = copy.deepcopy(model)
-            self.newsteps = steps
-            self.newoptions = options
-            self.update = True
-            self.output_state = copy.deepcopy(self.newmodel.state)
-            self.output_state.reset()
-
-        def single_iteration(self,step):
-            '''Find an equilibrium state for a single independent parameter value'''
-            #Reset the model 
-            self.model.reset()
-            #Set the independent value to the appropriate value
-            self.model.state[self.options['independent_variable']] = [self.options['independent_values'][step]]
-            self.model.parameters[self.options['independent_variable']] = self.options['independent_values'][step]
-            self.model.run(self.options['convergence_time'],constant_variable = self.options['independent_variable'])
-            if True: #self.model.state[self.options['independent_variable']][-1] == self.options['independent_values'][step]:
-                for param in self.model.state.keys():
-                    self.output_state[param].append(self.model.state[param][-1])
-            if self.model.state[self.options['independent_variable']][-1] < self.options['independent_values'][step]:
-                self.output_state[self.options['independent_variable']][-1] = self.options['independent_values'][step-1]+1e-6
-#            self.output_state[self.options['independent_variable']][-1] = self.options['independent_values'][step]
-
-        def output(self):
-            '''Return the output state'''
-            return self.output_state
+        run_class = StaticRun
             
 
-    def __init__(self,function=None):
-        self.static_thread = self.StaticThread(function)  
-        self.static_thread.start()
-        self.dynamic_thread = self.DynamicThread(function)  
-        self.dynamic_thread.start()
+    def __init__(self,function=None,cache=None,tracer=None):
+        '''
+        function: a function to be called with the output of each completed
+        run, and its generation if it has one (see run)
+        cache: the ResultCache for keyed and precomputed runs (a new one by default)
+        tracer: a latency_trace.Tracer marking the runs of each generation (optional)
+        Each thread is started when it is first needed (see _start).
+        '''
+        if cache == None:
+            cache = ResultCache()
+        self.cache = cache
+        self.static_thread = self.StaticThread(function,cache,tracer)  
+        self.dynamic_thread = self.DynamicThread(function,cache,tracer)  
+        self.precompute_thread = PrecomputeThread(cache,self.is_idle)
         
-    def run(self,model,steps,dynamic=True,independent_variable='effort',independent_minimum = 0,independent_maximum = None,convergence_time=4):
-
+    def _start(self,thread):
+        '''Start a thread if it has not been started'''
+        if thread.ident == None:
+            thread.start()
+        
+    def is_idle(self):
+        '''Whether no foreground run is in progress or pending'''
+        return self.static_thread.is_idle() and self.dynamic_thread.is_idle()
+        
+    def cancel(self):
+        '''Cancel the foreground runs'''
+        self.static_thread.cancel()
+        self.dynamic_thread.cancel()
+        
+    def precompute(self,jobs):
+        '''Compute runs in the background while idle (see PrecomputeThread.schedule)'''
+        self.precompute_thread.schedule(jobs)
+        self._start(self.precompute_thread)
+        
+    def run(self,model,steps,dynamic=True,independent_variable='effort',independent_minimum = 0,independent_maximum = None,convergence_time=20,tolerance=1e-9,continuation=True,key=None,generation=None):
+        '''
+        Start a run in the foreground, replacing any current run
+        convergence_time, tolerance, continuation: the equilibria of a static run (see static_options)
+        key: cache the output under this key (optional)
+        generation: the parameter change traced by the run (optional, see latency_trace)
+        '''
+        #Foreground work takes precedence over precomputation
+        self.precompute_thread.cancel()
         if dynamic:
             self.static_thread.cancel()
-            self.dynamic_thread.update_run(model,steps,{})
+            self.dynamic_thread.update_run(model,steps,{},key,generation)
+            self._start(self.dynamic_thread)
         else:
             self.dynamic_thread.cancel()
             self.static_thread.update_run(model,steps,
-                {   'independent_variable': independent_variable,
-                    'independent_values': linspace(independent_minimum,independent_maximum,steps),
-                    'convergence_time':convergence_time})
+                static_options(steps,independent_variable,independent_minimum,
+                               independent_maximum,convergence_time,tolerance,continuation),key,generation)
+            self._start(self.static_thread)
     
 def lobsterModel(control_type = 'catch'):
     
@@ -553,6 +1504,7 @@ def lobsterModel(control_type = 'catch'):
     #Create the fishery model
     #-----------------------------------------
     model = Model(functions = [growthClass,catchClass,economicsClass],initial_state = initial_state)
+    model.factory = ('lobster',control_type)
 
     return model
 
@@ -637,8 +1589,10 @@ def fishModel(control_type = 'catch'):
     #Create the fishery model
     #-----------------------------------------
     model = Model(functions = [growthClass,catchClass,economicsClass],initial_state = initial_state)
+    model.factory = ('fish',control_type)
 
     return model
 
-
-
+#Model factories by name, for use outside the GUI (reports, servers etc.)
+MODEL_FACTORIES = {'lobster': lobsterModel,
+                   'fish': fishModel}
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer latency tracing
+Follows each parameter change (a generation, numbered in order) from the
+slider move to the plot on screen, through the marks
+    changed     the parameters changed (Frame.on_slide_change)
+    polled      the model timer picked the change up (Frame.on_timer_model)
+    run_start   the model thread started the run (MultiThreadModelRun)
+    run_end     the run finished and was handed to the GUI thread (wx.CallAfter)
+    received    the GUI thread got the output (Frame.model_data_updater)
+    updated     the plot panel took the new state (PlotPanel.update_state)
+    redrawn     the plot lines were updated (PlotPanel.redraw)
+    drawn       the canvas was drawn (canvas.draw)
+A stage is the time between a mark and the one before it that was made (a
+cached result has no run). Rolling histograms of the last ROLLING_WINDOW
+times of each stage and of the total are kept, with the counts of
+generations superseded by a newer one before they were drawn and of runs
+dropped (interrupted or cancelled) before they finished.
+Named events with details (in place of debug prints) are kept in a log of
+the last LOG_SIZE, and printed if the tracer is verbose.
+Everything can be exported as JSON, or summarised as text for an overlay.
+This has no wx dependency.
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import collections
+import json
+import threading
+import time
+
+import numpy
+
+#The marks of a generation in order (see the module)
+MARKS = ['changed','polled','run_start','run_end','received','updated','redrawn','drawn']
+#The name of the stage ending at each mark
+STAGES = {'polled': 'poll',
+          'run_start': 'queue',
+          'run_end': 'run',
+          'received': 'handoff',
+          'updated': 'update',
+          'redrawn': 'redraw',
+          'drawn': 'draw'}
+#The number of latencies in the rolling histograms
+ROLLING_WINDOW = 200
+#The bucket edges of the histograms, in milliseconds
+HISTOGRAM_EDGES = [1,2,5,10,20,50,100,200,500,1000]
+#The number of events and of finished generations kept
+LOG_SIZE = 500
+RECENT_SIZE = 20
+
+class RollingHistogram:
+    '''The last values added, summarised as buckets and percentiles'''
+
+    def __init__(self,size=ROLLING_WINDOW,edges=HISTOGRAM_EDGES):
+        self.values = collections.deque(maxlen=size)
+        self.edges = edges
+        self.count = 0
+
+    def add(self,value):
+        self.values.append(value)
+        self.count += 1
+
+    def summary(self):
+        '''Return the buckets as a list of [label,count], and the count, mean and percentiles of the values'''
+        values = numpy.array(self.values)
+        counts = numpy.bincount(numpy.searchsorted(self.edges,values,side='right'),minlength=len(self.edges)+1)
+        labels = ['<%g' % self.edges[0]]
+        labels += ['%g-%g' % (low,high) for low,high in zip(self.edges[:-1],self.edges[1:])]
+        labels += ['>=%g' % self.edges[-1]]
+        summary = {'buckets': [[label,int(count)] for label,count in zip(labels,counts)],
+                   'count': self.count,
+                   'window': len(values)}
+        if len(values) > 0:
+            summary.update({'mean': float(values.mean()),
+                            'p50': float(numpy.percentile(values,50)),
+                            'p90': float(numpy.percentile(values,90)),
+                            'p99': float(numpy.percentile(values,99)),
+                            'max': float(values.max())})
+        return summary
+
+class Tracer:
+    '''The latency of each generation and an event log (see the module), safe to use from several threads'''
+
+    def __init__(self,verbose=False):
+        '''verbose: whether to print the events'''
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.generation = 0
+        #The marks (times) and source of each generation not yet drawn, by generation
+        self.pending = {}
+        self.stages = dict([(stage,RollingHistogram()) for stage in STAGES.values()])
+        self.total = RollingHistogram()
+        self.superseded = 0
+        self.dropped = 0
+        self.finished = 0
+        self.recent = collections.deque(maxlen=RECENT_SIZE)
+        self.log = collections.deque(maxlen=LOG_SIZE)
+        self.start = time.time()
+
+    def begin(self):
+        '''Start a new generation and return it, those not yet drawn are superseded'''
+        with self.lock:
+            self.superseded += len(self.pending)
+            self.pending.clear()
+            self.generation += 1
+            self.pending[self.generation] = {'marks': {'changed': time.time()},'source': 'run'}
+            return self.generation
+
+    def mark(self,generation,mark,source=None):
+        '''
+        Record a mark (a name of MARKS) of a generation, ignored for
+        generations superseded or None
+        source: where the output came from, eg. 'cache'
+        '''
+        now = time.time()
+        with self.lock:
+            record = self.pending.get(generation)
+            if record == None:
+                return
+            record['marks'][mark] = now
+            if source != None:
+                record['source'] = source
+            if mark == MARKS[-1]:
+                self._finish(generation,record)
+
+    def _finish(self,generation,record):
+        '''Add the stages of a generation drawn to the histograms (call with the lock held)'''
+        del self.pending[generation]
+        marks = record['marks']
+        previous = marks['changed']
+        stages = {}
+        for mark in MARKS[1:]:
+            if marks.has_key(mark):
+                stages[STAGES[mark]] = (marks[mark]-previous)*1000
+                previous = marks[mark]
+        for stage,milliseconds in stages.items():
+            self.stages[stage].add(milliseconds)
+        total = (marks[MARKS[-1]]-marks['changed'])*1000
+        self.total.add(total)
+        self.finished += 1
+        self.recent.append({'generation': generation,'source': record['source'],
+                            'total_ms': total,'stages_ms': stages})
+
+    def drop(self,generation):
+        '''Count a run of a generation that was abandoned before it finished'''
+        with self.lock:
+            self.dropped += 1
+        self.event('run dropped',generation=generation)
+
+    def event(self,name,**details):
+        '''Log an event with details'''
+        entry = dict(details,name=name,time=time.time()-self.start)
+        self.log.append(entry)
+        if self.verbose:
+            print(name + ''.join([' %s=%s' % (key,value) for key,value in sorted(details.items())]))
+
+    def export(self):
+        '''Return the histograms, counts, recent generations and event log as a dict'''
+        with self.lock:
+            return {'generations': self.generation,
+                    'finished': self.finished,
+                    'superseded': self.superseded,
+                    'dropped': self.dropped,
+                    'pending': len(self.pending),
+                    'total_ms': self.total.summary(),
+                    'stages_ms': dict([(stage,histogram.summary()) for stage,histogram in self.stages.items()]),
+                    'recent': list(self.recent),
+                    'events': list(self.log)}
+
+    def save(self,filename):
+        '''Export to a JSON file'''
+        fid = open(filename,'w')
+        json.dump(self.export(),fid,indent=1,sort_keys=True)
+        fid.close()
+
+    def summary_text(self):
+        '''Return a few lines summarising the latencies, eg. for an overlay'''
+        summary = self.export()
+        lines = ['Latency (ms)   last   p50   p90',
+                 'generations %d, superseded %d, dropped %d' % (summary['generations'],summary['superseded'],summary['dropped'])]
+        last = {}
+        if len(summary['recent']) > 0:
+            last = dict(summary['recent'][-1]['stages_ms'],total=summary['recent'][-1]['total_ms'])
+        rows = [(STAGES[mark],summary['stages_ms'][STAGES[mark]]) for mark in MARKS[1:]]+[('total',summary['total_ms'])]
+        for stage,histogram in rows:
+            if histogram['window'] > 0:
+                lines.insert(-1,'%-10s %6s %5.0f %5.0f' % (stage,'%.0f' % last[stage] if last.has_key(stage) else '-',
+                                                           histogram['p50'],histogram['p90']))
+        return '\n'.join(lines)
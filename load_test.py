@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer model server load test
+Simulates a class of clients moving sliders: each client sends run requests
+over several connections at once, as a client dragging a slider has newer
+requests waiting behind older ones, drawing the parameters from a limited
+number of distinct scenarios so that some requests are shared with other
+clients. Reports the throughput, latency percentiles, superseded requests and
+batch sizes, and the server statistics.
+
+Usage: python load_test.py [host:port] [clients] [requests per client] [distinct scenarios] [requests in flight per client]
+Start the server first, eg. python model_server.py
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import httplib
+import json
+import random
+import sys
+import threading
+import time
+
+import numpy
+
+def make_scenarios(count,seed=0):
+    '''Return count distinct scenarios varying the growth rate and catch or effort'''
+    generator = random.Random(seed)
+    scenarios = []
+    for i in range(count):
+        control_type = generator.choice(['catch','effort'])
+        scenario = {'model': generator.choice(['lobster','fish']),
+                    'control_type': control_type,
+                    'dynamic': generator.random() < 0.8,
+                    'parameters': {'r': round(generator.uniform(0.2,2),3)}}
+        scenarios.append(scenario)
+    return scenarios
+
+def client(host,port,scenarios,requests,client_id,seed,latencies,superseded,errors):
+    '''
+    Send requests run requests over one connection as client_id, appending the
+    latencies (seconds), superseded requests and errors
+    '''
+    generator = random.Random(seed)
+    connection = httplib.HTTPConnection(host,port)
+    for i in range(requests):
+        body = json.dumps(generator.choice(scenarios))
+        start = time.time()
+        try:
+            connection.request('POST','/run',body,{'Content-Type': 'application/json','X-Client-Id': str(client_id)})
+            response = connection.getresponse()
+            response.read()
+            if response.status == 409:
+                superseded.append(client_id)
+            elif response.status != 200:
+                errors.append(response.status)
+        except (httplib.HTTPException,IOError),e:
+            errors.append(str(e))
+            connection.close()
+            connection = httplib.HTTPConnection(host,port)
+        latencies.append(time.time()-start)
+    connection.close()
+
+def server_stats(host,port):
+    '''Return the statistics of the server'''
+    connection = httplib.HTTPConnection(host,port)
+    connection.request('GET','/stats')
+    stats = json.loads(connection.getresponse().read())
+    connection.close()
+    return stats
+
+def load_test(host='localhost',port=8642,clients=40,requests=25,distinct=100,overlap=4):
+    '''
+    Run the load test and return a dict of the results
+    overlap: the number of requests each client has in flight at once, each
+    on its own connection, so that waiting requests are superseded
+    '''
+    scenarios = make_scenarios(distinct)
+    latencies = []
+    superseded = []
+    errors = []
+    threads = []
+    for client_id in range(clients):
+        for connection in range(overlap):
+            #The requests of the client are shared between its connections
+            count = requests//overlap+(connection < requests%overlap)
+            threads.append(threading.Thread(target=client,args=(host,port,scenarios,count,client_id,client_id*overlap+connection,
+                                                               latencies,superseded,errors)))
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time()-start
+
+    latencies = numpy.array(latencies)*1000
+    server = server_stats(host,port)
+    return {'requests': len(latencies),
+            'superseded': len(superseded),
+            'errors': len(errors),
+            'seconds': elapsed,
+            'throughput': len(latencies)/elapsed,
+            'p50_ms': numpy.percentile(latencies,50),
+            'p99_ms': numpy.percentile(latencies,99),
+            'max_ms': latencies.max(),
+            'mean_batch_size': server['batch_size']['mean'],
+            'server': server}
+
+if __name__ == '__main__':
+    host,port = 'localhost',8642
+    clients,requests,distinct,overlap = 40,25,100,4
+    if len(sys.argv) > 1:
+        host,port = sys.argv[1].rsplit(':',1)
+        port = int(port)
+    if len(sys.argv) > 2:
+        clients = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        requests = int(sys.argv[3])
+    if len(sys.argv) > 4:
+        distinct = int(sys.argv[4])
+    if len(sys.argv) > 5:
+        overlap = int(sys.argv[5])
+
+    results = load_test(host,port,clients,requests,distinct,overlap)
+    print('%d requests from %d clients in %.2f s, %d errors' % (results['requests'],clients,results['seconds'],results['errors']))
+    print('Throughput %.1f requests/s' % results['throughput'])
+    print('Latency p50 %.1f ms, p99 %.1f ms, max %.1f ms' % (results['p50_ms'],results['p99_ms'],results['max_ms']))
+    print('%d requests superseded, mean batch size %.2f' % (results['superseded'],results['mean_batch_size']))
+    print('Server: ' + json.dumps(results['server'],sort_keys=True))
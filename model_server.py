@@ -0,0 +1,492 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer model server
+Serves model runs over HTTP/JSON so that many clients (eg. a class of
+students) can share one machine's worker processes and result cache.
+Identical requests are computed once: results are cached, and a request for a
+run that is already queued or being computed waits for that run instead of
+starting another. Requests arriving together are run as vectorised batches.
+
+API
+    GET  /models  the parameters of each model and control type
+    POST /run     run a scenario, the body is a JSON object with the keys
+                      model: 'lobster' or 'fish' (default 'lobster')
+                      control_type: 'catch' or 'effort' (default 'catch')
+                      dynamic: true for a dynamic, false for a static run (default true)
+                      parameters: parameter values overriding the model defaults
+                      steps: number of years or static points (default 100)
+                  and the response is a JSON object with the keys
+                      attributes: the list of values of each state attribute (nan as null)
+                      attribute_order, default_plot: as for the model state
+                      convergence: of a static run, the time steps to each
+                      equilibrium (iterations) and the independent values
+                      that did not converge (unconverged) or were run again
+                      from the initial state (restarts), null for a dynamic run
+                  a client may identify itself with an X-Client-Id header, its
+                  request is then answered with 409 if superseded by a newer one
+    GET  /stats   cache and request counts, batch size and queue wait histograms
+
+Usage: python model_server.py [host:port] [processes] [batch window in ms] [coordinator host:port]
+The default address is localhost:8642, use 0.0.0.0:8642 to serve the local network.
+With a coordinator address the batches are run by sweep workers (see
+sweep_cluster.py) connecting to it rather than by local processes.
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import BaseHTTPServer
+import SocketServer
+import multiprocessing
+import threading
+import bisect
+import json
+import math
+import sys
+import time
+
+import fisheries_model
+import serialization
+import sweep_cluster
+
+DEFAULT_ADDRESS = ('localhost',8642)
+#Largest number of steps a client may ask for
+MAX_STEPS = 10000
+
+class Superseded(Exception):
+    '''Raised for a request replaced by a newer request from the same client before it was run'''
+    pass
+
+class Histogram:
+    '''Counts of values in buckets, for the service statistics'''
+
+    def __init__(self,edges):
+        '''
+        edges: the increasing bucket edges, a value equal to an edge is counted in the bucket above it
+        '''
+        self.edges = edges
+        self.counts = [0]*(len(edges)+1)
+        self.count = 0
+        self.total = 0.
+
+    def add(self,value):
+        self.counts[bisect.bisect_right(self.edges,value)] += 1
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        '''Return the buckets as a list of [label,count] and the number and mean of the values'''
+        labels = ['<%g' % self.edges[0]]
+        labels += ['%g-%g' % (low,high) for low,high in zip(self.edges[:-1],self.edges[1:])]
+        labels += ['>=%g' % self.edges[-1]]
+        return {'buckets': [[label,count] for label,count in zip(labels,self.counts)],
+                'count': self.count,
+                'mean': self.total/max(self.count,1)}
+
+class Request:
+    '''A client's request waiting for a run'''
+
+    def __init__(self,client,pending):
+        self.client = client
+        self.pending = pending
+        #Set when the run is finished or the request is superseded
+        self.done = threading.Event()
+        self.superseded = False
+
+class PendingRun:
+    '''A run waiting for or being computed, shared by all the requests for it'''
+
+    def __init__(self,key,scenario):
+        self.key = key
+        self.scenario = scenario
+        self.requests = []
+        self.queued = time.time()
+        #Whether the run has been sent to the workers, before then it may be superseded
+        self.dispatched = False
+        #Set when the run is finished, the serialized state or an error message
+        self.data = None
+        self.error = None
+        #Whether the batch of the run has finished or timed out, a late result is dropped
+        self.finished = False
+
+class ModelService:
+    '''
+    Runs scenarios in a pool of worker processes, sharing the results between clients
+    Requests are gathered for a short window into batches. Requests for the same
+    run share it, a request that is still waiting is superseded by a newer one
+    from the same client, and the runs of a batch with the same model and
+    simulation settings are computed together as one vectorised ensemble.
+    While every worker is busy runs wait in the queue, where they are gathered
+    into larger batches and may still be superseded. A batch that runs longer
+    than run_timeout fails, so that its worker's place goes to the next batch.
+    '''
+
+    def __init__(self,processes=None,cache_size=1024,timeout=600,window=0.005,max_batch_size=64,coordinator=None,run_timeout=60):
+        '''
+        processes: number of worker processes (default number of cpus)
+        cache_size: number of results to keep
+        timeout: seconds to wait for a run before giving up
+        window: seconds to gather requests for a batch, trading latency for throughput
+        max_batch_size: largest number of runs computed together
+        coordinator: a sweep_cluster.Coordinator whose workers compute the
+        batches in place of the worker processes, None to use the processes
+        The number of batches sent to the workers at once is the number of processes.
+        run_timeout: seconds a batch may run before it fails
+        '''
+        self.coordinator = coordinator
+        self.pool = None
+        if coordinator == None:
+            self.pool = multiprocessing.Pool(processes)
+        self.cache = fisheries_model.ResultCache(cache_size)
+        self.timeout = timeout
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.run_timeout = run_timeout
+        self.max_running = processes or multiprocessing.cpu_count()
+        #Batches sent to the workers and not yet finished
+        self.running = 0
+        self.lock = threading.Lock()
+        self.queue_changed = threading.Condition(self.lock)
+        #Runs waiting for or being computed by key, and those not yet dispatched in order
+        self.in_flight = {}
+        self.queue = []
+        #The latest waiting request of each client
+        self.client_requests = {}
+        #Models by (model,control_type), for defaults and state templates
+        self.models = {}
+        for name in fisheries_model.MODEL_FACTORIES:
+            for control_type in ['catch','effort']:
+                self.models[(name,control_type)] = fisheries_model.MODEL_FACTORIES[name](control_type = control_type)
+        self.requests = 0
+        self.computed = 0
+        self.deduplicated = 0
+        self.superseded = 0
+        self.errors = 0
+        self.timed_out = 0
+        self.batch_size = Histogram([2,3,5,9,17,33])
+        self.queue_wait = Histogram([1,2,5,10,20,50,100])
+
+        self.batch_thread = threading.Thread(target=self._batch_loop)
+        self.batch_thread.daemon = True
+        self.batch_thread.start()
+
+    def close(self):
+        '''Stop the worker processes (or the coordinator)'''
+        if self.coordinator != None:
+            self.coordinator.close()
+        else:
+            self.pool.terminate()
+            self.pool.join()
+
+    def normalise(self,scenario):
+        '''
+        Return a scenario with defaults filled in and float parameter values,
+        raises ValueError for invalid scenarios
+        '''
+        if not isinstance(scenario,dict):
+            raise ValueError('The scenario must be a JSON object')
+        model = scenario.get('model','lobster')
+        control_type = scenario.get('control_type','catch')
+        if not self.models.has_key((model,control_type)):
+            raise ValueError('Unknown model or control type: %s, %s' % (model,control_type))
+        steps = scenario.get('steps',100)
+        if not isinstance(steps,int) or not 1 <= steps <= MAX_STEPS:
+            raise ValueError('steps must be an integer from 1 to %d' % MAX_STEPS)
+        overrides = scenario.get('parameters',{})
+        if not isinstance(overrides,dict):
+            raise ValueError('parameters must be a JSON object')
+        try:
+            parameters = fisheries_model.scenario_parameters(self.models[(model,control_type)],overrides)
+        except (KeyError,TypeError),e:
+            raise ValueError('Invalid parameters: %s' % e.args[0])
+        #Checked here so that single runs and batched runs fail alike
+        try:
+            self.models[(model,control_type)].check_parameters(parameters)
+        except ValueError,e:
+            raise ValueError('Invalid parameters: %s' % e)
+        return {'model': model,
+                'control_type': control_type,
+                'dynamic': bool(scenario.get('dynamic',True)),
+                'parameters': parameters,
+                'steps': steps}
+
+    def scenario_key(self,scenario):
+        '''Return the cache key of a normalised scenario'''
+        schema = self.models[(scenario['model'],scenario['control_type'])].get_schema()
+        return (scenario['model'],scenario['control_type'],scenario['dynamic'],scenario['steps'],
+                schema.key(scenario['parameters']))
+
+    def run(self,scenario,client=None):
+        '''
+        Return the output state of a scenario
+        client: identifies the client, its waiting request is superseded by this one
+        '''
+        scenario = self.normalise(scenario)
+        key = self.scenario_key(scenario)
+        template = self.models[(scenario['model'],scenario['control_type'])].state
+        with self.lock:
+            self.requests += 1
+            pending = self.in_flight.get(key)
+            if pending != None:
+                self.deduplicated += 1
+            elif not self.cache.has_key(key):
+                pending = PendingRun(key,scenario)
+                self.in_flight[key] = pending
+                self.queue.append(pending)
+                self.computed += 1
+                self.queue_changed.notify()
+            if pending != None:
+                request = Request(client,pending)
+                pending.requests.append(request)
+                if client != None:
+                    self._supersede(self.client_requests.get(client))
+                    self.client_requests[client] = request
+        if pending == None:
+            state = self.cache.get(key)
+            if state != None:
+                return state
+            #The result was dropped from the cache since it was checked
+            return self.run(scenario,client)
+
+        if not request.done.wait(self.timeout):
+            raise multiprocessing.TimeoutError()
+        if request.superseded:
+            raise Superseded('Superseded by a newer request from the same client')
+        if pending.error != None:
+            raise RuntimeError(pending.error)
+        return serialization.loads_state(pending.data,template)
+
+    def _supersede(self,request):
+        '''Drop a client's previous request if it has not been dispatched (call with the lock held)'''
+        if request == None or request.pending.dispatched or request.done.isSet():
+            return
+        pending = request.pending
+        pending.requests.remove(request)
+        request.superseded = True
+        request.done.set()
+        self.superseded += 1
+        #Nobody else is waiting for the run
+        if len(pending.requests) == 0:
+            self.queue.remove(pending)
+            del self.in_flight[pending.key]
+            self.computed -= 1
+
+    def _batch_loop(self):
+        '''Gather the queued runs into batches and send them to the workers'''
+        while True:
+            with self.lock:
+                while len(self.queue) == 0 or self.running >= self.max_running:
+                    self.queue_changed.wait()
+                first = self.queue[0].queued
+            #Give other requests the window to arrive
+            time.sleep(max(first+self.window-time.time(),0))
+
+            with self.lock:
+                #Runs of the same model and simulation settings are computed together, in the order queued
+                groups = {}
+                order = []
+                for pending in self.queue:
+                    scenario = pending.scenario
+                    group = (scenario['model'],scenario['control_type'],scenario['dynamic'],scenario['steps'])
+                    if not groups.has_key(group):
+                        groups[group] = []
+                        order.append(group)
+                    groups[group].append(pending)
+                batches = []
+                for group in order:
+                    for start in range(0,len(groups[group]),self.max_batch_size):
+                        batches.append(groups[group][start:start+self.max_batch_size])
+                #Only as many batches as there are free workers are sent, the
+                #others stay queued where they may still be superseded or batched
+                batches = batches[:self.max_running-self.running]
+                now = time.time()
+                for batch in batches:
+                    self.batch_size.add(len(batch))
+                    self.running += 1
+                    for pending in batch:
+                        pending.dispatched = True
+                        self.queue_wait.add((now-pending.queued)*1000)
+                        for request in pending.requests:
+                            if self.client_requests.get(request.client) is request:
+                                del self.client_requests[request.client]
+                self.queue = [pending for pending in self.queue if not pending.dispatched]
+
+            for batch in batches:
+                self._dispatch(batch)
+
+    def _dispatch(self,batch):
+        '''Send a batch of runs (counted in running) to the workers'''
+        scenarios = [pending.scenario for pending in batch]
+        #The batch fails if its result has not arrived in time, even if the worker never answers
+        timer = threading.Timer(self.run_timeout,self._finish,
+                                (batch,(None,'The model run took longer than %g s' % self.run_timeout),True))
+        timer.daemon = True
+        timer.start()
+        if self.coordinator != None:
+            self.coordinator.submit(scenarios[0],[scenario['parameters'] for scenario in scenarios],
+                                    callback = lambda results: self._finish(batch,results,timer=timer))
+        else:
+            #The worker process gives up too, so that it is free for the next batch
+            self.pool.apply_async(sweep_cluster.run_scenarios,(scenarios,self.run_timeout),
+                                  callback = lambda results: self._finish(batch,results,timer=timer))
+
+    def _finish(self,batch,results,timed_out=False,timer=None):
+        '''Hand the results of a batch to the waiting requests, once'''
+        if timer != None:
+            timer.cancel()
+        data,error = results
+        with self.lock:
+            if batch[0].finished:
+                return
+            for pending in batch:
+                pending.finished = True
+            if timed_out:
+                self.timed_out += 1
+            self.running -= 1
+            self.queue_changed.notify()
+        for index,pending in enumerate(batch):
+            if error == None:
+                pending.data = data[index]
+                scenario = pending.scenario
+                template = self.models[(scenario['model'],scenario['control_type'])].state
+                self.cache.put(pending.key,serialization.loads_state(pending.data,template),source='server')
+            else:
+                pending.error = error
+            with self.lock:
+                del self.in_flight[pending.key]
+                requests = list(pending.requests)
+            for request in requests:
+                request.done.set()
+
+    def model_descriptions(self):
+        '''Return the parameters of each model and control type'''
+        descriptions = {}
+        for (name,control_type),model in self.models.items():
+            descriptions.setdefault(name,{})[control_type] = model.get_parameters()
+        return descriptions
+
+    def stats(self):
+        '''Return the cache, request and batch counts'''
+        with self.lock:
+            stats = {'requests': self.requests,
+                     'computed': self.computed,
+                     'deduplicated': self.deduplicated,
+                     'superseded': self.superseded,
+                     'in_flight': len(self.in_flight),
+                     'running_batches': self.running,
+                     'queued': len(self.queue),
+                     'errors': self.errors,
+                     'timed_out_batches': self.timed_out,
+                     'window_ms': self.window*1000,
+                     'batch_size': self.batch_size.summary(),
+                     'queue_wait_ms': self.queue_wait.summary()}
+        stats['cache'] = self.cache.stats()
+        return stats
+
+def state_to_json(state):
+    '''Return a state as a JSON string, nan values (not valid JSON) become null'''
+    attributes = {}
+    for att in state.attribute_names():
+        attributes[att] = [None if math.isnan(value) else value for value in state[att]]
+    return json.dumps({'attributes': attributes,
+                       'attribute_order': state.attribute_order,
+                       'default_plot': state.default_plot,
+                       'convergence': state.convergence})
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''Handles the requests of the model server (see the module documentation)'''
+
+    #Keep connections open between requests
+    protocol_version = 'HTTP/1.1'
+    #Send each response in one go, small writes are delayed by the Nagle algorithm
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def send_json(self,body,status=200):
+        '''Send a JSON response'''
+        self.send_response(status)
+        self.send_header('Content-Type','application/json')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self,status,message):
+        '''Send an error as a JSON response'''
+        with self.server.service.lock:
+            self.server.service.errors += 1
+        self.send_json(json.dumps({'error': message}),status)
+
+    def do_GET(self):
+        if self.path == '/models':
+            self.send_json(json.dumps(self.server.service.model_descriptions()))
+        elif self.path == '/stats':
+            self.send_json(json.dumps(self.server.service.stats()))
+        else:
+            self.send_error_json(404,'Not found: ' + self.path)
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if self.path != '/run':
+            self.send_error_json(404,'Not found: ' + self.path)
+            return
+        try:
+            state = self.server.service.run(json.loads(body),self.headers.getheader('X-Client-Id'))
+        except ValueError,e:
+            self.send_error_json(400,str(e))
+            return
+        except Superseded,e:
+            self.send_error_json(409,str(e))
+            return
+        except multiprocessing.TimeoutError:
+            self.send_error_json(504,'The model run timed out')
+            return
+        except Exception,e:
+            self.send_error_json(500,'The model run failed: ' + str(e))
+            return
+        self.send_json(state_to_json(state))
+
+    def log_message(self,format,*args):
+        #Logging every request slows the server down with a class full of clients
+        pass
+
+class ModelServer(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+    '''HTTP server handling each connection in a thread, backed by a ModelService'''
+
+    daemon_threads = True
+    allow_reuse_address = True
+    #A whole class connecting at once overflows the default listen backlog of 5
+    request_queue_size = 128
+
+    def __init__(self,address=DEFAULT_ADDRESS,processes=None,cache_size=1024,window=0.005,coordinator=None):
+        BaseHTTPServer.HTTPServer.__init__(self,address,RequestHandler)
+        self.service = ModelService(processes,cache_size,window=window,coordinator=coordinator)
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.service.close()
+
+if __name__ == '__main__':
+    address = DEFAULT_ADDRESS
+    processes = None
+    window = 0.005
+    coordinator = None
+    if len(sys.argv) > 1:
+        host,port = sys.argv[1].rsplit(':',1)
+        address = (host,int(port))
+    if len(sys.argv) > 2:
+        processes = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        window = float(sys.argv[3])/1000
+    if len(sys.argv) > 4:
+        host,port = sys.argv[4].rsplit(':',1)
+        coordinator = sweep_cluster.Coordinator((host,int(port)))
+    server = ModelServer(address,processes or None,window=window,coordinator=coordinator)
+    print('Serving on http://%s:%d' % server.server_address)
+    if coordinator != None:
+        print('Batches are run by sweep workers connecting to %s:%d' % coordinator.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer management strategy evaluation
+Compares harvest control rules, which set the TAC each year from an observed
+cpue or biomass, by running each rule on many stochastic replicates of a model
+with lognormal variation of the growth and of the observations. The replicates
+of a rule are run at once by the vectorised model (the rule is called once a
+year with the observations of all of them), in batches across a pool of
+worker processes. Every rule sees the same random variation (the generators
+are seeded by the batch), so differences between rules are not from chance.
+Results are summary tables of the yield, NPV and risk of each rule.
+
+Usage: python mse.py [model] [replicates] [years] [processes]
+model is 'lobster' or 'fish' (default 'lobster'), a set of rules around the
+maximum sustainable yield of its default parameters is compared.
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import copy
+import multiprocessing
+import sys
+import time
+
+import numpy
+
+import fisheries_model
+import vector_model
+
+class ConstantCatch:
+    '''A TAC that does not depend on the stock'''
+
+    observation = 'biomass'
+
+    def __init__(self,tac):
+        self.tac = tac
+        self.name = 'Constant catch %.3g' % tac
+
+    def __call__(self,observed,parameters):
+        return self.tac*numpy.ones(numpy.shape(observed))
+
+class HarvestRate:
+    '''A TAC of a fixed proportion of the observed biomass, up to a maximum'''
+
+    observation = 'biomass'
+
+    def __init__(self,rate,maximum=numpy.inf):
+        self.rate = rate
+        self.maximum = maximum
+        self.name = 'Harvest rate %.3g' % rate
+        if maximum < numpy.inf:
+            self.name += ', max %.3g' % maximum
+
+    def __call__(self,observed,parameters):
+        return numpy.minimum(self.rate*observed,self.maximum)
+
+class ThresholdRule:
+    '''
+    A "hockey stick" rule: no catch below a limit cpue (or biomass), the
+    maximum TAC above a target, and in proportion between them
+    '''
+
+    def __init__(self,limit,target,maximum,observation='cpue'):
+        self.limit = limit
+        self.target = target
+        self.maximum = maximum
+        self.observation = observation
+        self.name = 'Threshold %s %.3g-%.3g, max %.3g' % (observation,limit,target,maximum)
+
+    def __call__(self,observed,parameters):
+        return self.maximum*numpy.clip((observed-self.limit)/float(self.target-self.limit),0,1)
+
+def default_rules(parameters):
+    '''Return a set of rules to compare around the maximum sustainable yield of the parameter values'''
+    r = parameters['r']
+    K = parameters['K']
+    msy = r*K/4
+    #The cpue at a biomass of K
+    cpue = parameters['catch_rate']
+    return [ConstantCatch(0.6*msy),
+            ConstantCatch(0.8*msy),
+            ConstantCatch(msy),
+            HarvestRate(r/4),
+            HarvestRate(r/2),
+            ThresholdRule(0.2*cpue,0.5*cpue,msy),
+            ThresholdRule(0.1*cpue,0.4*cpue,1.2*msy)]
+
+def mse_model(model,rule,process_error=0.1,observation_error=0.2,seed=[0]):
+    '''
+    Return a copy of a model (eg. from lobsterModel) with the TAC set by a
+    harvest control rule in place of its catch or effort control, and with
+    lognormal variation of the growth and of the observations
+    process_error,observation_error: the standard deviations of the variation
+    seed: a list of integers seeding the random variation
+    '''
+    model = copy.deepcopy(model)
+    functions = []
+    for function in model.functions:
+        if isinstance(function,(fisheries_model.CatchFixed,fisheries_model.EffortFixed)):
+            control = fisheries_model.HarvestControlRule(rule,rule.observation,observation_error,
+                                                         numpy.random.RandomState(seed+[1]))
+            control.catch_rate.update(function.catch_rate)
+            functions.append(fisheries_model.ProcessError(process_error,numpy.random.RandomState(seed+[0])))
+            functions.append(control)
+        else:
+            functions.append(function)
+    return fisheries_model.Model(functions = functions,initial_state = model.state,parameters = model.parameters)
+
+def replicate_metrics(state,parameters,limit):
+    '''
+    Return a dict of arrays of the results of each replicate of a vectorised run
+    limit: the limit biomass, as a proportion of K
+    '''
+    catch = numpy.array(state['catch'][1:])
+    biomass = numpy.array(state['biomass'][1:])
+    below = biomass < limit*parameters['K']
+    with numpy.errstate(divide='ignore',invalid='ignore'):
+        #Average annual variation of the catch
+        aav = numpy.abs(numpy.diff(catch,axis=0)).sum(axis=0)/catch[1:].sum(axis=0)
+    return {'mean_catch': catch.mean(axis=0),
+            'aav': aav,
+            'npv': numpy.nansum(numpy.array(state['discounted_profit'][1:]),axis=0),
+            'below_limit': below.any(axis=0),
+            'years_below': below.mean(axis=0),
+            'final_depletion': biomass[-1]/parameters['K']}
+
+def _evaluate_batch(task):
+    '''Run a batch of replicates of a rule (in a worker process) and return their metrics'''
+    model,rule,replicates,years,process_error,observation_error,limit,seed = task
+    vector = vector_model.ensembleModel(mse_model(model,rule,process_error,observation_error,seed),replicates)
+    vector.set_parameters(dict(model.parameters))
+    vector.run(years)
+    return replicate_metrics(vector.state,model.parameters,limit)
+
+def summarise(rule,metrics):
+    '''Return the summary table row of a rule from the metrics of its replicates'''
+    return {'rule': rule.name,
+            'replicates': len(metrics['npv']),
+            'mean_catch': metrics['mean_catch'].mean(),
+            'aav': numpy.nanmean(metrics['aav']),
+            'npv_mean': metrics['npv'].mean(),
+            'npv_p5': numpy.percentile(metrics['npv'],5),
+            'risk': metrics['below_limit'].mean(),
+            'years_below': metrics['years_below'].mean(),
+            'final_depletion': numpy.median(metrics['final_depletion'])}
+
+def evaluate(model,rules,replicates=1000,years=50,process_error=0.1,observation_error=0.2,limit=0.2,
+             seed=0,processes=None,batch_size=500):
+    '''
+    Evaluate harvest control rules and return the summary table, a list of one
+    dict per rule (see TABLE_COLUMNS)
+    model: the model (eg. from lobsterModel) with its parameter values set
+    rules: the rules, functions of the observed values and the parameter values
+    that return the TAC, with an observation attribute ('cpue' or 'biomass')
+    replicates,years: the number of stochastic replicates and years of each rule
+    process_error,observation_error: the standard deviations of the lognormal
+    variation of the growth and of the observations
+    limit: the limit biomass as a proportion of K, the risk is the probability
+    of falling below it in any year
+    processes: the number of worker processes (default number of cpus), 1 runs
+    in this process
+    batch_size: the largest number of replicates run at once
+    '''
+    starts = range(0,replicates,batch_size)
+    tasks = [(model,rule,min(batch_size,replicates-start),years,process_error,observation_error,limit,[seed,batch])
+             for rule in rules for batch,start in enumerate(starts)]
+    if processes == 1:
+        results = map(_evaluate_batch,tasks)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_evaluate_batch,tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    table = []
+    for index,rule in enumerate(rules):
+        batches = results[index*len(starts):(index+1)*len(starts)]
+        metrics = dict([(key,numpy.concatenate([batch[key] for batch in batches])) for key in batches[0]])
+        table.append(summarise(rule,metrics))
+    return table
+
+#The columns of the summary table: key, title and format
+TABLE_COLUMNS = [('rule','Rule','%s'),
+                 ('mean_catch','Mean catch','%.4g'),
+                 ('aav','AAV','%.3f'),
+                 ('npv_mean','Mean NPV','%.4g'),
+                 ('npv_p5','5% NPV','%.4g'),
+                 ('risk','P(B<limit)','%.3f'),
+                 ('years_below','Years<limit','%.3f'),
+                 ('final_depletion','Final B/K','%.3f')]
+
+def format_table(table,columns=TABLE_COLUMNS):
+    '''Return a summary table as aligned text'''
+    rows = [[title for key,title,format in columns]]
+    for row in table:
+        rows.append([format % row[key] for key,title,format in columns])
+    widths = [max([len(row[i]) for row in rows]) for i in range(len(columns))]
+    lines = []
+    for row in rows:
+        #The rule is left aligned, the numbers right aligned
+        cells = [row[0].ljust(widths[0])]+[cell.rjust(width) for cell,width in zip(row[1:],widths[1:])]
+        lines.append('  '.join(cells))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    name = 'lobster'
+    replicates = 1000
+    years = 50
+    processes = None
+    if len(sys.argv) > 1:
+        name = sys.argv[1]
+    if len(sys.argv) > 2:
+        replicates = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        years = int(sys.argv[3])
+    if len(sys.argv) > 4:
+        processes = int(sys.argv[4])
+
+    model = fisheries_model.MODEL_FACTORIES[name]()
+    p = model.get_parameters()
+    model.set_parameters(dict([(param,float(p[param]['value'])) for param in p]))
+    model.reset()
+
+    rules = default_rules(model.parameters)
+    start = time.time()
+    table = evaluate(model,rules,replicates,years,processes=processes)
+    print('%d rules x %d replicates x %d years in %.2f s' % (len(rules),replicates,years,time.time()-start))
+    print(format_table(table))
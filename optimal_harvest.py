@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer optimal harvest paths
+Finds the catch of each time step that maximises the NPV of a logistic stock
+(fisheries_model.PDLogistic) fished for the profit of fisheries_model.Economics,
+by backward induction over a grid of biomass values.
+The decision each time step is the escapement, the biomass left after the
+catch, from a grid of biomass values. The biomass of every time step after the
+first is an escapement, so the states are the escapements and the current
+biomass and no interpolation is needed. The revenue less the effort cost of
+every state and escapement is calculated once, as a matrix, and each time step
+is a maximum over its rows.
+The profit is the profit of the model, small profits and losses counting as
+0, with the fleet held at its current size. That is the fleet of the model
+unless it adjusts to the profit (movement_rate > 0, see
+fisheries_model.Economics), in which case the NPV of the path is taken from
+its simulation by the model. Solving for the fleet size as well would take a
+state per biomass and fleet size.
+
+Usage: python optimal_harvest.py [steps]
+solves each model and control type with its default parameters and checks
+that the NPV of each path is the NPV of its simulation.
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import copy
+import sys
+import time
+
+import numpy
+
+import fisheries_model
+
+def growth(biomass,parameters):
+    '''The biomass after a time step of logistic growth (see fisheries_model.PDLogistic)'''
+    return numpy.maximum(biomass+biomass*parameters['r']*(1-biomass/parameters['K']),0)
+
+def margin(biomass,escapement,parameters):
+    '''
+    Return the revenue less the effort cost of each biomass (rows) and
+    escapement (columns), nan if the escapement is more than the biomass after growth
+    The cpue, and so the effort of a catch, is set by the biomass at the start
+    of the time step as in fisheries_model.CatchFixed.
+    '''
+    catch = growth(biomass,parameters)[:,numpy.newaxis]-escapement[numpy.newaxis,:]
+    with numpy.errstate(divide='ignore',invalid='ignore'):
+        #The cost of the effort to catch a unit of biomass
+        effort_cost = parameters['marginal_cost']*parameters['K']/(biomass*parameters['catch_rate'])
+        margin = numpy.where(catch > 0,catch*(parameters['beach_price']-effort_cost[:,numpy.newaxis]),0)
+    margin[catch < 0] = numpy.nan
+    return margin
+
+def profit(margin,fleet_size,parameters):
+    '''
+    Return the profit of each biomass and escapement of a margin (see margin)
+    with a fleet size, as fisheries_model.profit_column, -inf where the
+    escapement cannot be reached
+    '''
+    profit = margin-fleet_size*parameters['fixed_cost']
+    with numpy.errstate(invalid='ignore'):
+        #Small profits and losses count as 0
+        profit[numpy.abs(profit) < 1000000] = 0
+    profit[numpy.isnan(profit)] = -numpy.inf
+    return profit
+
+class HarvestPath:
+    '''The NPV maximising harvest policy of a model, and its path from the current state (see solve)'''
+
+    def __init__(self,biomass,choices,policy,value,start,parameters):
+        '''
+        biomass: the biomass of each state
+        choices: the state of each escapement
+        policy: the escapement (index in choices) of each time step (rows) and state
+        value: the NPV of each state at the first time step
+        start: the state of the current biomass
+        parameters: the model parameter values
+        '''
+        self.biomass = biomass
+        self.escapement = biomass[choices]
+        self.choices = choices
+        self.policy = policy
+        self.value = value
+        self.parameters = parameters
+        self.npv = value[start]
+        #Whether the fleet keeps its size in the simulation of the path (see solve)
+        self.fleet_fixed = True
+
+        #Follow the policy from the current biomass
+        grown = growth(biomass,parameters)
+        self.catches = []
+        self.biomass_path = [biomass[start]]
+        index = start
+        for step in range(len(policy)):
+            choice = policy[step,index]
+            self.catches.append(grown[index]-self.escapement[choice])
+            index = choices[choice]
+            self.biomass_path.append(biomass[index])
+
+    def catch(self,step,biomass):
+        '''Return the optimal catch at a time step (counted from the start) and biomass, from the nearest state'''
+        index = numpy.abs(self.biomass-biomass).argmin()
+        return growth(self.biomass[index],self.parameters)-self.escapement[self.policy[step,index]]
+
+def solve(model,steps,escapement_points=1000,should_continue=None):
+    '''
+    Return the HarvestPath maximising the NPV of the next steps time steps of
+    the model, from its current state
+    model: a model (eg. from lobsterModel) with its parameter values set
+    escapement_points: the number of escapement values
+    should_continue: a function checked every time step, None is returned if
+    it returns False (optional)
+    The fleet_fixed attribute of the path is False if the fleet size changes
+    in its simulation (see the module documentation).
+    '''
+    parameters = model.parameters
+    r = parameters['r']
+    K = parameters['K']
+    initial = model.state.get('biomass')
+
+    #The escapements cover the biomass after growth from any of them
+    maximum = max(K,initial)
+    if r > 0:
+        maximum = max(maximum,K*(1+r)**2/(4*r))
+    escapement = numpy.linspace(0,maximum,escapement_points)
+    #The current biomass is added to the states
+    biomass = numpy.union1d(escapement,[initial])
+    choices = numpy.searchsorted(biomass,escapement)
+    start = numpy.searchsorted(biomass,initial)
+    fleet_size = model.state.get('fleet_size')
+    discount = 1-parameters['discount_rate']
+
+    reward = profit(margin(biomass,escapement,parameters),fleet_size,parameters)
+    total = numpy.empty_like(reward)
+    rows = numpy.arange(len(biomass))
+    policy = numpy.empty((steps,len(biomass)),dtype=numpy.int32)
+    #The NPV from each time step on, in the money of that time step, none after the last
+    value = numpy.zeros(len(biomass))
+    for step in range(steps-1,-1,-1):
+        if should_continue != None and not should_continue():
+            return None
+        numpy.add(reward,discount*value[choices],out=total)
+        best = total.argmax(axis=1)
+        policy[step] = best
+        value = total[rows,best]
+
+    #The NPV is discounted to the first time step, as in fisheries_model.Economics
+    value = value*discount**model.state.time()
+    path = HarvestPath(biomass,choices,policy,value,start,parameters)
+
+    #Where the fleet adjusts the NPV is that of the model
+    state = simulate(model,path)
+    path.fleet_fixed = (numpy.array(state['fleet_size'][-steps:]) == fleet_size).all()
+    if not path.fleet_fixed:
+        path.npv = state.npv()
+    return path
+
+def simulate(model,path):
+    '''
+    Return the output state of a run of the model that takes the catches of a
+    HarvestPath, as a TAC or as the effort needed to take the catch (by the
+    model control type)
+    '''
+    model = copy.deepcopy(model)
+    model.parameters = dict(model.parameters)
+    if model.get_control_variable() == 'catch':
+        #A schedule of the TACs, from the time step after the current one
+        start = model.state.time()
+        model.parameters['catch'] = fisheries_model.Schedule(numpy.concatenate([numpy.zeros(start),path.catches]))
+        model.run(len(path.catches))
+        return model.state
+
+    #The effort to take each catch depends on the biomass, so the time steps are run one by one
+    for catch in path.catches:
+        cpue = model.state.get('biomass')/model.parameters['K']*model.parameters['catch_rate']
+        if cpue > 0:
+            model.parameters['effort'] = catch/cpue
+        else:
+            model.parameters['effort'] = 0
+        model.run(1)
+    return model.state
+
+class OptimalPathJob:
+    '''
+    A background solution of the optimal harvest path (see
+    fisheries_model.PrecomputeThread), its simulation is handed to a function
+    rather than cached
+    '''
+
+    def __init__(self,model,steps,function,source='optimal'):
+        '''
+        model, steps: as for solve
+        function: called with the output state of the simulation of the path
+        '''
+        self.keys = []
+        self.model = model
+        self.steps = steps
+        self.function = function
+        self.source = source
+
+    def execute(self,should_continue):
+        '''Run the job and return no results to cache, or None if it should not continue'''
+        path = solve(self.model,self.steps,should_continue=should_continue)
+        if path == None:
+            return None
+        self.function(simulate(self.model,path))
+        return []
+
+def check(model,steps,tolerance=1e-9):
+    '''
+    Solve a model and return the path, the NPV of its simulation and whether
+    they agree to within tolerance (relative)
+    '''
+    path = solve(model,steps)
+    npv = simulate(model,path).npv()
+    return path,npv,abs(path.npv-npv) <= tolerance*max(abs(path.npv),abs(npv))
+
+if __name__ == '__main__':
+    steps = 100
+    if len(sys.argv) > 1:
+        steps = int(sys.argv[1])
+
+    failed = False
+    for name in sorted(fisheries_model.MODEL_FACTORIES):
+        for control_type in ['catch','effort']:
+            model = fisheries_model.MODEL_FACTORIES[name](control_type = control_type)
+            model.set_parameters(fisheries_model.scenario_parameters(model))
+            model.reset()
+            start = time.time()
+            path,npv,agree = check(model,steps)
+            print('%s, %s control: NPV %.6g, simulated %.6g, fleet %s in %.2f s%s' %
+                  (name,control_type,path.npv,npv,'fixed' if path.fleet_fixed else 'adjusting',
+                   time.time()-start,'' if agree else ' MISMATCH'))
+            failed = failed or not agree
+    sys.exit(failed)
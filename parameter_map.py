@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer parameter maps
+A measure of a dynamic model run (the NPV or the total catch) over a grid of
+the values of two parameters, eg. TAC by beach price, drawn as a heatmap with
+contours. The grid fills progressively: nested grids of 26, 51, 101 and 201
+values a side (each has every other value of the next), computed a batch of
+cells at a time by a vectorised ensemble run (see vector_model.ensembleModel)
+and drawn upsampled until the next grid is complete. The cells of a finer grid
+that straddle a contour of the coarser one are computed first, so contours
+sharpen before the flat areas do.
+The values of each axis are slider positions (0 to 1000, as in the GUI), so
+computed cells are cached by position and reused when an axis range changes.
+This has no wx dependency (see fisheries_gui.ParameterMapFrame).
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import numpy
+
+import colourblind
+import vector_model
+
+#The values a side of the nested grids, (LEVELS[0]-1)*2**n+1 for each
+LEVELS = [26,51,101,201]
+#The most cells computed by one ensemble run
+BATCH_SIZE = 2000
+#The number of contours drawn (and refined first)
+CONTOURS = 8
+#The slider positions of the range of a parameter
+POSITIONS = 1000
+#The measures of a run: the attribute summed over its time steps, and the
+#colour map and whether it diverges from 0 (eg. profit and loss)
+MEASURES = {'npv': {'attribute': 'discounted_profit','title': 'NPV','colourmap': 'redBlueMap','diverging': True},
+            'yield': {'attribute': 'catch','title': 'Total catch','colourmap': 'blueMap','diverging': False}}
+#The colourblind colour maps that may be chosen
+COLOURMAPS = ['blueMap','blueGrayMap','brownBlueMap','redBlueMap']
+
+def axis_positions(low,high,size=LEVELS[-1]):
+    '''Return size slider positions from low to high (rounded, so some may repeat)'''
+    return numpy.floor(numpy.linspace(low,high,size)+0.5).astype(int)
+
+def upsample(grid,stride):
+    '''Return a grid interpolated (bilinearly) to stride times the resolution'''
+    rows,columns = grid.shape
+    fine_rows = numpy.arange((rows-1)*stride+1)
+    fine_columns = numpy.arange((columns-1)*stride+1)
+    grid = numpy.array([numpy.interp(fine_rows,numpy.arange(rows)*stride,column) for column in grid.T]).T
+    return numpy.array([numpy.interp(fine_columns,numpy.arange(columns)*stride,row) for row in grid])
+
+class ParameterMap:
+    '''
+    The grid of a measure over two parameters of a model, and its refinement
+    (see the module)
+    Use set_view to choose the parameters and their ranges, then refine until
+    it returns 0; image gives the best grid so far.
+    '''
+
+    def __init__(self,model,steps=100):
+        '''
+        model: the model run (with a state to run from)
+        steps: the time steps of each run
+        '''
+        self.model = model
+        self.schema = model.get_schema()
+        self.steps = steps
+        #The computed values by context (see set_view), each a dict by (x position,y position)
+        self.cache = {}
+        self.values = None
+
+    def set_view(self,parameters,x,y,x_range=(0,POSITIONS),y_range=(0,POSITIONS),measure='npv'):
+        '''
+        Set the map shown
+        parameters: the values of the other parameters
+        x,y: the parameters of the axes
+        x_range,y_range: the lowest and highest slider position of each axis
+        measure: a name of MEASURES
+        '''
+        self.parameters = dict(parameters)
+        self.x = x
+        self.y = y
+        self.measure = measure
+        self.x_positions = axis_positions(*x_range)
+        self.y_positions = axis_positions(*y_range)
+        self.repeated = len(numpy.unique(self.x_positions))+len(numpy.unique(self.y_positions)) < 2*LEVELS[-1]
+
+        #The cells of the other parameter values computed before
+        vector = self.schema.to_vector(self.parameters)
+        vector[[self.schema.index[x],self.schema.index[y]]] = 0
+        self.cells = self.cache.setdefault((self.schema.key(vector),x,y,measure,self.steps),{})
+        size = LEVELS[-1]
+        self.values = numpy.ones((size,size))*numpy.nan
+        for row,y_position in enumerate(self.y_positions):
+            for column,x_position in enumerate(self.x_positions):
+                self.values[row,column] = self.cells.get((x_position,y_position),numpy.nan)
+        self.level = 0
+        self.queue = None
+
+    def parameter_values(self,param,positions):
+        '''Return the values of a parameter at slider positions'''
+        index = self.schema.index[param]
+        return numpy.asarray(positions,dtype=float)/POSITIONS*(self.schema.max[index]-self.schema.min[index])+self.schema.min[index]
+
+    def evaluate(self,rows,columns):
+        '''Return the measure of the cells (arrays of rows and columns), run at once'''
+        x_values = self.parameter_values(self.x,self.x_positions[columns])
+        y_values = self.parameter_values(self.y,self.y_positions[rows])
+        parameters = dict(self.parameters)
+        parameters[self.x] = x_values
+        parameters[self.y] = y_values
+        vector = vector_model.ensembleModel(self.model,len(rows))
+        vector.set_parameters(parameters)
+        vector.run(self.steps)
+        column = numpy.array(vector.state[MEASURES[self.measure]['attribute']][1:])
+        return numpy.nansum(column,axis=0)
+
+    def stride(self,level):
+        '''Return the stride of the cells of a level in the finest grid'''
+        return (LEVELS[-1]-1)//(LEVELS[level]-1)
+
+    def contour_levels(self,values=None):
+        '''Return the contour values of the computed cells (or of values), None if there are none'''
+        if values is None:
+            values = self.values
+        finite = values[numpy.isfinite(values)]
+        if len(finite) == 0 or finite.min() == finite.max():
+            return None
+        return numpy.linspace(finite.min(),finite.max(),CONTOURS+2)[1:-1]
+
+    def _queue(self,level):
+        '''
+        Return the rows and columns of the cells of a level left to compute,
+        those in a cell of the coarser level crossed by a contour first
+        '''
+        stride = self.stride(level)
+        rows,columns = numpy.mgrid[0:LEVELS[-1]:stride,0:LEVELS[-1]:stride]
+        rows,columns = rows.ravel(),columns.ravel()
+        missing = numpy.isnan(self.values[rows,columns])
+        rows,columns = rows[missing],columns[missing]
+        if level == 0 or len(rows) == 0:
+            return rows,columns
+
+        #The contour bands of the corners of each cell of the coarser grid
+        coarse = self.values[::2*stride,::2*stride]
+        contours = self.contour_levels(coarse)
+        if contours is None:
+            return rows,columns
+        bands = numpy.where(numpy.isnan(coarse),-1,numpy.searchsorted(contours,coarse))
+        corners = [bands[:-1,:-1],bands[1:,:-1],bands[:-1,1:],bands[1:,1:]]
+        crossed = numpy.zeros(corners[0].shape,dtype=bool)
+        for corner in corners[1:]:
+            crossed |= corner != corners[0]
+        crossed |= numpy.isnan(coarse[:-1,:-1])
+        last = len(crossed)-1
+        near = crossed[numpy.minimum(rows//(2*stride),last),numpy.minimum(columns//(2*stride),last)]
+        order = numpy.argsort(~near,kind='mergesort')
+        return rows[order],columns[order]
+
+    def refine(self,size=BATCH_SIZE):
+        '''Compute up to size more cells, return the number computed (0 when the map is complete)'''
+        while self.level < len(LEVELS):
+            if self.queue is None:
+                self.queue = self._queue(self.level)
+            rows,columns = self.queue
+            if len(rows) > 0:
+                break
+            self.level += 1
+            self.queue = None
+        else:
+            return 0
+
+        rows,columns = rows[:size],columns[:size]
+        self.queue = self.queue[0][size:],self.queue[1][size:]
+        values = self.evaluate(rows,columns)
+        self.values[rows,columns] = values
+        for row,column,value in zip(rows,columns,values):
+            self.cells[(self.x_positions[column],self.y_positions[row])] = value
+        #Repeated positions (a range narrower than the grid) are the same cell
+        if self.repeated:
+            self._fill_from_cache()
+        return len(rows)
+
+    def _fill_from_cache(self):
+        '''Set the missing values of cells at positions already computed'''
+        for row,column in zip(*numpy.nonzero(numpy.isnan(self.values))):
+            value = self.cells.get((self.x_positions[column],self.y_positions[row]))
+            if value != None:
+                self.values[row,column] = value
+
+    def complete(self):
+        '''Whether every cell has been computed'''
+        return not numpy.isnan(self.values).any()
+
+    def image(self):
+        '''
+        Return the best grid so far: the finest complete level upsampled, with
+        the cells computed since
+        '''
+        image = self.values.copy()
+        for level in range(len(LEVELS)):
+            stride = self.stride(level)
+            grid = self.values[::stride,::stride]
+            if numpy.isnan(grid).any():
+                break
+            image = upsample(grid,stride)
+        computed = ~numpy.isnan(self.values)
+        image[computed] = self.values[computed]
+        return image
+
+class MapLayout:
+    '''
+    Draws a ParameterMap on a matplotlib figure, as a heatmap with contours
+    and a colour bar, updating the artists in place as the map refines
+    '''
+
+    def __init__(self,fig):
+        self.fig = fig
+        self.axes = None
+        self.colourmap = None
+
+    def set_colourmap(self,name):
+        '''Set the colour map, a name of COLOURMAPS or None for that of the measure'''
+        self.colourmap = name
+
+    def _axis(self,parameter_map,param,positions):
+        '''Return the displayed range and label of an axis'''
+        p = parameter_map.schema.parameters[param]
+        values = parameter_map.parameter_values(param,positions[[0,-1]])/p['scale']
+        label = p['title']
+        if p['units'] != '':
+            label += ' (' + p['units'] + ')'
+        return values,label
+
+    def update(self,parameter_map):
+        '''Draw the current image of the map'''
+        measure = MEASURES[parameter_map.measure]
+        attributes = parameter_map.model.state.attributes
+        scale = attributes[measure['attribute']]['scale']
+        image = parameter_map.image()/scale
+        x_values,x_label = self._axis(parameter_map,parameter_map.x,parameter_map.x_positions)
+        y_values,y_label = self._axis(parameter_map,parameter_map.y,parameter_map.y_positions)
+        extent = [x_values[0],x_values[1],y_values[0],y_values[1]]
+
+        colourmap = colourblind.getMap(self.colourmap or measure['colourmap'])
+        finite = image[numpy.isfinite(image)]
+        if len(finite) == 0:
+            limits = (0,1)
+        elif measure['diverging']:
+            largest = max(numpy.abs(finite).max(),1e-9)
+            limits = (-largest,largest)
+        else:
+            limits = (finite.min(),max(finite.max(),finite.min()+1e-9))
+
+        if self.axes is None:
+            self.axes = self.fig.add_subplot(111)
+            self.heatmap = self.axes.imshow(image,origin='lower',aspect='auto',interpolation='nearest',
+                                            extent=extent,cmap=colourmap)
+            self.colourbar = self.fig.colorbar(self.heatmap,ax=self.axes)
+            self.contours = None
+        else:
+            self.heatmap.set_data(image)
+            self.heatmap.set_extent(extent)
+            self.heatmap.set_cmap(colourmap)
+        self.heatmap.set_clim(*limits)
+        self.colourbar.set_label('%s (%s)' % (measure['title'],attributes[measure['attribute']]['units']))
+
+        #The contours are redrawn, they change with every batch of cells
+        if self.contours != None:
+            for collection in self.contours.collections:
+                collection.remove()
+            self.contours = None
+        contours = parameter_map.contour_levels(image)
+        if contours is not None:
+            x = numpy.linspace(extent[0],extent[1],image.shape[1])
+            y = numpy.linspace(extent[2],extent[3],image.shape[0])
+            self.contours = self.axes.contour(x,y,image,contours,colors=[colourblind.rgbScaled[0]],linewidths=0.5)
+
+        self.axes.set_xlabel(x_label)
+        self.axes.set_ylabel(y_label)
+        self.axes.set_xlim(extent[:2])
+        self.axes.set_ylim(extent[2:])
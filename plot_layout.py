@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer plot layout
+Lays out a fishery state on a matplotlib figure: one right hand axis per unit,
+colour per unit, dash style per attribute and the NPV text. This has no wx
+dependency so it is shared by the GUI plot panel and the report renderer.
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import numpy
+import colourblind
+
+def sig_round(number):
+    '''Ceil a number to a nice round figure for limits'''
+    if number == 0:
+        return 0
+    sig = number/(10**numpy.floor(numpy.log10(number*2)))
+
+    if sig < 2:
+        factor_multiple = 2.0
+    elif sig < 5:
+        factor_multiple = 2.0
+    else:
+        factor_multiple = 1.0
+
+
+    factor = 10**(numpy.floor(numpy.log10(number*factor_multiple)))/factor_multiple
+    rounded = numpy.ceil(number/factor)*factor
+    return rounded
+
+def minmax_downsample(x,y,bins):
+    '''
+    Reduce a line to about 2*bins points, keeping the minimum and maximum of
+    each bin (in their original order) so that peaks and collapses remain visible
+    x, y: the line data
+    bins: the number of bins, typically the width of the plot in pixels
+    '''
+    x = numpy.asarray(x,dtype=float)
+    y = numpy.asarray(y,dtype=float)
+    n = len(y)
+    if bins < 1 or n <= 2*bins:
+        return x,y
+
+    #Pad the data to a whole number of bins by repeating the last value
+    size = int(numpy.ceil(n/float(bins)))
+    bins = int(numpy.ceil(n/float(size)))
+    padded = numpy.empty(bins*size)
+    padded[:n] = y
+    padded[n:] = y[-1]
+    padded = padded.reshape(bins,size)
+
+    #Index of the minimum and maximum of each bin, ignoring nans
+    missing = numpy.isnan(padded)
+    low = numpy.where(missing,numpy.inf,padded).argmin(axis=1)
+    high = numpy.where(missing,-numpy.inf,padded).argmax(axis=1)
+    offset = numpy.arange(bins)*size
+    index = numpy.sort(numpy.column_stack((low+offset,high+offset)),axis=1).ravel()
+    index = numpy.concatenate(([0],numpy.minimum(index,n-1),[n-1]))
+    return x[index],y[index]
+
+class FigureLayout:
+    '''Plots the selected attributes of a fishery state on a figure'''
+
+    line_colours = colourblind.rgbScaled
+    line_styles = [[127,1],         #solid
+                   [5,5],           #dashed
+                   [20,20,2,20],       #dash-dot
+                   [2,2,2,2]        #dotted
+                   ]
+
+    def __init__(self,fig):
+        '''
+        fig: the matplotlib figure to draw on
+        '''
+        self.fig = fig
+        self.state = None
+        self.selected = []
+        self.bounds = {}
+        self.xbound = 0
+        self.npv = float('nan')
+        #Width of the plot in pixels, lines are downsampled to this resolution
+        self.pixel_width = 1000
+        #Downsampled (x,y) line data by attribute, cleared when the data change
+        self.line_cache = {}
+        #Simulation settings, dynamic (or static) and the control type ('catch' or 'effort')
+        self.dynamic = True
+        self.control_type = 'catch'
+        #The axes by unit and lines by attribute made so far, shown when selected (see setup_axes)
+        self.unit_axes = {}
+        self.lines = {}
+        #The (colour,whether first) each axes is styled for
+        self.unit_axes_style = {}
+        self.npvtext = None
+
+    def set_simulation(self,dynamic,control_type):
+        '''Set the simulation type, which determines the x axis'''
+        if (dynamic,control_type) != (self.dynamic,self.control_type):
+            self.line_cache = {}
+        self.dynamic = dynamic
+        self.control_type = control_type
+
+    def set_pixel_width(self,width):
+        '''Set the width of the plot in pixels'''
+        if width != self.pixel_width:
+            self.line_cache = {}
+        self.pixel_width = width
+
+    def set_state(self,state):
+        '''Set the state that is being plotted'''
+        self.state = state
+        self.line_cache = {}
+        self.npv = self.state.npv()
+        self.update_line_styles()
+
+    def update_line_styles(self):
+        '''
+        Update the colour and style associated with each unit and parameter
+        '''
+        self.unit_colour = {}
+        self.parameter_style = {}
+
+        #For tracking the number of parameters per unit
+        unit_count = {}
+
+        #Determine colours for units
+        for unit in self.state.unit_order:
+            self.unit_colour[unit] = self.line_colours[len(self.unit_colour)]
+            unit_count[unit] = 0
+
+        #Determine line styles for parameters
+        for param in self.state.attribute_order:
+            unit = self.state.get_attribute_units(param)
+            self.parameter_style[param] = self.line_styles[unit_count[unit]]
+            unit_count[unit] += 1
+
+    def get_units(self):
+        '''
+        Returns a list of units that will be plotted
+        '''
+        units = []
+        for param in self.selected:
+            unit = self.state.get_attribute_units(param)
+            if unit not in units:
+                units.append(unit)
+
+        return units
+
+    def setup_axes(self,selected):
+        '''
+        Show the axes and lines of the selected attributes, required if the
+        selection or the units have changed. The axes (one per unit) and lines
+        (one per attribute) are kept once made, and shown, hidden, moved and
+        restyled rather than rebuilt.
+        selected: the attributes to plot
+        '''
+        self.selected = list(selected)
+
+        #The figure was cleared since the axes were made
+        if len(self.unit_axes) > 0 and self.unit_axes.values()[0] not in self.fig.axes:
+            self.unit_axes = {}
+            self.unit_axes_style = {}
+            self.lines = {}
+            self.npvtext = None
+
+        #The shown axes and lines
+        self.axes = {}
+        self.plot_data = {}
+        self.axes_xscale = {}
+
+        max_width = 0.87
+        width_increment = 0.07
+        bottom_space = .13
+        units = self.get_units()
+        pos=[.05, bottom_space, max_width-width_increment*(len(units)-1), 1-bottom_space-0.05]
+
+        #Show the axes, one for each unit, the first (with the x axis) at the back
+        for unit in units:
+            first_figure = len(self.axes)==0
+            colour = self.unit_colour[unit]
+
+            if not self.unit_axes.has_key(unit):
+                self.unit_axes[unit] = self.fig.add_axes(pos,frameon=True,label=unit)
+                self.unit_axes[unit].yaxis.tick_right()
+                self.unit_axes[unit].yaxis.set_label_position('right')
+                self.unit_axes[unit].set_ylabel(unit)
+            self.axes[unit] = self.unit_axes[unit]
+            self.axes[unit].set_position(pos)
+            self.axes[unit].set_zorder(len(self.axes)-1)
+            self.axes[unit].set_visible(True)
+
+            self.axes_xscale[unit] = pos[2]/(max_width-width_increment*(len(units)-1))
+            if first_figure:
+                self.firstaxes = self.axes[unit]
+            if self.unit_axes_style.get(unit) != (tuple(colour),first_figure):
+                self.style_axes(self.axes[unit],colour,first_figure)
+                self.unit_axes_style[unit] = (tuple(colour),first_figure)
+
+            pos[2] += width_increment
+
+        for unit in self.unit_axes:
+            if unit not in units:
+                self.unit_axes[unit].set_visible(False)
+
+        #Show the plot lines, one for each parameter
+        for param in self.selected:
+            unit = self.state.get_attribute_units(param)
+            if not self.lines.has_key(param) or self.lines[param].axes is not self.axes[unit]:
+                if self.lines.has_key(param):
+                    self.lines[param].remove()
+                self.lines[param] = self.axes[unit].plot([0,0],[0,0],linewidth=2)[0]
+            self.plot_data[param] = self.lines[param]
+            self.plot_data[param].set_color(self.unit_colour[unit])
+            self.plot_data[param].set_dashes(self.parameter_style[param])
+            self.plot_data[param].set_visible(True)
+
+        for param in self.lines:
+            if param not in self.plot_data:
+                self.lines[param].set_visible(False)
+
+        #Text for npv
+        if self.npvtext == None:
+            self.npvtext = self.fig.text(.1,bottom_space,'NPV')
+
+    def line_data(self,param):
+        '''
+        Return the downsampled (x,y) data of an attribute in plot units
+        '''
+        if not self.line_cache.has_key(param):
+            data = self.state[param]
+            if self.dynamic:
+                x = numpy.arange(len(data))
+            else:
+                xunit = self.control_type
+                x = numpy.asarray(self.state[xunit])/self.state.attributes[xunit]['scale']
+            y = numpy.asarray(data,dtype=float)/self.state.attributes[param]['scale']
+            self.line_cache[param] = minmax_downsample(x,y,self.pixel_width)
+        return self.line_cache[param]
+
+    def update_bounds(self):
+        '''Update the figure bounds'''
+        self.xbound = 0
+        self.bounds = {}
+        for unit in self.get_units():
+            self.bounds[unit]=[float('inf'), -float('inf')]
+
+        for param in self.selected:
+            unit = self.state.get_attribute_units(param)
+            #Downsampling keeps the extremes so the bounds are unaffected
+            yv = self.line_data(param)[1]
+            self.bounds[unit][0] = min(self.bounds[unit][0], numpy.nanmin(yv))
+            self.bounds[unit][1] = max(self.bounds[unit][1], numpy.nanmax(yv))
+            self.bounds[unit][0] = sig_round(self.bounds[unit][0])
+            self.bounds[unit][1] = sig_round(self.bounds[unit][1])
+            if self.dynamic:
+                self.xbound = max(self.xbound,len(self.state[param])-1)
+        if not self.dynamic:
+            xunit = self.control_type
+            self.xbound = numpy.nanmax(numpy.asarray(self.state[xunit])/self.state.attributes[xunit]['scale'])
+            self.xbound = sig_round(self.xbound)
+
+    def update_plot(self):
+        '''
+        Update the plots using data in the current state
+        '''
+        self.update_bounds()
+
+        #Update axes bounds
+        for unit in self.get_units():
+            bounds = self.bounds[unit]
+            self.axes[unit].set_ybound(lower = 0,upper = bounds[1])
+            self.axes[unit].set_xbound(lower = 0,upper=self.xbound*self.axes_xscale[unit])
+
+        #Update plot data
+        for param in self.selected:
+            x,y = self.line_data(param)
+            self.plot_data[param].set_data(x,y)
+
+        if self.dynamic:
+            self.firstaxes.set_xlabel('Years')
+        else:
+            xunit = self.control_type
+            self.firstaxes.set_xlabel('Management Control: ' + self.state.attributes[xunit]['title'] + ' (' + self.state.attributes[xunit]['units'] + ')')
+
+        if self.dynamic and ~numpy.isnan(self.npv):
+            self.npvtext.set_text('NPV: $' + str(int(round(self.npv/self.state.attributes['revenue']['scale']))) + ' million')
+        else:
+            self.npvtext.set_text('')
+
+    @staticmethod
+    def style_axes(axes,color,first):
+        '''
+        Set the colour of the y axis to color, and show the remaining borders
+        of the graph and the x axis only on the first axes
+        '''
+        for side,spine in axes.spines.items():
+            if side == 'right':
+                spine.set_color(color)
+                spine.set_visible(True)
+            else:
+                spine.set_visible(first)
+        axes.tick_params(axis='y',which='both',colors=color)
+        axes.yaxis.label.set_color(color)
+        axes.yaxis.get_offset_text().set_color(color)
+        axes.xaxis.set_visible(first)
+        if first:
+            axes.patch.set_alpha(1)
+        else:
+            axes.patch.set_alpha(0)
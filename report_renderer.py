@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer report renderer
+Renders scenario charts to PNG/SVG files without the GUI, using the same
+layout as the GUI plot panel on the Agg backend. Scenarios are rendered in
+parallel worker processes, each of which reuses a single figure.
+
+Usage: python report_renderer.py scenarios.json [processes]
+where scenarios.json contains a list of scenarios (see render_scenarios)
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import multiprocessing
+import json
+import os
+import sys
+
+import fisheries_model
+import plot_layout
+
+class ReportRenderer:
+    '''Renders scenarios to file, reusing one figure for all of them'''
+
+    def __init__(self,width=800,height=400,dpi=100):
+        '''
+        width, height: size of the rendered chart in pixels
+        dpi: resolution of the rendered chart
+        '''
+        self.fig = Figure(figsize=(width/float(dpi),height/float(dpi)),dpi=dpi)
+        self.fig.set_facecolor([1,1,1])
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.layout = plot_layout.FigureLayout(self.fig)
+        self.layout.set_pixel_width(width)
+        #What the axes were last set up for, they are only set up again if this changes
+        self.last_setup = None
+
+    def render(self,scenario):
+        '''Render a scenario and return the name of the written file'''
+        state = fisheries_model.scenario_state(scenario)
+        self.layout.set_simulation(scenario.get('dynamic',True),scenario.get('control_type','catch'))
+        self.layout.set_state(state)
+
+        selected = scenario.get('attributes',state.default_plot)
+        setup = (list(selected),[(unit,tuple(colour)) for unit,colour in sorted(self.layout.unit_colour.items())])
+        if setup != self.last_setup:
+            self.layout.setup_axes(selected)
+            self.last_setup = setup
+        self.layout.update_plot()
+
+        filename = scenario['filename']
+        format = os.path.splitext(filename)[1][1:].lower() or 'png'
+        self.fig.savefig(filename,format=format,facecolor=self.fig.get_facecolor())
+        return filename
+
+#The renderer of a worker process
+_renderer = None
+
+def _init_worker(width,height,dpi):
+    '''Create the renderer of a worker process'''
+    global _renderer
+    _renderer = ReportRenderer(width,height,dpi)
+
+def _render_worker(scenario):
+    '''Render a scenario in a worker process'''
+    return _renderer.render(scenario)
+
+def render_scenarios(scenarios,processes=None,width=800,height=400,dpi=100):
+    '''
+    Render scenarios in parallel and return the written file names
+    scenarios: a list of dicts with the keys
+        filename: the output file, the extension (.png or .svg) sets the format
+        model: 'lobster' or 'fish' (default 'lobster')
+        control_type: 'catch' or 'effort' (default 'catch')
+        dynamic: True for a dynamic, False for a static run (default True)
+        parameters: dict of parameter values overriding the model defaults
+        steps: number of years or static points (default 100)
+        attributes: the state attributes to plot (default the model's default plot)
+    processes: number of worker processes (default number of cpus, 1 renders in this process)
+    width, height, dpi: chart size in pixels and resolution
+    '''
+    if processes == 1:
+        _init_worker(width,height,dpi)
+        return [_render_worker(scenario) for scenario in scenarios]
+
+    pool = multiprocessing.Pool(processes,_init_worker,(width,height,dpi))
+    try:
+        return pool.map(_render_worker,scenarios,chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+if __name__ == '__main__':
+    fid = open(sys.argv[1],'r')
+    scenarios = json.load(fid)
+    fid.close()
+    processes = None
+    if len(sys.argv) > 2:
+        processes = int(sys.argv[2])
+    for filename in render_scenarios(scenarios,processes):
+        print(filename)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer model serialization
+A compact binary form of models and states for passing them between
+processes, caching them and saving scenarios. A model is stored as the
+identity of the factory that built it (eg. lobsterModel with catch control)
+plus the vector of its parameter values (ordered as its parameter schema), a state as its attribute columns of
+raw little endian doubles, followed by the equilibrium iterations of a static
+run (see State.convergence) if it has them. Attribute titles, units etc. are not stored, they
+come from the factory (or a template state) when loading.
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import struct
+import itertools
+import numpy
+
+import fisheries_model
+
+MODEL_MAGIC = 'FXM1'
+STATE_MAGIC = 'FXS1'
+
+#Header of a state: magic, time offset, number of time steps, number of attributes, flags
+_STATE_HEADER = struct.Struct('<4siiiB')
+#State flags: the initial row is stored (see State.trim), the convergence is stored
+_TRIMMED = 1
+_CONVERGENCE = 2
+#The lengths of the convergence lists: iterations, unconverged and restarts
+_CONVERGENCE_HEADER = struct.Struct('<iii')
+_CONVERGENCE_LISTS = ['iterations','unconverged','restarts']
+#Header of a model: magic, followed by the factory, parameters and state
+_MODEL_HEADER = struct.Struct('<4s')
+
+def _pack_strings(strings):
+    '''Pack a list of strings, each prefixed by its length'''
+    return ''.join([struct.pack('<H',len(s))+s for s in strings])
+
+def _unpack_strings(data,offset,count):
+    '''Unpack count strings starting at offset, returns the strings and the new offset'''
+    strings = []
+    for i in range(count):
+        length, = struct.unpack_from('<H',data,offset)
+        offset += 2
+        strings.append(data[offset:offset+length])
+        offset += length
+    return strings,offset
+
+def _pack_floats(values,count):
+    '''Pack count floats from the iterable values as little endian doubles'''
+    return struct.pack('<%dd' % count,*values)
+
+def dumps_state(state,derived=True):
+    '''
+    Return a state as a string: its time steps as a raw float buffer per attribute
+    derived: whether to store the derived attributes (see State.set_derived),
+    which is not needed if they are derived again when loading (as by dumps)
+    '''
+    if derived:
+        names = sorted(state.attribute_names())
+    else:
+        names = sorted(state.keys())
+    steps = len(state[names[0]])
+    flags = 0
+    if state.time_offset > 0:
+        flags |= _TRIMMED
+    if state.convergence != None:
+        flags |= _CONVERGENCE
+    data = [_STATE_HEADER.pack(STATE_MAGIC,state.time_offset,steps,len(names),flags),
+            _pack_strings(names)]
+    if flags & _TRIMMED:
+        #The initial time step kept for reset (see State.trim)
+        data.append(_pack_floats([state.initial[att] for att in names],len(names)))
+    data.append(_pack_floats(itertools.chain.from_iterable([state[att] for att in names]),steps*len(names)))
+    if flags & _CONVERGENCE:
+        lists = [state.convergence[name] for name in _CONVERGENCE_LISTS]
+        data.append(_CONVERGENCE_HEADER.pack(*[len(values) for values in lists]))
+        data.append(_pack_floats(itertools.chain.from_iterable(lists),sum([len(values) for values in lists])))
+    return ''.join(data)
+
+def _read_state(data,state,offset=0):
+    '''Read the time steps stored by dumps_state at offset in data into state'''
+    magic,time_offset,steps,count,flags = _STATE_HEADER.unpack_from(data,offset)
+    if magic != STATE_MAGIC:
+        raise ValueError('Not a serialized state')
+    names,offset = _unpack_strings(data,offset+_STATE_HEADER.size,count)
+    for att in names:
+        if not state.attributes.has_key(att):
+            raise ValueError('Unknown state attribute: ' + att)
+
+    #Attributes stored are no longer derived
+    if len(state.derived) > 0:
+        state.set_derived(dict([(att,state.derived[att]) for att in state.derived if att not in names]))
+    state.time_offset = time_offset
+    if flags & _TRIMMED:
+        initial = numpy.frombuffer(data,dtype='<f8',count=count,offset=offset)
+        state.initial = dict(zip(names,initial.tolist()))
+        offset += 8*count
+    columns = numpy.frombuffer(data,dtype='<f8',count=steps*count,offset=offset).reshape(count,steps)
+    for att,column in zip(names,columns.tolist()):
+        state[att] = column
+    offset += 8*steps*count
+
+    state.convergence = None
+    if flags & _CONVERGENCE:
+        lengths = _CONVERGENCE_HEADER.unpack_from(data,offset)
+        offset += _CONVERGENCE_HEADER.size
+        values = numpy.frombuffer(data,dtype='<f8',count=sum(lengths),offset=offset).tolist()
+        state.convergence = {}
+        for name,length in zip(_CONVERGENCE_LISTS,lengths):
+            state.convergence[name] = values[:length]
+            values = values[length:]
+        state.convergence['iterations'] = [int(value) for value in state.convergence['iterations']]
+
+def state_template(state):
+    '''
+    Return an empty state with the attribute descriptions and plot settings of
+    state, to use as the template of loads_state
+    '''
+    template = fisheries_model.State(state.attributes)
+    template.attribute_order = list(state.attribute_order)
+    template.default_plot = list(state.default_plot)
+    return template
+
+def loads_state(data,template):
+    '''
+    Return the state stored in a string by dumps_state
+    template: a state (eg. model.state) of the same model, the attribute
+    descriptions and plot settings are taken from it
+    '''
+    state = state_template(template)
+    _read_state(data,state)
+    return state
+
+def dumps(model):
+    '''
+    Return a model as a string: its factory, parameter values and state
+    The model must have been built by one of fisheries_model.MODEL_FACTORIES
+    '''
+    if model.factory == None:
+        raise ValueError('Model has no factory, it can not be serialized')
+    name,control_type = model.factory
+    schema = model.get_schema()
+    for param in model.parameters:
+        if not schema.index.has_key(param):
+            raise ValueError('Unknown model parameter: ' + param)
+        if isinstance(model.parameters[param],fisheries_model.Schedule):
+            raise ValueError('Scheduled parameters can not be serialized: ' + param)
+    #Parameters that have not been set are stored as nan
+    values = schema.to_vector(model.parameters,fill=numpy.nan)
+
+    return ''.join([_MODEL_HEADER.pack(MODEL_MAGIC),
+                    _pack_strings([name,control_type]),
+                    struct.pack('<H',len(values)),
+                    _pack_floats(values,len(values)),
+                    dumps_state(model.state,derived=False)])
+
+def loads(data):
+    '''Return the model stored in a string by dumps'''
+    magic, = _MODEL_HEADER.unpack_from(data)
+    if magic != MODEL_MAGIC:
+        raise ValueError('Not a serialized model')
+    (name,control_type),offset = _unpack_strings(data,_MODEL_HEADER.size,2)
+    if not fisheries_model.MODEL_FACTORIES.has_key(name):
+        raise ValueError('Unknown model factory: ' + name)
+    model = fisheries_model.MODEL_FACTORIES[name](control_type = control_type)
+
+    count, = struct.unpack_from('<H',data,offset)
+    offset += 2
+    schema = model.get_schema()
+    if count != schema.size:
+        raise ValueError('Parameters do not match the model factory')
+    values = numpy.frombuffer(data,dtype='<f8',count=count,offset=offset)
+    offset += 8*count
+    parameters = schema.to_dict(values)
+    for param in schema.names:
+        if numpy.isnan(parameters[param]):
+            del parameters[param]
+    model.set_parameters(parameters)
+
+    #The state built by the factory is new so it is filled in directly
+    _read_state(data,model.state,offset)
+    return model
+
+def save(filename,model):
+    '''Save a model (eg. a scenario) to file'''
+    fid = open(filename,'wb')
+    fid.write(dumps(model))
+    fid.close()
+
+def load(filename):
+    '''Load a model saved by save'''
+    fid = open(filename,'rb')
+    data = fid.read()
+    fid.close()
+    return loads(data)
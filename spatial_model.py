@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer spatial models
+A stock spread over cells (eg. the zones of a lobster fishery) in place of
+the single well-mixed biomass of fisheries_model.PDLogistic. Each cell has
+its own logistic growth (a share of K and a multiple of r) and its own catch
+or effort (a share of the TAC or total effort), and biomass moves between
+cells each time step by a sparse migration matrix. Closed cells (a boolean
+mask) are not fished, their share goes to the open cells.
+
+The cells are held as columns (one numpy array per attribute, one element
+per cell) and the migration matrix as coordinates (source cell, destination
+cell and rate of each movement) applied with numpy.bincount, so a time step
+is a fixed number of array operations and scales to 10^5 cells or more.
+
+The totals over the cells are kept in the model state as the biomass, catch,
+effort and cpue of the single stock models, so the economics (and the plots)
+are unchanged.
+
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import numpy
+
+import fisheries_model
+
+#The most time steps of the cells run to an equilibrium time step, and the
+#largest change (relative) in the biomass of any cell of an equilibrium
+EQUILIBRIUM_STEPS = 500
+EQUILIBRIUM_TOLERANCE = 1e-9
+
+class Cells:
+    '''
+    The attributes of the cells of a spatial stock, as arrays
+    capacity: the share of K of each cell (they sum to 1)
+    growth: the multiple of r of each cell
+    share: the share of the catch or effort of each cell (they sum to 1 over
+    the open cells when used)
+    '''
+
+    def __init__(self,capacity,growth=None,share=None):
+        self.capacity = numpy.asarray(capacity,dtype=float)
+        self.capacity = self.capacity/self.capacity.sum()
+        if growth is None:
+            growth = numpy.ones(len(self.capacity))
+        self.growth = numpy.asarray(growth,dtype=float)
+        #By default the catch or effort of a cell is in proportion to its share of K
+        if share is None:
+            share = self.capacity
+        self.share = numpy.asarray(share,dtype=float)
+
+    def __len__(self):
+        return len(self.capacity)
+
+    @staticmethod
+    def generate(count,spread=0.3,generator=None):
+        '''
+        Return count cells with lognormal shares of K and multiples of r
+        (mean 1, the standard deviation of the logarithm is spread)
+        generator: the numpy RandomState of the attributes
+        '''
+        if generator == None:
+            generator = numpy.random.RandomState()
+        capacity,growth = [numpy.exp(generator.normal(-spread**2/2,spread,count)) for i in range(2)]
+        return Cells(capacity,growth)
+
+class Migration:
+    '''
+    A sparse migration matrix, the proportion of the biomass of a cell that
+    moves to another cell each time step, as coordinates
+    '''
+
+    def __init__(self,source,destination,rate,size):
+        '''
+        source,destination,rate: arrays of the cells and proportion of each movement
+        size: the number of cells
+        '''
+        self.source = numpy.asarray(source,dtype=int)
+        self.destination = numpy.asarray(destination,dtype=int)
+        self.rate = numpy.asarray(rate,dtype=float)
+        self.size = size
+        #The proportion of the biomass of each cell that stays
+        self.staying = 1-numpy.bincount(self.source,self.rate,minlength=size)
+        if (self.staying < 0).any():
+            raise ValueError('More than all of the biomass of a cell moves')
+
+    def apply(self,biomass):
+        '''Return the biomass of each cell after migration'''
+        if len(self.rate) == 0:
+            return biomass
+        arriving = numpy.bincount(self.destination,self.rate*biomass[self.source],minlength=self.size)
+        return biomass*self.staying+arriving
+
+    @staticmethod
+    def grid(rows,columns,rate):
+        '''
+        Return the migration of cells on a grid (numbered by row) to their
+        neighbours above, below, left and right, rate/4 to each neighbour
+        '''
+        index = numpy.arange(rows*columns).reshape(rows,columns)
+        pairs = [(index[:,:-1],index[:,1:]),(index[:-1,:],index[1:,:])]
+        source = numpy.concatenate([a.ravel() for a,b in pairs]+[b.ravel() for a,b in pairs])
+        destination = numpy.concatenate([b.ravel() for a,b in pairs]+[a.ravel() for a,b in pairs])
+        return Migration(source,destination,numpy.ones(len(source))*rate/4.,rows*columns)
+
+class SpatialFishery(fisheries_model.Component):
+    '''
+    Growth, migration and catch of a spatial stock (see the module), in place
+    of PDLogistic and CatchFixed or EffortFixed
+    Each time step the cells grow, then migrate, then are fished. The cpue
+    of a cell is set by its biomass at the start of the time step relative to
+    its share of K, as by CatchFixed; the cpue of the state is the total
+    catch per unit of effort. At equilibrium the cells are run until they
+    converge (see EQUILIBRIUM_STEPS).
+    The biomass of each cell is kept from one time step to the next; when the
+    state does not follow on from the last time step run (eg. it was reset)
+    or its biomass was changed, the biomass of the state is spread over the
+    cells in proportion to their shares of K.
+    '''
+
+    def __init__(self,cells,migration=None,control_type='catch',closed=None):
+        '''
+        cells: the Cells
+        migration: the Migration, None for none
+        control_type: 'catch' or 'effort'
+        closed: a boolean array of the cells that are not fished, None for none
+        '''
+        self.r = fisheries_model.Parameter(title='Population growth rate',
+                                           description='The maximum growth rate of each cell, relative to its biomass',
+                                           type='Population dynamics')
+        self.K = fisheries_model.Parameter(title='Maximum population size',
+                                           description='The size of a unfished (virgin) population, over all the cells',
+                                           type='Population dynamics')
+        self.catch_rate = fisheries_model.Parameter(title='Max catch rate',
+                                                    description='The biomass caught per unit of effort',
+                                                    type='Fleet dynamics')
+        if control_type == 'catch':
+            self.control = fisheries_model.Parameter(title='TAC',
+                                                     description='Total allowable catch',
+                                                     type='Management Controls')
+        else:
+            self.control = fisheries_model.Parameter(title='Effort',
+                                                     description='Fishing effort',
+                                                     type='Management Controls')
+        self.control_type = control_type
+        self.cells = cells
+        if migration == None:
+            migration = Migration([],[],[],len(cells))
+        self.migration = migration
+        self.set_closures(closed)
+        self.biomass = None
+        #The time step the biomass of the cells is of
+        self.time = None
+
+    def get_parameters(self):
+        return {'r': self.r,'K': self.K,'catch_rate': self.catch_rate,self.control_type: self.control}
+
+    def set_closures(self,closed):
+        '''Set the closed cells, a boolean array (None for none)'''
+        if closed is None:
+            closed = numpy.zeros(len(self.cells),dtype=bool)
+        self.closed = numpy.asarray(closed,dtype=bool)
+        share = numpy.where(self.closed,0,self.cells.share)
+        total = share.sum()
+        if total > 0:
+            share = share/total
+        self.share = share
+
+    def step(self,biomass,parameters):
+        '''Return the biomass, catch and effort of each cell after a time step from biomass'''
+        K = parameters['K']*self.cells.capacity
+        r = parameters['r']*self.cells.growth
+        cpue = biomass/K*parameters['catch_rate']
+        biomass = numpy.maximum(biomass+biomass*r*(1-biomass/K),0)
+        biomass = self.migration.apply(biomass)
+        if self.control_type == 'catch':
+            catch = numpy.minimum(parameters['catch']*self.share,biomass)
+            with numpy.errstate(divide='ignore',invalid='ignore'):
+                effort = numpy.where(cpue > 0,catch/cpue,0)
+        else:
+            effort = parameters['effort']*self.share
+            catch = numpy.minimum(effort*cpue,biomass)
+        return biomass-catch,catch,effort
+
+    def execute(self,state,parameters,equilibrium=False):
+        #The biomass of the cells at the start of the time step
+        total = state.get('biomass')
+        if self.biomass is None or self.time != state.time()-1:
+            self.biomass = total*self.cells.capacity
+        elif self.biomass.sum() != total:
+            self.biomass = self.biomass*(total/self.biomass.sum())
+        start = self.biomass.sum()
+
+        biomass,catch,effort = self.step(self.biomass,parameters)
+        if equilibrium:
+            for step in range(EQUILIBRIUM_STEPS):
+                previous = biomass
+                biomass,catch,effort = self.step(biomass,parameters)
+                if not (numpy.abs(biomass-previous) > EQUILIBRIUM_TOLERANCE*numpy.abs(biomass)).any():
+                    break
+            start = biomass.sum()+catch.sum()
+
+        catch = catch.sum()
+        effort = effort.sum()
+        if effort > 0:
+            cpue = catch/effort
+        else:
+            cpue = start/parameters['K']*parameters['catch_rate']
+        state.set(biomass=biomass.sum(),catch=catch,effort=effort,cpue=cpue)
+        self.biomass = biomass
+        self.time = state.time()
+        return state
+
+def spatialModel(name='lobster',control_type='catch',cells=None,migration=None,closed=None):
+    '''
+    Return a model (a name of fisheries_model.MODEL_FACTORIES) with a spatial
+    stock in place of its single biomass, with the same parameters
+    cells: the Cells, by default a 10 by 10 grid (see Cells.generate)
+    migration: the Migration, by default 10% of the biomass of each cell of
+    the default grid moves to its neighbours each time step
+    closed: a boolean array of the closed cells
+    The model can not be serialized (it has no factory).
+    '''
+    model = fisheries_model.MODEL_FACTORIES[name](control_type = control_type)
+    if cells == None:
+        cells = Cells.generate(100,generator=numpy.random.RandomState(0))
+        if migration == None:
+            migration = Migration.grid(10,10,0.1)
+    stock = SpatialFishery(cells,migration,control_type,closed)
+    functions = [stock]
+    for function in model.functions:
+        if isinstance(function,(fisheries_model.PDLogistic,fisheries_model.CatchFixed,fisheries_model.EffortFixed)):
+            #The parameter ranges of the model
+            for param,value in function.get_parameters().items():
+                if param == control_type:
+                    stock.control = value
+                else:
+                    setattr(stock,param,value)
+        else:
+            functions.append(function)
+    return fisheries_model.Model(functions = functions,initial_state = model.state)
@@ -0,0 +1,637 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer distributed sweeps
+Runs the parameter sets of a sweep (many runs of one model, control type,
+simulation type and number of steps) on worker processes on this and other
+hosts. A coordinator splits each sweep into chunks of parameter vectors;
+workers connect to it over TCP, pull a chunk at a time, run it with the
+vectorised model (as one ensemble, see run_scenarios) and send back the
+serialized states (see serialization.dumps_state).
+
+Scheduling
+    Chunks are cut when a worker asks for one, about half of the sets left
+    per connected worker (between min_chunk and max_chunk sets), so the
+    chunks shrink as a sweep ends and the workers finish together.
+    A worker that finds no work left while chunks are running steals a copy
+    of the chunk that has run longest (if longer than steal_delay seconds),
+    the first result of a chunk is kept and the other dropped.
+    A chunk is lost when its worker disconnects or has not answered within
+    chunk_timeout seconds, and is run again (before new chunks), up to
+    max_attempts times before its sweep fails. A chunk a worker fails to run
+    (eg. invalid parameters) is run again elsewhere in the same way.
+
+Protocol
+    Each message is a 4 byte big endian length followed by that many bytes:
+    a 1 byte message type, the 4 byte big endian length of a JSON header,
+    the header and a binary payload.
+    worker to coordinator
+        HELLO   {'name'}, the first message
+        PULL    {}, ask for a chunk
+        RESULT  {'chunk','sizes','seconds'}, the serialized states end to end
+        FAILED  {'chunk','error'}
+    coordinator to worker
+        CHUNK   {'chunk','scenario','names','count'}, the parameter vectors
+                as count rows of little endian doubles ordered by names
+        WAIT    {'seconds'}, no work for now, pull again after a while
+        STOP    {}, the coordinator is closing
+
+Usage
+    python sweep_cluster.py worker host:port [processes]
+        run worker processes for the coordinator at host:port
+    python sweep_cluster.py test [workers] [sets]
+        run a sweep on a coordinator with local worker processes, check it
+        against a local run and print the worker statistics
+A coordinator is started by the program running the sweeps, eg.
+python model_server.py localhost:8642 0 5 0.0.0.0:8643 serves its batches
+through workers connecting to port 8643.
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import SocketServer
+import json
+import math
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+import numpy
+
+import fisheries_model
+import serialization
+import vector_model
+
+DEFAULT_ADDRESS = ('localhost',8643)
+#The smallest and largest chunks, in parameter sets
+MIN_CHUNK = 16
+MAX_CHUNK = 1024
+#Seconds a chunk may run before it is lost, and before a copy may be stolen
+CHUNK_TIMEOUT = 300
+STEAL_DELAY = 1.0
+#Runs of a chunk before its sweep fails
+MAX_ATTEMPTS = 3
+#Seconds a worker waits before pulling again when there is no work
+WAIT_TIME = 0.05
+#Seconds a worker keeps trying to connect to the coordinator
+CONNECT_TIMEOUT = 10
+#The largest message accepted
+MAX_MESSAGE_SIZE = 1 << 30
+
+#Message types
+HELLO = 1
+PULL = 2
+CHUNK = 3
+RESULT = 4
+FAILED = 5
+WAIT = 6
+STOP = 7
+
+_LENGTH = struct.Struct('!I')
+_HEADER = struct.Struct('!BI')
+
+class ConnectionClosed(Exception):
+    '''Raised when the other end of a connection closes it'''
+    pass
+
+def send_message(connection,type,header={},payload=''):
+    '''Send a message (see the module) on a socket'''
+    header = json.dumps(header)
+    body = _HEADER.pack(type,len(header))+header+payload
+    connection.sendall(_LENGTH.pack(len(body))+body)
+
+def _receive(connection,size):
+    '''Return size bytes from a socket'''
+    data = []
+    while size > 0:
+        block = connection.recv(min(size,1 << 20))
+        if len(block) == 0:
+            raise ConnectionClosed()
+        data.append(block)
+        size -= len(block)
+    return ''.join(data)
+
+def receive_message(connection):
+    '''Return the type, header and payload of the next message on a socket'''
+    length, = _LENGTH.unpack(_receive(connection,_LENGTH.size))
+    if not _HEADER.size <= length <= MAX_MESSAGE_SIZE:
+        raise ValueError('Invalid message length %d' % length)
+    body = _receive(connection,length)
+    type,header_length = _HEADER.unpack_from(body)
+    header = json.loads(body[_HEADER.size:_HEADER.size+header_length])
+    return type,header,body[_HEADER.size+header_length:]
+
+def run_scenarios(scenarios,timeout=None):
+    '''
+    Run scenarios of the same model, control type, simulation type and number
+    of steps as one vectorised ensemble (vector_model.EnsembleRun), however few
+    timeout: the most seconds to run for, checked between steps, None for no limit
+    Returns the serialized states and None, or None and an error message
+    '''
+    try:
+        start = time.time()
+        first = scenarios[0]
+        model = fisheries_model.MODEL_FACTORIES[first['model']](control_type = first['control_type'])
+        parameter_sets = [scenario['parameters'] for scenario in scenarios]
+        arguments = {}
+        if not first['dynamic']:
+            maxima = [fisheries_model.static_maximum(parameters,first['control_type']) for parameters in parameter_sets]
+            arguments = {'dynamic': False,
+                         'independent_variable': maxima[0][0],
+                         'independent_maximum': [maximum for variable,maximum in maxima]}
+        run = vector_model.EnsembleRun(model,parameter_sets,first['steps'],**arguments)
+        for step in range(0,first['steps']):
+            if timeout != None and time.time()-start > timeout:
+                return None,'The model run took longer than %g s' % timeout
+            run.single_iteration(step)
+        return [serialization.dumps_state(state) for state in run.output()],None
+    except Exception,e:
+        return None,str(e)
+
+class Sweep:
+    '''The parameter sets of a sweep and their results'''
+
+    def __init__(self,scenario,names,vectors,callback):
+        self.scenario = scenario
+        self.names = names
+        self.vectors = vectors
+        self.callback = callback
+        #The serialized state of each parameter set
+        self.results = [None]*len(vectors)
+        self.remaining = len(vectors)
+        #The first parameter set not yet in a chunk
+        self.next = 0
+        self.error = None
+        #Set when the sweep is finished or has failed
+        self.done = threading.Event()
+        self.submitted = time.time()
+
+class Chunk:
+    '''Consecutive parameter sets of a sweep run by a worker'''
+
+    def __init__(self,identifier,sweep,start,stop):
+        self.identifier = identifier
+        self.sweep = sweep
+        self.start = start
+        self.stop = stop
+        #The time each worker running it was sent it, by name
+        self.assigned = {}
+        self.attempts = 0
+        self.done = False
+
+class WorkerStats:
+    '''The work done by a worker, for the coordinator statistics'''
+
+    def __init__(self,name):
+        self.name = name
+        self.connected = True
+        self.chunks = 0
+        self.sets = 0
+        #Seconds from sending chunks to receiving their results, and running them (as the worker reports)
+        self.busy = 0.
+        self.running = 0.
+        self.stolen = 0
+        self.duplicates = 0
+        self.failures = 0
+        self.lost = 0
+
+    def summary(self):
+        return {'connected': self.connected,
+                'chunks': self.chunks,
+                'sets': self.sets,
+                'busy_seconds': self.busy,
+                'run_seconds': self.running,
+                'sets_per_second': self.sets/self.busy if self.busy > 0 else 0.,
+                'stolen': self.stolen,
+                'duplicates': self.duplicates,
+                'failures': self.failures,
+                'lost': self.lost}
+
+class WorkerHandler(SocketServer.BaseRequestHandler):
+    '''The connection of a worker to the coordinator'''
+
+    def handle(self):
+        coordinator = self.server
+        self.request.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        try:
+            type,header,payload = receive_message(self.request)
+            if type != HELLO:
+                return
+        except (ConnectionClosed,socket.error,ValueError):
+            return
+        name = coordinator.connect(header.get('name','worker'))
+        try:
+            while True:
+                type,header,payload = receive_message(self.request)
+                if type == PULL:
+                    if coordinator.stopping:
+                        send_message(self.request,STOP)
+                        return
+                    chunk = coordinator.assign(name)
+                    if chunk == None:
+                        send_message(self.request,WAIT,{'seconds': WAIT_TIME})
+                    else:
+                        sweep = chunk.sweep
+                        send_message(self.request,CHUNK,
+                                     {'chunk': chunk.identifier,'scenario': sweep.scenario,
+                                      'names': sweep.names,'count': chunk.stop-chunk.start},
+                                     sweep.vectors[chunk.start:chunk.stop].astype('<f8').tostring())
+                elif type == RESULT:
+                    coordinator.complete(name,header,payload)
+                elif type == FAILED:
+                    coordinator.fail(name,header['chunk'],header.get('error','Unknown error'))
+        except (ConnectionClosed,socket.error,ValueError):
+            pass
+        finally:
+            coordinator.disconnect(name)
+
+class Coordinator(SocketServer.ThreadingMixIn,SocketServer.TCPServer):
+    '''
+    Hands out the chunks of sweeps to the workers connected to it and gathers
+    their results (see the module), serving in a background thread
+    '''
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self,address=DEFAULT_ADDRESS,min_chunk=MIN_CHUNK,max_chunk=MAX_CHUNK,chunk_timeout=CHUNK_TIMEOUT,
+                 steal_delay=STEAL_DELAY,max_attempts=MAX_ATTEMPTS):
+        '''
+        address: the address to listen on, port 0 for any free port (see server_address)
+        Other arguments are as described in the module
+        '''
+        SocketServer.TCPServer.__init__(self,address,WorkerHandler)
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.chunk_timeout = chunk_timeout
+        self.steal_delay = steal_delay
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        #Sweeps with sets not yet in a chunk, in order
+        self.sweeps = []
+        #Chunks lost or failed to run again, and chunks being run by identifier
+        self.retry = []
+        self.in_flight = {}
+        self.chunk_count = 0
+        #The statistics of each worker by name
+        self.workers = {}
+        self.stopping = False
+        #Models by (model,control_type), for defaults and state templates
+        self.models = {}
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        '''Stop serving, workers are told to stop when they next pull and sweeps still running fail'''
+        with self.lock:
+            self.stopping = True
+            sweeps = set([chunk.sweep for chunk in self.in_flight.values()]+self.sweeps)
+        for sweep in sweeps:
+            self._fail_sweep(sweep,'The coordinator closed')
+        self.shutdown()
+        self.server_close()
+
+    def _model(self,name,control_type):
+        '''The model of a scenario, for its parameter schema and state template'''
+        key = (name,control_type)
+        if not self.models.has_key(key):
+            self.models[key] = fisheries_model.MODEL_FACTORIES[name](control_type = control_type)
+        return self.models[key]
+
+    def submit(self,scenario,parameter_sets,callback=None):
+        '''
+        Start a sweep and return it (a Sweep, done is set when it finishes)
+        scenario: the model, control_type, dynamic and steps of the runs (as
+        for model_server.ModelService.run)
+        parameter_sets: a list of dicts of parameter values, missing values are the defaults
+        callback: called with (serialized states,None) or (None,error message) when the sweep finishes
+        '''
+        scenario = {'model': scenario.get('model','lobster'),
+                    'control_type': scenario.get('control_type','catch'),
+                    'dynamic': bool(scenario.get('dynamic',True)),
+                    'steps': int(scenario.get('steps',100))}
+        schema = self._model(scenario['model'],scenario['control_type']).get_schema()
+        vectors = numpy.array([schema.to_vector(fisheries_model.scenario_parameters(self._model(scenario['model'],scenario['control_type']),parameters))
+                               for parameters in parameter_sets]).reshape(len(parameter_sets),schema.size)
+        sweep = Sweep(scenario,list(schema.names),vectors,callback)
+        if len(parameter_sets) == 0:
+            self._finish(sweep)
+            return sweep
+        with self.lock:
+            if self.stopping:
+                sweep.error = 'The coordinator closed'
+            else:
+                self.sweeps.append(sweep)
+        if sweep.error != None:
+            self._finish(sweep)
+        return sweep
+
+    def run(self,scenario,parameter_sets,timeout=None):
+        '''
+        Return the output state of each parameter set of a sweep (see submit),
+        as vector_model.run_ensemble does
+        timeout: the most seconds to wait for the sweep
+        '''
+        sweep = self.submit(scenario,parameter_sets)
+        if not sweep.done.wait(timeout):
+            raise multiprocessing.TimeoutError()
+        if sweep.error != None:
+            raise RuntimeError(sweep.error)
+        template = self._model(sweep.scenario['model'],sweep.scenario['control_type']).state
+        return [serialization.loads_state(data,template) for data in sweep.results]
+
+    def connect(self,name):
+        '''Register a worker, returns its unique name'''
+        with self.lock:
+            unique = name
+            count = 1
+            while self.workers.has_key(unique) and self.workers[unique].connected:
+                count += 1
+                unique = '%s#%d' % (name,count)
+            if self.workers.has_key(unique):
+                self.workers[unique].connected = True
+            else:
+                self.workers[unique] = WorkerStats(unique)
+            return unique
+
+    def disconnect(self,name):
+        '''A worker disconnected, the chunks it was running are lost'''
+        with self.lock:
+            self.workers[name].connected = False
+            failed = []
+            for chunk in self.in_flight.values():
+                if chunk.assigned.has_key(name):
+                    self.workers[name].lost += 1
+                    if self._lose(chunk,name):
+                        failed.append(chunk.sweep)
+        for sweep in failed:
+            self._fail_sweep(sweep,'A chunk was lost %d times' % self.max_attempts)
+
+    def _lose(self,chunk,name):
+        '''
+        A worker did not finish a chunk, run it again if nobody else is (call
+        with the lock held), return whether it has run too many times
+        '''
+        del chunk.assigned[name]
+        chunk.attempts += 1
+        if len(chunk.assigned) > 0:
+            return False
+        if chunk.attempts >= self.max_attempts:
+            return True
+        del self.in_flight[chunk.identifier]
+        self.retry.append(chunk)
+        return False
+
+    def _expire(self,now):
+        '''Lose the chunks that have run too long (call with the lock held), returns the sweeps that failed'''
+        failed = []
+        for chunk in self.in_flight.values():
+            for name,start in chunk.assigned.items():
+                if now-start > self.chunk_timeout:
+                    self.workers[name].lost += 1
+                    if self._lose(chunk,name):
+                        failed.append(chunk.sweep)
+        return failed
+
+    def _new_chunk(self):
+        '''Return the next chunk of the first sweep with sets left (call with the lock held), None if none'''
+        while len(self.sweeps) > 0:
+            sweep = self.sweeps[0]
+            left = len(sweep.vectors)-sweep.next
+            if left <= 0 or sweep.error != None:
+                self.sweeps.pop(0)
+                continue
+            workers = max(len([stats for stats in self.workers.values() if stats.connected]),1)
+            size = min(max(int(math.ceil(left/(2.*workers))),self.min_chunk),self.max_chunk,left)
+            self.chunk_count += 1
+            chunk = Chunk(self.chunk_count,sweep,sweep.next,sweep.next+size)
+            sweep.next += size
+            return chunk
+        return None
+
+    def _steal(self,name,now):
+        '''Return the chunk that has run longest by another worker, None if none has run long enough'''
+        candidates = [(min(chunk.assigned.values()),chunk) for chunk in self.in_flight.values()
+                      if len(chunk.assigned) == 1 and not chunk.assigned.has_key(name)]
+        if len(candidates) == 0:
+            return None
+        start,chunk = min(candidates)
+        if now-start < self.steal_delay:
+            return None
+        self.workers[name].stolen += 1
+        return chunk
+
+    def assign(self,name):
+        '''Return the chunk a worker is to run next, None if there is none'''
+        with self.lock:
+            now = time.time()
+            failed = self._expire(now)
+            chunk = None
+            while chunk == None and len(self.retry) > 0:
+                chunk = self.retry.pop(0)
+                if chunk.done or chunk.sweep.error != None:
+                    chunk = None
+            if chunk == None:
+                chunk = self._new_chunk()
+            if chunk == None:
+                chunk = self._steal(name,now)
+            if chunk != None:
+                chunk.assigned[name] = now
+                self.in_flight[chunk.identifier] = chunk
+        for sweep in failed:
+            self._fail_sweep(sweep,'A chunk was lost %d times' % self.max_attempts)
+        return chunk
+
+    def complete(self,name,header,payload):
+        '''Store the results of a chunk sent by a worker'''
+        sizes = header['sizes']
+        with self.lock:
+            stats = self.workers[name]
+            chunk = self.in_flight.get(header['chunk'])
+            if chunk == None or chunk.done:
+                #Another worker finished the chunk first
+                stats.duplicates += 1
+                return
+            if len(sizes) != chunk.stop-chunk.start or sum(sizes) != len(payload):
+                invalid = True
+            else:
+                invalid = False
+                offsets = numpy.cumsum([0]+sizes)
+                sweep = chunk.sweep
+                sweep.results[chunk.start:chunk.stop] = [payload[start:stop] for start,stop in zip(offsets[:-1],offsets[1:])]
+                sweep.remaining -= len(sizes)
+                chunk.done = True
+                del self.in_flight[chunk.identifier]
+                start = chunk.assigned.get(name)
+                if start != None:
+                    stats.busy += time.time()-start
+                stats.running += header.get('seconds',0.)
+                stats.chunks += 1
+                stats.sets += len(sizes)
+                finished = sweep.remaining == 0
+        if invalid:
+            self.fail(name,header['chunk'],'Invalid result')
+        elif finished:
+            self._finish(sweep)
+
+    def fail(self,name,identifier,error):
+        '''A worker could not run a chunk'''
+        with self.lock:
+            self.workers[name].failures += 1
+            chunk = self.in_flight.get(identifier)
+            if chunk == None or chunk.done or not chunk.assigned.has_key(name):
+                return
+            failed = self._lose(chunk,name)
+        if failed:
+            self._fail_sweep(chunk.sweep,error)
+
+    def _fail_sweep(self,sweep,error):
+        '''Stop a sweep with an error'''
+        with self.lock:
+            if sweep.done.isSet() or sweep.error != None:
+                return
+            sweep.error = error
+            for chunk in self.in_flight.values():
+                if chunk.sweep is sweep:
+                    del self.in_flight[chunk.identifier]
+            if sweep in self.sweeps:
+                self.sweeps.remove(sweep)
+        self._finish(sweep)
+
+    def _finish(self,sweep):
+        '''Signal the end of a sweep'''
+        sweep.done.set()
+        if sweep.callback != None:
+            if sweep.error == None:
+                sweep.callback((sweep.results,None))
+            else:
+                sweep.callback((None,sweep.error))
+
+    def stats(self):
+        '''Return the statistics of each worker and the work left'''
+        with self.lock:
+            return {'workers': dict([(name,stats.summary()) for name,stats in self.workers.items()]),
+                    'sweeps': len(self.sweeps),
+                    'chunks_in_flight': len(self.in_flight),
+                    'chunks_to_retry': len(self.retry)}
+
+def _connect(address,timeout=CONNECT_TIMEOUT):
+    '''Return a connection to a coordinator, trying until timeout seconds have passed'''
+    end = time.time()+timeout
+    while True:
+        try:
+            return socket.create_connection(address)
+        except socket.error:
+            if time.time() > end:
+                raise
+            time.sleep(0.1)
+
+def work(address,name=None):
+    '''Run chunks for the coordinator at address until it stops or goes away'''
+    if name == None:
+        name = '%s:%d' % (socket.gethostname(),os.getpid())
+    connection = _connect(address)
+    connection.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+    try:
+        send_message(connection,HELLO,{'name': name})
+        while True:
+            send_message(connection,PULL)
+            type,header,payload = receive_message(connection)
+            if type == STOP:
+                return
+            if type == WAIT:
+                time.sleep(header['seconds'])
+                continue
+            #The strings of a JSON header are unicode
+            scenario = dict([(str(key),value) for key,value in header['scenario'].items()])
+            scenario['model'] = str(scenario['model'])
+            scenario['control_type'] = str(scenario['control_type'])
+            names = [str(param) for param in header['names']]
+            vectors = numpy.frombuffer(payload,dtype='<f8').reshape(header['count'],len(names))
+            scenarios = [dict(scenario,parameters=dict(zip(names,vector))) for vector in vectors.tolist()]
+            start = time.time()
+            data,error = run_scenarios(scenarios)
+            if error != None:
+                send_message(connection,FAILED,{'chunk': header['chunk'],'error': error})
+            else:
+                send_message(connection,RESULT,{'chunk': header['chunk'],'sizes': [len(state) for state in data],
+                                                'seconds': time.time()-start},''.join(data))
+    except (ConnectionClosed,socket.error):
+        pass
+    finally:
+        connection.close()
+
+def start_local_workers(address,count):
+    '''Start count worker processes on this host, returns the processes'''
+    processes = []
+    for index in range(count):
+        process = multiprocessing.Process(target=work,args=(address,'local-%d' % index))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+    return processes
+
+def _test(workers,sets):
+    '''Run a sweep on local workers, check it against a local run and print the statistics'''
+    coordinator = Coordinator(('localhost',0),min_chunk=8)
+    processes = start_local_workers(coordinator.server_address,workers)
+    generator = numpy.random.RandomState(0)
+    parameter_sets = [{'r': generator.uniform(0.2,2),'catch': generator.uniform(0,4e6)} for i in range(sets)]
+    scenario = {'model': 'lobster','control_type': 'catch','dynamic': True,'steps': 100}
+
+    start = time.time()
+    states = coordinator.run(scenario,parameter_sets)
+    seconds = time.time()-start
+    print('%d sets on %d workers: %.3f s' % (sets,workers,seconds))
+
+    #The same sweep run here
+    model = fisheries_model.lobsterModel(control_type = 'catch')
+    local = vector_model.run_ensemble(model,[fisheries_model.scenario_parameters(model,parameters) for parameters in parameter_sets],100)
+    worst = 0.
+    for state,expected in zip(states,local):
+        for att in expected.attribute_names():
+            x = numpy.array(expected[att],dtype=float)
+            y = numpy.array(state[att],dtype=float)
+            worst = max(worst,numpy.nanmax(numpy.abs(x-y)/numpy.maximum(numpy.abs(x),1)))
+    print('Largest difference from a local run: %g' % worst)
+
+    #A worker lost half way through a second sweep
+    sweep = coordinator.submit(scenario,parameter_sets)
+    time.sleep(seconds/2)
+    processes[0].terminate()
+    sweep.done.wait()
+    print('After losing a worker: %s' % ('failed: '+sweep.error if sweep.error != None else 'all %d sets done' % len(sweep.results)))
+
+    stats = coordinator.stats()
+    for name in sorted(stats['workers']):
+        worker = stats['workers'][name]
+        print('%s: %d chunks, %d sets, %.0f sets/s, %d stolen, %d duplicates, %d lost, %d failures' %
+              (name,worker['chunks'],worker['sets'],worker['sets_per_second'],worker['stolen'],
+               worker['duplicates'],worker['lost'],worker['failures']))
+    coordinator.close()
+    for process in processes:
+        process.join(5)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == 'worker':
+        host,port = sys.argv[2].rsplit(':',1)
+        count = 1
+        if len(sys.argv) > 3:
+            count = int(sys.argv[3])
+        for process in start_local_workers((host,int(port)),count):
+            process.join()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'test':
+        workers = 4
+        sets = 20000
+        if len(sys.argv) > 2:
+            workers = int(sys.argv[2])
+        if len(sys.argv) > 3:
+            sets = int(sys.argv[3])
+        _test(workers,sets)
+    else:
+        print(__doc__)
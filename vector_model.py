@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+
+'''
+Fisheries Economics Masterclass vectorised model components
+Array versions of the fisheries_model components, which step many stocks (or
+many independent model runs) at once. Parameters may be scalars or arrays and
+each state attribute holds an array per time step.
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import numpy
+import copy
+from fisheries_model import PDLogistic, CatchFixed, EffortFixed, Economics, HarvestControlRule, ProcessError, Schedule, State, Model, lobsterModel, CONTINUATION_JUMP, adjust_fleet
+
+class PDLogisticVector(PDLogistic):
+    '''Population Dynamics Logistic growth component for arrays of stocks'''
+
+    def execute(self,state,parameters,equilibrium=False):
+        r = parameters['r']
+        K = parameters['K']
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            if equilibrium:
+                if parameters.has_key('catch'):
+                    C = parameters['catch']
+                    term = r**2-4*C*r/K
+                    #Catch is added back on as the catch step removes it
+                    biomass = (r+numpy.sqrt(numpy.maximum(term,0)))/(2*r/K)+C
+                    state.set(biomass=numpy.where(term < 0,0,biomass))
+                else:
+                    catch = state.get('biomass')*parameters['catch_rate']*parameters['effort']/K
+                    state.set(biomass=K-parameters['catch_rate']*parameters['effort']/r+catch)
+            else:
+                b = state.get('biomass')
+                state.set(biomass=b+b*r*(1-b/K))
+        return state
+
+class CatchFixedVector(CatchFixed):
+    '''Fixed catch component for arrays of stocks'''
+
+    def execute(self,state,parameters,equilibrium=False):
+        return self.take_catch(state,parameters)
+
+    @staticmethod
+    def take_catch(state,parameters):
+        '''Take the catch (TAC) parameters['catch'] from each stock'''
+        preCatchBiomass = state.get('biomass')
+        previousBiomass = state['biomass'][-2]
+
+        cpue = previousBiomass/parameters['K']*parameters['catch_rate']
+        biomass = preCatchBiomass-parameters['catch']
+        crashed = biomass < 0
+        catch = numpy.where(crashed,preCatchBiomass,parameters['catch'])
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            effort = numpy.where(cpue <= 0,0,catch/cpue)
+        state.set(cpue=cpue,biomass=numpy.where(crashed,0,biomass),catch=catch,effort=effort)
+        return state
+
+class HarvestControlRuleVector(HarvestControlRule):
+    '''Harvest control rule component for arrays of stocks, eg. stochastic replicates'''
+
+    def execute(self,state,parameters,equilibrium=False):
+        return CatchFixedVector.take_catch(state,self.tac_parameters(state,parameters))
+
+class EffortFixedVector(EffortFixed):
+    '''Fixed effort component for arrays of stocks'''
+
+    def get_effort(self,state,parameters,cpue):
+        '''Return the effort applied to each stock'''
+        return parameters['effort']
+
+    def execute(self,state,parameters,equilibrium=False):
+        previousBiomass = state['biomass'][-2]
+        preCatchBiomass = state.get('biomass')
+
+        cpue = previousBiomass/parameters['K']*parameters['catch_rate']
+        effort = self.get_effort(state,parameters,cpue)
+        catch = effort*cpue
+        biomass = preCatchBiomass-catch
+        crashed = biomass < 0
+        state.set(cpue=cpue,
+                  catch=numpy.where(crashed,preCatchBiomass,catch),
+                  biomass=numpy.where(crashed,0,biomass),
+                  effort=effort*numpy.ones_like(cpue))
+        return state
+
+class EconomicsVector(Economics):
+    '''Economics and fleet dynamics for arrays of independent fisheries'''
+
+    def get_derived_columns(self):
+        #The economic attributes are set each time step, as arrays
+        return {}
+
+    def execute(self,state,parameters,equilibrium=False):
+        #Adjust the fleet size
+        profit = self._calculate_profit(state,parameters)
+        state.set(fleet_size = adjust_fleet(state.get('fleet_size'),profit,parameters['fixed_cost'],
+                                            parameters['movement_rate'],equilibrium))
+
+        #Set the cost, revenue and profit
+        state.set(cost = self._calculate_cost(state, parameters))
+        state.set(revenue = self._calculate_revenue(state,parameters))
+        profit = state.get('revenue')-state.get('cost')
+        profit = numpy.where(numpy.abs(profit)<1000000,0,profit)
+        state.set(profit = profit)
+
+        state.set(discounted_profit = profit*(1-parameters['discount_rate'])**(state.time()-1))
+
+        return state
+
+class SharedFleetEconomics(Economics):
+    '''
+    Economics and fleet dynamics of a single fleet fishing many stocks
+    The state holds the catch, effort and revenue of each stock and the fleet
+    size, cost and profit of the whole fleet. The beach price may differ by stock.
+    '''
+
+    def get_derived_columns(self):
+        #The economic attributes are set each time step, the revenue per stock
+        return {}
+
+    @staticmethod
+    def allocate_effort(effort,cpue,parameters):
+        '''
+        Allocate the total effort of the fleet across stocks in proportion to
+        the expected margin per unit effort (cpue*beach_price-marginal_cost) of
+        each stock, or evenly if no stock is expected to be profitable
+        '''
+        margin = numpy.maximum(cpue*parameters['beach_price']-parameters['marginal_cost'],0)
+        margin = numpy.where(numpy.isfinite(margin),margin,0)
+        total = margin.sum()
+        if total <= 0:
+            return effort*numpy.ones_like(cpue)/len(cpue)
+        return effort*margin/total
+
+    def execute(self,state,parameters,equilibrium=False):
+        revenue = state.get('catch')*parameters['beach_price']
+        effort_cost = state.get('effort').sum()*parameters['marginal_cost']
+
+        #Adjust the fleet size
+        fleet_size = state.get('fleet_size')
+        profit = revenue.sum()-fleet_size*parameters['fixed_cost']-effort_cost
+        fleet_size = adjust_fleet(fleet_size,profit,parameters['fixed_cost'],parameters['movement_rate'],equilibrium)
+
+        #Set the cost, revenue and profit
+        cost = fleet_size*parameters['fixed_cost']+effort_cost
+        profit = revenue.sum()-cost
+        if abs(profit)<1000000:
+            profit = 0
+        state.set(fleet_size=fleet_size,revenue=revenue,cost=cost,profit=profit,
+                  discounted_profit = profit*(1-parameters['discount_rate'])**(state.time()-1))
+        return state
+
+class SharedEffortFixed(EffortFixedVector):
+    '''Fixed total effort of a shared fleet, allocated across stocks by SharedFleetEconomics'''
+
+    def get_effort(self,state,parameters,cpue):
+        return SharedFleetEconomics.allocate_effort(parameters['effort'],cpue,parameters)
+
+#Parameters that are set per stock in the multi-stock model, all others are fleet wide
+STOCK_PARAMETERS = ['r','K','catch_rate','catch','beach_price']
+
+def multiStockModel(stocks,control_type = 'catch',base_model = lobsterModel):
+    '''
+    A model of one fleet fishing many stocks
+    stocks: the number of stocks
+    control_type: 'catch' for a TAC per stock, 'effort' for a total fleet effort
+    base_model: the single stock model that provides the parameter definitions
+    and default values, which are the same for all stocks initially
+    The per stock parameters (STOCK_PARAMETERS) are arrays of length stocks.
+    '''
+    base = base_model(control_type = control_type)
+    growthBase,catchBase,economicsBase = base.functions
+
+    growthClass = PDLogisticVector()
+    growthClass.r.update(growthBase.r)
+    growthClass.K.update(growthBase.K)
+
+    if control_type == 'catch':
+        catchClass = CatchFixedVector()
+        catchClass.catch.update(catchBase.catch)
+    elif control_type == 'effort':
+        catchClass = SharedEffortFixed()
+        catchClass.effort.update(catchBase.effort)
+    catchClass.catch_rate.update(catchBase.catch_rate)
+
+    economicsClass = SharedFleetEconomics()
+    for param in economicsBase.get_parameters():
+        getattr(economicsClass,param).update(getattr(economicsBase,param))
+
+    #Per stock state attributes are arrays, fleet attributes are scalars
+    initial_state = State(attributes = base.state.attributes)
+    initial_state.default_plot = base.state.default_plot
+    initial_state.attribute_order = base.state.attribute_order
+    for att in ['biomass','catch','cpue','effort','revenue']:
+        initial_state.set(**{att: numpy.ones(stocks)*base.state.get(att)})
+    initial_state.set(fleet_size = base.state.get('fleet_size'))
+
+    model = Model(functions = [growthClass,catchClass,economicsClass],initial_state = initial_state,parameters = {})
+
+    #Default parameter values
+    p = model.get_parameters()
+    for param in p:
+        if param in STOCK_PARAMETERS:
+            model.parameters[param] = numpy.ones(stocks)*p[param]['value']
+        else:
+            model.parameters[param] = float(p[param]['value'])
+
+    return model
+
+#The vectorised version of each component
+VECTOR_COMPONENTS = {PDLogistic: PDLogisticVector,
+                     CatchFixed: CatchFixedVector,
+                     EffortFixed: EffortFixedVector,
+                     HarvestControlRule: HarvestControlRuleVector,
+                     ProcessError: ProcessError,
+                     Economics: EconomicsVector}
+
+def ensembleModel(model,size):
+    '''
+    Return a vectorised copy of a model (eg. from lobsterModel) that runs size
+    independent copies of it at once, each parameter may be an array of length size
+    '''
+    functions = []
+    for function in model.functions:
+        vector = VECTOR_COMPONENTS[function.__class__]()
+        #The parameter definitions and any other settings, eg. the rule of a HarvestControlRule
+        vector.__dict__.update(copy.deepcopy(function.__dict__))
+        functions.append(vector)
+
+    initial_state = copy.deepcopy(model.state)
+    initial_state.reset()
+    initial_state.materialise()
+    for att in initial_state:
+        initial_state[att] = [numpy.ones(size)*initial_state[att][0]]
+
+    return Model(functions = functions,initial_state = initial_state,parameters = {})
+
+def _split_states(model,columns,size):
+    '''
+    Split arrays of shape (time steps,size) by attribute into size states
+    shaped like the state of model
+    '''
+    outputs = []
+    for index in range(size):
+        state = copy.deepcopy(model.state)
+        state.reset()
+        state.set_derived({})
+        for att in columns:
+            state[att] = columns[att][:,index].tolist()
+        outputs.append(state)
+    return outputs
+
+def changed(previous,current,tolerance):
+    '''Whether each element changed by more than tolerance, relative to its size (see State.converged)'''
+    with numpy.errstate(invalid='ignore'):
+        same = (previous == current) | (numpy.isnan(previous) & numpy.isnan(current))
+        return ~same & ~(numpy.abs(current-previous) <= tolerance*numpy.maximum(numpy.abs(previous),numpy.abs(current)))
+
+def run_to_equilibrium(model,max_steps,constant_variable,attributes,tolerance=1e-9):
+    '''
+    Run a vectorised model at equilibrium until each element converges (as
+    fisheries_model.Model.run_to_equilibrium), for at most max_steps time steps
+    attributes: the attributes checked for convergence
+    tolerance: None to run max_steps time steps
+    Returns the state of each element at its equilibrium (a dict of arrays by
+    attribute), the number of time steps to each and whether each converged
+    '''
+    size = len(model.state[constant_variable][-1])
+    equilibrium = {}
+    iterations = numpy.ones(size,dtype=int)*max_steps
+    converged = numpy.zeros(size,dtype=bool)
+    for step in range(1,max_steps+1):
+        model.run(1,constant_variable = constant_variable)
+        if tolerance == None:
+            continue
+        done = ~converged
+        for att in attributes:
+            done &= ~changed(model.state[att][-2],model.state[att][-1],tolerance)
+        if done.any():
+            #Elements stop at the time step they converge
+            for att in model.state:
+                values = equilibrium.setdefault(att,numpy.zeros(size))
+                values[done] = (numpy.ones(size)*model.state[att][-1])[done]
+            iterations[done] = step
+            converged |= done
+            if converged.all():
+                break
+
+    for att in model.state:
+        last = numpy.ones(size)*model.state[att][-1]
+        equilibrium[att] = numpy.where(converged,equilibrium.get(att,last),last)
+    if tolerance == None:
+        converged[:] = True
+    return equilibrium,iterations,converged
+
+class EnsembleRun:
+    '''
+    A run of a model for several sets of parameter values at once, advanced
+    one time step (dynamic) or one independent value (static) of every set
+    per iteration, as fisheries_model.DynamicRun and StaticRun
+    With the continuation option the equilibria of each set are continued
+    from one independent value to the next, and found again from the initial
+    state, exactly as by StaticRun.
+    '''
+
+    def __init__(self,model,parameter_sets,steps,dynamic=True,independent_variable='effort',independent_minimum = 0,independent_maximum = None,convergence_time=20,tolerance=1e-9,continuation=True):
+        '''
+        Arguments are as for run_ensemble
+        '''
+        self.model = model
+        self.steps = steps
+        self.dynamic = dynamic
+        self.independent_variable = independent_variable
+        self.convergence_time = convergence_time
+        self.tolerance = tolerance
+        self.continuation = continuation
+        sets = len(parameter_sets)
+        self.sets = sets
+
+        scheduled = []
+        for parameter_set in parameter_sets:
+            for param,value in parameter_set.items():
+                if isinstance(value,Schedule) and param not in scheduled:
+                    scheduled.append(param)
+        if len(scheduled) > 0 and not dynamic:
+            raise ValueError('Parameter schedules need a dynamic run')
+
+        #One row of parameter values per set, one column per parameter
+        schema = model.get_schema()
+        vectors = numpy.array([schema.to_vector(dict([(param,value) for param,value in parameter_set.items()
+                                                      if param not in scheduled]))
+                               for parameter_set in parameter_sets])
+        parameters = dict(zip(schema.names,vectors.T))
+        #A schedule of one value per set at each time step
+        for param in scheduled:
+            parameters[param] = Schedule.batch([parameter_set.get(param,schema.parameters[param]['value'])
+                                                for parameter_set in parameter_sets],steps)
+
+        self.parameters = parameters
+        self.vector = ensembleModel(model,sets)
+        self.vector.set_parameters(parameters)
+        if dynamic:
+            return
+
+        #A static run is one element per parameter set, each iteration finds
+        #the equilibria of one independent value
+        if not hasattr(independent_maximum,'__len__'):
+            independent_maximum = [independent_maximum]*sets
+        self.values = numpy.array([numpy.linspace(independent_minimum,maximum,steps) for maximum in independent_maximum])
+        #Attributes derived in the model follow the others (the discounted profit changes with time)
+        derived = model.get_derived_columns()
+        self.attributes = [att for att in self.vector.state if att not in derived]
+        self.equilibria = dict([(att,numpy.zeros((sets,steps))) for att in self.vector.state])
+        self.iterations = numpy.zeros((sets,steps),dtype=int)
+        self.converged = numpy.zeros((sets,steps),dtype=bool)
+        self.restarted = numpy.zeros((sets,steps),dtype=bool)
+        #The initial state, and the equilibrium state to continue each set from
+        #where continued is set
+        self.initial = dict([(att,numpy.array(self.vector.state[att][0])) for att in self.attributes
+                             if att != independent_variable])
+        self.previous = self.initial
+        self.continued = numpy.zeros(sets,dtype=bool)
+        #The time steps of the last equilibrium of each set found from the initial state
+        self.cold_iterations = numpy.zeros(sets,dtype=int)
+
+    def _run_to_equilibrium(self,value,start,index=None):
+        '''
+        Run every set, or the sets of index, to the equilibria of independent
+        values from start (a dict of arrays of attribute values)
+        Returns as run_to_equilibrium
+        '''
+        vector = self.vector
+        if index is not None:
+            vector = ensembleModel(self.model,len(index))
+            vector.set_parameters(dict([(param,self.parameters[param][index]) for param in self.parameters]))
+            value = value[index]
+            start = dict([(att,start[att][index]) for att in start])
+        vector.reset()
+        for att in start:
+            vector.state[att] = [start[att]]
+        vector.state[self.independent_variable] = [value]
+        vector.parameters[self.independent_variable] = value
+        return run_to_equilibrium(vector,self.convergence_time,self.independent_variable,
+                                  self.attributes,self.tolerance)
+
+    def _collapsed(self,final,value):
+        '''Whether each stock collapsed or its independent value could not be reached'''
+        with numpy.errstate(invalid='ignore'):
+            return (final['biomass'] <= 0) | (final[self.independent_variable] < value)
+
+    def _jumped(self,final):
+        '''Whether each equilibrium biomass changed by more than CONTINUATION_JUMP from the previous one'''
+        previous = self.previous['biomass']
+        current = final['biomass']
+        with numpy.errstate(invalid='ignore'):
+            return numpy.abs(current-previous) > CONTINUATION_JUMP*numpy.maximum(numpy.abs(previous),numpy.abs(current))
+
+    def single_iteration(self,step):
+        '''Run a single time step, or find the equilibria of a single independent value'''
+        if self.dynamic:
+            self.vector.run(1)
+            return
+        value = self.values[:,step]
+        start = dict([(att,numpy.where(self.continued,self.previous[att],self.initial[att])) for att in self.initial])
+        final,iterations,converged = self._run_to_equilibrium(value,start)
+        collapsed = self._collapsed(final,value)
+        self.cold_iterations = numpy.where(self.continued,self.cold_iterations,iterations)
+
+        #Continued equilibria that are unreliable are found again from the initial state
+        restart = self.continued & (~converged | collapsed | (self._jumped(final) & (iterations > self.cold_iterations)))
+        if restart.any():
+            index = numpy.nonzero(restart)[0]
+            again,again_iterations,again_converged = self._run_to_equilibrium(value,self.initial,index)
+            for att in final:
+                final[att][index] = again[att]
+            self.cold_iterations[index] = again_iterations
+            iterations[index] += again_iterations
+            converged[index] = again_converged
+            collapsed = self._collapsed(final,value)
+        self.restarted[:,step] = restart
+
+        #The next value continues from these equilibria, unless they are unreliable
+        self.continued = self.continuation & converged & ~collapsed
+        self.previous = dict([(att,final[att]) for att in self.initial])
+
+        for att in final:
+            self.equilibria[att][:,step] = final[att]
+        self.iterations[:,step] = iterations
+        self.converged[:,step] = converged
+
+    def output(self):
+        '''Return a list of the output state of each parameter set'''
+        if self.dynamic:
+            columns = dict([(att,numpy.array(self.vector.state[att])) for att in self.vector.state])
+            return _split_states(self.model,columns,self.sets)
+
+        #As StaticRun marks the independent values that could not be reached
+        values = self.values
+        reached = self.equilibria[self.independent_variable]
+        previous = numpy.roll(values,1,axis=1)+1e-6
+        reached = numpy.where(reached < values,previous,reached)
+
+        #Prepend the initial state, as in the output of StaticRun
+        columns = {}
+        for att in self.equilibria:
+            initial = numpy.ones((self.sets,1))*self.model.state[att][0]
+            final = self.equilibria[att]
+            if att == self.independent_variable:
+                final = reached
+            columns[att] = numpy.hstack((initial,final)).T
+        outputs = _split_states(self.model,columns,self.sets)
+
+        #The convergence of each output, as StaticRun reports it
+        for index,state in enumerate(outputs):
+            state.convergence = {'iterations': self.iterations[index].tolist(),
+                                 'unconverged': values[index][~self.converged[index]].tolist(),
+                                 'restarts': values[index][self.restarted[index]].tolist()}
+        return outputs
+
+def run_ensemble(model,parameter_sets,steps,dynamic=True,independent_variable='effort',independent_minimum = 0,independent_maximum = None,convergence_time=20,tolerance=1e-9,continuation=True):
+    '''
+    Run a model for several sets of parameter values at once and return a list
+    of output states, the same as fisheries_model.run_model gives for each set
+    parameter_sets: a list of dicts of parameter values, in a dynamic run
+    values may be schedules (see fisheries_model.Schedule), eg. a TAC path per set
+    independent_maximum: a value, or a list of values with one per parameter set
+    Other arguments are as for fisheries_model.run_model, so a static run
+    continues each equilibrium from the previous one unless continuation=False
+    '''
+    run = EnsembleRun(model,parameter_sets,steps,dynamic,independent_variable,independent_minimum,
+                      independent_maximum,convergence_time,tolerance,continuation)
+    for step in range(0,steps):
+        run.single_iteration(step)
+    return run.output()
+
+class EnsembleJob:
+    '''A background run of several parameter sets at once (see fisheries_model.PrecomputeThread)'''
+
+    def __init__(self,keys,model,parameter_sets,steps,arguments,source='speculative'):
+        '''
+        keys: the cache key of each parameter set
+        Other arguments are as for run_ensemble
+        source: the source of the results in the cache
+        '''
+        self.keys = keys
+        self.model = model
+        self.parameter_sets = parameter_sets
+        self.steps = steps
+        self.arguments = arguments
+        self.source = source
+
+    def execute(self,should_continue):
+        '''Run the job and return a list of (key,output) or None if it should not continue'''
+        import time
+        run = EnsembleRun(self.model,self.parameter_sets,self.steps,**self.arguments)
+        for step in range(0,self.steps):
+            if not should_continue():
+                return None
+            run.single_iteration(step)
+            #Yield to the foreground threads
+            time.sleep(0)
+        return zip(self.keys,run.output())
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+'''
+Fisheries Explorer heterogeneous fleets
+A fleet of individual vessels, each with its own fixed and marginal cost,
+catchability and effort capacity, in place of the identical vessels of
+fisheries_model.Economics. The vessels are held as columns (one numpy array
+per attribute, one element per vessel) so a time step is a fixed number of
+array operations, with no Python loop over the vessels. Its cost still
+grows with the pool, as the profit of every vessel is found each time step
+the fleet may move (see benchmark_fleet.py).
+
+The fleet is a pool of vessels, of which some are active (fishing) and the
+others could enter the fishery. Each time step the total effort (set by the
+catch or effort control) is shared among the active vessels in proportion to
+their capacity, and the catch in proportion to their catchability times
+effort. The costs and profits follow from these shares, so they are found
+from the fleet totals and each vessel's attributes without allocating the
+effort and catch vessel by vessel. Vessels losing money leave and vessels
+that would make money if they joined enter, the most extreme first and at
+most movement_rate of each a time step (half of those that would at a time
+until none would at equilibrium).
+The number of active vessels and their total cost are kept in the model state
+as fleet_size and cost, so the fleet is plotted as the identical one is.
+
+Copyright 2010,2016 University of Tasmania, Australian Seafood CRC
+This program is released under the Open Software License ("OSL") v. 3.0. See OSL3.0.htm for details.
+'''
+
+import numpy
+
+import fisheries_model
+
+#The most rounds of entry and exit of an equilibrium time step
+EQUILIBRIUM_ROUNDS = 64
+
+class Vessels:
+    '''
+    The attributes of a pool of vessels, as arrays
+    Costs are multiples of the fixed_cost and marginal_cost parameters, the
+    catchability and capacity are relative to the average vessel.
+    '''
+
+    def __init__(self,fixed_cost,marginal_cost,catchability,capacity):
+        self.fixed_cost = numpy.asarray(fixed_cost,dtype=float)
+        self.marginal_cost = numpy.asarray(marginal_cost,dtype=float)
+        self.catchability = numpy.asarray(catchability,dtype=float)
+        self.capacity = numpy.asarray(capacity,dtype=float)
+        #The share of the catch and of the marginal cost of each vessel is in
+        #proportion to these (with the effort shared by capacity)
+        self.fishing_power = self.capacity*self.catchability
+        self.effort_cost = self.capacity*self.marginal_cost
+        #The columns summed over the active vessels (see totals)
+        self.columns = numpy.vstack((self.capacity,self.fishing_power,self.effort_cost,self.fixed_cost))
+
+    def __len__(self):
+        return len(self.capacity)
+
+    def totals(self,vessels):
+        '''
+        Return the total capacity, fishing power, effort cost and fixed cost
+        (an array) of some of the vessels (indices or a mask)
+        '''
+        return self.columns[:,vessels].sum(axis=1)
+
+    @staticmethod
+    def generate(count,spread=0.2,generator=None):
+        '''
+        Return a pool of count vessels, each attribute lognormal with a mean
+        of 1 and a standard deviation (of its logarithm) of spread
+        generator: the numpy RandomState of the attributes
+        '''
+        if generator == None:
+            generator = numpy.random.RandomState()
+        attributes = [numpy.exp(generator.normal(-spread**2/2,spread,count)) for i in range(4)]
+        return Vessels(*attributes)
+
+class VesselFleet(fisheries_model.Economics):
+    '''
+    Economics and fleet dynamics of a heterogeneous fleet (see the module)
+    The fleet_size of the state is the number of active vessels. The active
+    vessels are kept from one time step to the next; when the state does not
+    follow on from the last time step run (eg. it was reset) the first
+    fleet_size vessels of the pool are active.
+    The columns of the pool are kept in an order with the active vessels
+    first, so the profits of the active vessels and of the others joining
+    are each found over their own part of the pool only. Vessels moving are
+    swapped between the parts, and the totals of the active vessels (see
+    Vessels.totals) are kept as they move rather than summed every time step.
+    '''
+
+    def __init__(self,vessels):
+        '''vessels: the pool of Vessels'''
+        fisheries_model.Economics.__init__(self)
+        self.vessels = vessels
+        self._order(0)
+        #The time step the active vessels are of
+        self.time = None
+
+    def _order(self,fleet_size):
+        '''Make the first fleet_size vessels of the pool the active ones'''
+        #The pool index of each position, and the columns (see Vessels.columns) in that order
+        self.order = numpy.arange(len(self.vessels))
+        self.columns = self.vessels.columns.copy()
+        self.count = min(max(fleet_size,0),len(self.vessels))
+        self.totals = self.columns[:,:self.count].sum(axis=1)
+
+    def active(self):
+        '''Return the pool indices of the active vessels'''
+        return self.order[:self.count]
+
+    def get_derived_columns(self):
+        #The cost is the sum over the vessels, it is stored
+        return {'revenue': fisheries_model.revenue_column,
+                'profit': fisheries_model.profit_column,
+                'discounted_profit': fisheries_model.discounted_profit_column}
+
+    def profits(self,effort,catch,parameters):
+        '''
+        Return the profit of each active vessel and of each of the others if
+        it joined them, in the order of the positions of each
+        '''
+        capacity,power = self.totals[:2]
+        revenue = catch*parameters['beach_price']
+        marginal = effort*parameters['marginal_cost']
+        fixed_cost = parameters['fixed_cost']
+        columns = self.columns
+        n = self.count
+
+        if capacity > 0:
+            active = (revenue/power)*columns[1,:n]-(marginal/capacity)*columns[2,:n]-fixed_cost*columns[3,:n]
+        else:
+            active = numpy.zeros(0)
+        #A vessel joining takes its share of the effort, and of the catch, from the others
+        with numpy.errstate(invalid='ignore'):
+            joining = revenue*columns[1,n:]/(power+columns[1,n:])-\
+                      marginal*columns[2,n:]/(capacity+columns[0,n:])-fixed_cost*columns[3,n:]
+        return active,joining
+
+    @staticmethod
+    def _extremes(indices,values,count):
+        '''Return the count indices with the lowest values (all of them if there are fewer)'''
+        if len(indices) <= count:
+            return indices
+        return indices[numpy.argpartition(values[indices],count-1)[:count]]
+
+    def _swap(self,a,b):
+        '''Swap the vessels at the positions a and b (arrays of positions)'''
+        if len(a) == 0:
+            return
+        positions = numpy.concatenate((a,b))
+        swapped = numpy.concatenate((b,a))
+        self.order[positions] = self.order[swapped]
+        self.columns[:,positions] = self.columns[:,swapped]
+
+    def move(self,profits,limit):
+        '''
+        Remove up to limit of the active vessels losing the most money, and add
+        up to limit of the others that would make the most
+        profits: the profits of the active vessels and of the others (see profits)
+        limit: the most of each, None for half of those that would (at least 1)
+        Returns the number of vessels that moved
+        '''
+        active,joining = profits
+        n = self.count
+        leaving = numpy.flatnonzero(active < 0)
+        entering = numpy.flatnonzero(joining > 0)
+        if limit == None:
+            leaving = self._extremes(leaving,active,(len(leaving)+1)//2)
+            entering = self._extremes(entering,-joining,(len(entering)+1)//2)
+        else:
+            leaving = self._extremes(leaving,active,limit)
+            entering = self._extremes(entering,-joining,limit)
+        entering = entering+n
+        if len(leaving)+len(entering) == 0:
+            return 0
+        self.totals = self.totals-self.columns[:,leaving].sum(axis=1)+self.columns[:,entering].sum(axis=1)
+
+        #Vessels leaving and entering change places, the rest of either are
+        #swapped with the vessels at the new boundary of the active part
+        pairs = min(len(leaving),len(entering))
+        self._swap(leaving[:pairs],entering[:pairs])
+        leaving = numpy.sort(leaving[pairs:])
+        entering = numpy.sort(entering[pairs:])
+        count = n-len(leaving)+len(entering)
+        if len(leaving) > 0:
+            boundary = numpy.arange(count,n)
+            self._swap(leaving[leaving < count],boundary[~numpy.in1d(boundary,leaving)])
+        if len(entering) > 0:
+            boundary = numpy.arange(n,count)
+            self._swap(entering[entering >= count],boundary[~numpy.in1d(boundary,entering)])
+        self.count = count
+        if count == 0:
+            #No rounding left over from the vessels that moved
+            self.totals = numpy.zeros(len(self.totals))
+        return pairs*2+len(leaving)+len(entering)
+
+    def execute(self,state,parameters,equilibrium=False):
+        effort = state.get('effort')
+        catch = state.get('catch')
+        #The fleet at the start of the time step
+        fleet_size = int(round(state.get('fleet_size')))
+        if self.time != state.time()-1 or self.count != fleet_size:
+            self._order(fleet_size)
+
+        #Adjust the fleet
+        if parameters['movement_rate'] > 0:
+            if equilibrium:
+                for attempt in range(EQUILIBRIUM_ROUNDS):
+                    if self.move(self.profits(effort,catch,parameters),None) == 0:
+                        break
+            else:
+                self.move(self.profits(effort,catch,parameters),int(parameters['movement_rate']))
+
+        capacity,power,effort_cost,fixed_cost = self.totals
+        cost = parameters['fixed_cost']*fixed_cost
+        if capacity > 0:
+            cost += parameters['marginal_cost']*effort*effort_cost/capacity
+        state.set(fleet_size=float(self.count),cost=cost)
+        self.time = state.time()
+        return state
+
+def heterogeneousModel(name='lobster',control_type='catch',vessels=None,spread=0.2,seed=0):
+    '''
+    Return a model (a name of fisheries_model.MODEL_FACTORIES) with a
+    heterogeneous fleet in place of its identical vessels, with the same
+    parameters (the fixed and marginal costs are of the average vessel)
+    vessels: the pool of Vessels, by default ten times the initial fleet
+    generated with the spread and seed (see Vessels.generate)
+    The model can not be serialized (it has no factory).
+    '''
+    model = fisheries_model.MODEL_FACTORIES[name](control_type = control_type)
+    state = model.state
+    if vessels == None:
+        vessels = Vessels.generate(int(10*state.get('fleet_size')),spread,numpy.random.RandomState(seed))
+    functions = []
+    for function in model.functions:
+        if isinstance(function,fisheries_model.Economics):
+            fleet = VesselFleet(vessels)
+            for param,value in function.get_parameters().items():
+                setattr(fleet,param,value)
+            functions.append(fleet)
+        else:
+            functions.append(function)
+    #The cost is stored rather than derived
+    state['cost'] = [numpy.nan]*state.steps()
+    return fisheries_model.Model(functions = functions,initial_state = state)